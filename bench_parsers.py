@@ -0,0 +1,256 @@
+"""
+Микробенчмарки парсеров этапов на сохранённых страницах.
+
+    python bench_parsers.py                  # замер и сравнение с базой
+    python bench_parsers.py update           # записать текущие числа как базу
+    python bench_parsers.py fixtures         # пересоздать шаблонные страницы
+    python bench_parsers.py stage7 stage11   # только указанные этапы
+
+Корпус — BENCH_DIR/<этап>/*.html: шаблоны fake_zapo.py крупного размера, обёрнутые
+в меню и подвал сайта до MIN_PAGE_BYTES; туда же можно положить настоящие страницы
+(например, из http_cache). Для каждого экстрактора пишутся страниц/с (лучший из
+ROUNDS проходов, каждый не короче MIN_ROUND_SECONDS) и пик памяти на страницу
+по tracemalloc.
+Скорость сравнивается не в абсолютных числах, а относительно калибровочного
+разбора (calibrate), проходы которого чередуются с проходами экстрактора в том же
+процессе: база переносима между машинами. Если относительная скорость упала или
+память выросла больше чем на THRESHOLD относительно BASELINE_FILE, а также если
+экстрактор не импортируется, код выхода — 1.
+Корпус генерируется и в git не хранится, база (BASELINE_FILE) — хранится:
+после update её нужно закоммитить.
+"""
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from fake_zapo import (
+    Catalog, brand_page, carbase_brand_page, catalog_page, data_table_page, modification_page,
+    models_page, site_page, version_page,
+)
+from loadtest import isolate_network
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(ROOT, "bench_fixtures")
+BASELINE_FILE = os.path.join(ROOT, "bench_baseline.json")
+FIXTURE_PAGES = 10
+ROUNDS = 7
+MIN_ROUND_SECONDS = 0.5  # короткий проход слишком шумный — корпус повторяется до этого времени
+# Допуск к базе. Отношение к калибровке убирает разницу в скорости машины, но не в кешах
+# процессора и версиях библиотек: на загруженной машине оно гуляет в пределах ~20 %
+THRESHOLD = 0.3
+# Реальные страницы зеркал — 60–150 КБ, в основном меню, подвал и скрипты вокруг данных
+MIN_PAGE_BYTES = 64 * 1024
+BASE_URL = "https://zapo.ru"
+
+# Страницы тяжелее реальных средних: парсер должен упираться в CPU, а не в накладные расходы
+CATALOG = Catalog(
+    models=30, versions=8, modifications=40, parts=600, table_rows=100, table_pages=10,
+    filter_keys=12, filter_values=15,
+)
+
+FIXTURES = {
+    "stage2": lambda n: brand_page(BASE_URL, n),
+    "stage3": lambda n: site_page(n, contacts=n % 2 == 1),
+    "stage5": lambda n: carbase_brand_page(CATALOG, n),
+    "stage6": lambda n: version_page(CATALOG, n, 0, 0),
+    "stage7": lambda n: modification_page(CATALOG, f"/mod/{n}/0/0/0"),
+    "stage10": lambda n: models_page(CATALOG, "CARS_FOREIGN", str(n)),
+    "stage11": lambda n: data_table_page(CATALOG, str(n), "0", 1 + n % CATALOG.table_pages),
+    "stage13": lambda n: catalog_page(CATALOG, str(1000 + n), {}),
+}
+
+# Обвязка сайта: ссылки и текст без цифр, почт и слова «Сайт» — экстракторы в ней ничего не находят
+_CHROME_WORDS = ("Каталог", "Запчасти", "Доставка", "Оплата", "Новости", "Гарантия", "Помощь", "Акции")
+_CHROME_SCRIPT = "<script>window.dataLayer = window.dataLayer || []; function track(e) { dataLayer.push(e); }</script>"
+
+def with_site_chrome(html: str, min_bytes: int = MIN_PAGE_BYTES) -> str:
+    """Дополнить шаблон меню и подвалом сайта до min_bytes."""
+    size = len(html.encode("utf-8"))
+    items = []
+    while size < min_bytes:
+        word = _CHROME_WORDS[len(items) % len(_CHROME_WORDS)]
+        slug = "-".join(_CHROME_WORDS[(len(items) + k) % len(_CHROME_WORDS)].lower() for k in range(3))
+        item = (
+            f'<li class="site-menu__item"><a class="site-menu__link" href="/section/{slug}/">{word}</a>'
+            f'<span class="site-menu__hint">{word} — раздел {slug.replace("-", " ")}</span>{_CHROME_SCRIPT}</li>'
+        )
+        items.append(item)
+        size += len(item.encode("utf-8"))
+    half = len(items) // 2
+    header = f'<header class="site-header"><ul class="site-menu">{"".join(items[:half])}</ul></header>'
+    footer = f'<footer class="site-footer"><ul class="site-menu">{"".join(items[half:])}</ul></footer>'
+    head, _, rest = html.partition("<body>")
+    body, _, tail = rest.rpartition("</body>")
+    return f"{head}<body>{header}{body}{footer}</body>{tail}"
+
+# Экстракторы получают Page — так же, как в этапах после загрузки
+def _stage11_extract(module, page):
+    soup = page.soup()
+    return module.extract_rows(soup), module.get_pages_total(soup), module.extract_expected_modifications(soup)
+
+EXTRACTORS = {
+    "stage2": ("stage2_contacts_scraper", "extract_company_site", lambda m, page: m.extract_company_site(page.text)),
+    "stage3": ("stage3_contacts_scraper", "extract_contacts", lambda m, page: m.extract_contacts(page.text)),
+    "stage5": ("stage5_carbase_scraper", "extract_models_and_versions",
+               lambda m, page: m.extract_models_and_versions(page, "Brand", page.url)),
+    "stage6": ("stage6_parse_modifications", "extract_version_details", lambda m, page: m.extract_version_details(page)),
+    "stage7": ("stage7_parse_parts", "extract_parts", lambda m, page: m.extract_parts(page)),
+    "stage10": ("stage10_parse_models", "extract_models", lambda m, page: m.extract_models(page)),
+    "stage11": ("stage11_parse_modification_table", "extract_rows", _stage11_extract),
+    "stage13": ("stage13_catalog_sitemaps", "parse_filters", lambda m, page: m.parse_filters(page)),
+}
+
+def write_fixtures(names):
+    for name in names:
+        folder = os.path.join(BENCH_DIR, name)
+        os.makedirs(folder, exist_ok=True)
+        for n in range(FIXTURE_PAGES):
+            with open(os.path.join(folder, f"template_{n:02d}.html"), "w", encoding="utf-8") as f:
+                f.write(with_site_chrome(FIXTURES[name](n)))
+
+def load_pages(name: str) -> list:
+    from utils import Page
+
+    folder = os.path.join(BENCH_DIR, name)
+    if not os.path.isdir(folder) or not os.listdir(folder):
+        write_fixtures([name])
+    pages = []
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith(".html"):
+            with open(os.path.join(folder, file_name), "rb") as f:
+                url = f"{BASE_URL}/{name}/{file_name}"
+                pages.append(Page(url, 200, f.read(), "utf-8", {}, url))
+    return pages
+
+def round_rate(run, items: list) -> float:
+    """Вызовов run в секунду за один проход по items (не короче MIN_ROUND_SECONDS)."""
+    done = 0
+    started = time.perf_counter()
+    while True:
+        for item in items:
+            run(item)
+        done += len(items)
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_ROUND_SECONDS:
+            return done / elapsed
+
+# Калибровка: тот же html.parser и CSS-селекторы, что у экстракторов, на неизменной странице
+_CALIBRATION_HTML = "".join(
+    f'<div class="row"><a href="/item/{i}">Позиция {i}</a><span class="price">{i * 10}</span></div>' for i in range(300)
+)
+
+def calibrate(html: str = _CALIBRATION_HTML) -> int:
+    """Эталонный разбор — мерило скорости этой машины."""
+    from bs4 import BeautifulSoup
+
+    return len(BeautifulSoup(html, "html.parser").select("div.row > a"))
+
+def measure(extract, pages: list) -> dict:
+    """
+    Страниц/с по лучшему проходу, медиана их отношения к калибровке и пик памяти одной
+    страницы. Проходы калибровки и экстрактора чередуются: скорость машины плавает и
+    внутри одного запуска, а соседние проходы попадают в одни и те же условия.
+    """
+    for page in pages:
+        extract(page)  # прогрев: импорты, кеши селекторов
+    calibrate()
+    rates, ratios = [], []
+    for _ in range(ROUNDS):
+        calibration = round_rate(calibrate, [_CALIBRATION_HTML])
+        rates.append(round_rate(extract, pages))
+        ratios.append(rates[-1] / calibration)
+    best = max(rates)
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for page in pages:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            extract(page)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return {
+        "pages": len(pages),
+        "pages_per_s": best,
+        "relative": statistics.median(ratios),
+        "peak_kb": max(peaks) / 1024,
+        "avg_peak_kb": sum(peaks) / len(peaks) / 1024,
+        "bytes": sum(len(page.content) for page in pages),
+    }
+
+def regressions(name: str, result: dict, baseline: dict) -> list[str]:
+    base = baseline.get(name)
+    if not base or "relative" not in base:
+        return ["нет базы — запустите update"]
+    problems = []
+    if result["relative"] < base["relative"] * (1 - THRESHOLD):
+        expected = base["relative"] * result["pages_per_s"] / result["relative"]
+        problems.append(f"скорость {result['pages_per_s']:.1f} < {expected:.1f} стр/с (с поправкой на калибровку)")
+    if result["peak_kb"] > base["peak_kb"] * (1 + THRESHOLD):
+        problems.append(f"память {result['peak_kb']:.0f} > {base['peak_kb']:.0f} КБ/стр")
+    return problems
+
+def main():
+    args = sys.argv[1:]
+    command = args.pop(0) if args and args[0] in ("update", "fixtures") else None
+    names = args or list(EXTRACTORS)
+    unknown = [name for name in names if name not in EXTRACTORS]
+    if unknown:
+        print(f"❌ Неизвестные этапы: {', '.join(unknown)}; доступны: {', '.join(EXTRACTORS)}")
+        sys.exit(2)
+    if command == "fixtures":
+        write_fixtures(names)
+        print(f"📁 Страницы записаны в {BENCH_DIR}")
+        return
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r", encoding="utf-8") as f:
+            # Записи старого формата (без relative) не с чем сравнивать
+            baseline = {name: base for name, base in json.load(f).items() if "relative" in base}
+
+    # Этапы при импорте создают каталоги и открывают пул прокси — пусть делают это во временном каталоге
+    os.environ.pop("PROXY_API_KEY", None)
+    os.chdir(tempfile.mkdtemp(prefix="zapo_bench_"))
+    isolate_network()
+
+    results, failed = {}, []
+    for name in names:
+        module_name, function, extract = EXTRACTORS[name]
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            # Непроверенный экстрактор — такой же провал, как регрессия
+            print(f"❌ {name}.{function}: не импортируется — {e}")
+            failed.append(f"{name}: {e}")
+            continue
+        pages = load_pages(name)
+        result = measure(lambda page: extract(module, page), pages)
+        results[name] = result
+        problems = regressions(name, result, baseline) if command != "update" else []
+        mark = "❌" if problems else "✅"
+        base = baseline.get(name)
+        delta = f" ({result['relative'] / base['relative'] - 1:+.0%})" if base else ""
+        print(
+            f"{mark} {name}.{function:<28} {result['pages_per_s']:>9.1f} стр/с{delta:<8}"
+            f" пик {result['peak_kb']:>7.0f} КБ/стр, {result['pages']} стр по {result['bytes'] // result['pages'] // 1024} КБ"
+        )
+        for problem in problems:
+            print(f"     ↳ регрессия: {problem}")
+        failed.extend(problems)
+
+    if command == "update":
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump({**baseline, **results}, f, indent=2, ensure_ascii=False)
+        print(f"💾 База обновлена: {BASELINE_FILE}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
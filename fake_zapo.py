@@ -0,0 +1,486 @@
+"""
+Локальная подделка zapo.ru и SOCKS5-прокси для нагрузочных прогонов.
+
+    python fake_zapo.py
+
+Сервер отдаёт шаблонные (или записанные в RECORDED_DIR) страницы под селекторы
+этапов: /brandslist, /carbase, страницы версий и модификаций, auto2dV2,
+таблицу dataTable с пагинацией и *_catalog с getFilters. Задержка, ошибки,
+блокировки, «Превышен лимит» и обрезанные ответы задаются Faults.
+FakeSocks — минимальный SOCKS5 (CONNECT без авторизации), пускает только на
+локальные адреса. Модуль не зависит от utils, поэтому его можно поднять до
+импорта этапов (см. loadtest.py).
+"""
+import json
+import os
+import random
+import re
+import select
+import socket
+import socketserver
+import struct
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import NamedTuple
+from urllib.parse import parse_qs, quote, urlsplit
+
+HOST = "127.0.0.1"
+PORT = 8765
+SOCKS_PORT = 9050
+SOCKS_COUNT = 4
+RECORDED_DIR = None  # каталог с записанными страницами: имя файла — quote(путь?запрос, safe="")
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+
+class Faults(NamedTuple):
+    """Доли ответов с неисправностью (0..1) и задержка ответа в секундах."""
+    latency: float = 0.02
+    jitter: float = 0.02
+    error_rate: float = 0.0      # 500 Internal Server Error
+    block_rate: float = 0.0      # 403 Access Denied
+    challenge_rate: float = 0.0  # антибот-заглушка
+    soft_block_rate: float = 0.0  # 200 без разметки сайта
+    truncate_rate: float = 0.0   # ответ обрывается на середине
+    limit_after: int | None = None  # после стольких запросов к хосту — «Превышен лимит»
+    seed: int | None = None
+
+class Catalog(NamedTuple):
+    """Размер шаблонного каталога."""
+    brands: int = 20
+    models: int = 4
+    versions: int = 3
+    modifications: int = 4
+    parts: int = 40
+    table_rows: int = 25
+    table_pages: int = 3
+    groups: int = 3
+    filter_keys: int = 3
+    filter_values: int = 4
+
+CATALOG_TYPES = ("CARS_FOREIGN", "CARS_NATIVE", "MOTORCYCLE")
+
+# === Шаблоны ===
+def _html(title: str, body: str) -> str:
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title></head>'
+        f'<body><div class="fr-container">{body}</div></body></html>'
+    )
+
+BLOCK_PAGE = "<html><head><title>Access Denied</title></head><body>Access denied to this resource</body></html>"
+CHALLENGE_PAGE = "<html><body><script>window.location.href='/check'</script>Please enable Javascript</body></html>"
+LIMIT_PAGE = _html("Ошибка", "<p>Превышен лимит запросов в день</p>")
+SOFT_BLOCK_PAGE = "<html><body></body></html>"
+
+def brandslist_page(catalog: Catalog) -> str:
+    items = "".join(
+        f'<li class="inline"><a href="/brand/{b}">Brand {b}</a></li>' for b in range(catalog.brands)
+    )
+    return _html("Бренды", f"<ul>{items}</ul>")
+
+def brand_page(base: str, brand: int) -> str:
+    return _html(f"Brand {brand}", (
+        f'<div class="getBrandFullInfoContent"><b>Сайт:</b> '
+        f'<a href="{base}/site/{brand}/">brand{brand}.example</a></div>'
+    ))
+
+def site_page(brand: int, contacts: bool) -> str:
+    if contacts:
+        return _html("Контакты", f"<p>Email: sales{brand}@brand{brand}.example</p><p>Тел.: +7 495 123-45-{brand % 100:02d}</p>")
+    return _html(f"Brand {brand}", f'<a href="contacts/">Контакты</a><p>info{brand}@brand{brand}.example</p>')
+
+def carbase_page(catalog: Catalog) -> str:
+    items = "".join(
+        f'<div class="carbase3Brands__brand"><a href="/carbase/{b}">Brand {b}</a></div>' for b in range(catalog.brands)
+    )
+    return _html("Автокаталог", items)
+
+def carbase_brand_page(catalog: Catalog, brand: int) -> str:
+    groups = "".join(
+        f'<a class="carbase3Models__groups__name" href="#group_{m}">Model {m}</a>' for m in range(catalog.models)
+    )
+    wrappers = []
+    for m in range(catalog.models):
+        tiles = "".join(
+            f'<a class="carbase3Models__tile" href="/carbase/{brand}/{m}/{v}">'
+            f'<img src="//img.example/{brand}/{m}/{v}.jpg">'
+            f'<div class="carbase3Models__tile__name">Version {v}</div>'
+            f'<div class="carbase3Models__tile__text"><span>Годы:</span><span>{2000 + v} - {2005 + v}</span></div></a>'
+            for v in range(catalog.versions)
+        )
+        wrappers.append(f'<div class="carbase3Models__models__tiles__wrapper" id="group_{m}">{tiles}</div>')
+    return _html(f"Brand {brand}", groups + "".join(wrappers))
+
+def version_page(catalog: Catalog, brand: int, model: int, version: int) -> str:
+    rows = "".join(
+        f"<tr onclick=\"location.href='/mod/{brand}/{model}/{version}/{n}'\">"
+        f"<td>{1.4 + n / 10:.1f} MT</td><td>2001-2005</td><td>Бензин</td><td>{75 + n * 10}</td>"
+        f"<td>E{n}X</td><td>{1400 + n * 100}</td></tr>"
+        for n in range(catalog.modifications)
+    )
+    return _html(f"Version {version}", f"<table>{rows}</table>")
+
+def modification_page(catalog: Catalog, path: str) -> str:
+    rows = "".join(
+        f'<tr data-goodsgroup="#{1000 + p}"><td><img src="//img.example/part/{p}.jpg"></td>'
+        f'<td><b>Part {p}</b></td><td><a href="/{1000 + p}_catalog">Group {p % 7}</a></td>'
+        f'<td><a class="fr-btn-primary" href="/search?part={p}&amp;mod={quote(path)}">Найти</a></td></tr>'
+        for p in range(catalog.parts)
+    )
+    return _html("Запчасти", f"<table>{rows}</table>")
+
+def marks_page(catalog: Catalog, type_catalog: str) -> str:
+    items = "".join(
+        f'<a class="catalogAuto2dMarkLink" href="/auto2dV2/?action=models&typeCatalog={type_catalog}&mark={b}">'
+        f'<img src="//img.example/mark/{b}.png"><span class="catalogAuto2dMarkName">Mark {b}</span></a>'
+        for b in range(catalog.brands)
+    )
+    return _html("Марки", items)
+
+def models_page(catalog: Catalog, type_catalog: str, mark: str) -> str:
+    items = "".join(
+        f'<div class="productTile"><a class="goodDescriptionLink" '
+        f'href="/auto2dV2/?action=modifications&typeCatalog={type_catalog}&mark={mark}&model={m}">'
+        f'<img class="goodDescriptionImg" src="//img.example/model/{m}.png">'
+        f'<span class="goodDescriptionName">Model {m}</span></a></div>'
+        for m in range(catalog.models)
+    )
+    return _html("Модели", items)
+
+def data_table_page(catalog: Catalog, mark: str, model: str, page: int) -> str:
+    total = catalog.table_rows * catalog.table_pages
+    rows = "".join(
+        f'<tr><td><a href="/auto2dV2/?action=parts&mark={mark}&model={model}&mod={n}">Mod {n}</a></td>'
+        f"<td>2010</td><td>—</td><td>AT</td><td>JP</td><td>Описание {n}</td></tr>"
+        for n in range((page - 1) * catalog.table_rows, page * catalog.table_rows)
+    )
+    pages = "".join(
+        f'<li><a class="pageNumber selectFilterPage" href="#">{p}</a></li>' for p in range(1, catalog.table_pages + 1)
+    )
+    return _html("Модификации", (
+        f"<div>Модификаций: {total}</div>"
+        f'<table id="dataTable"><thead><tr><th>Модель</th></tr></thead><tbody>{rows}</tbody></table>'
+        f'<ul class="fr-pagination">{pages}</ul>'
+    ))
+
+def filter_values(catalog: Catalog) -> dict[str, list[str]]:
+    return {f"k{k}": [f"v{k}{v}" for v in range(catalog.filter_values)] for k in range(catalog.filter_keys)}
+
+def catalog_page(catalog: Catalog, group: str, query: dict) -> str:
+    if query.get("action") == ["search"]:
+        selected = sorted(v for k, vs in query.items() if k.startswith("property[") for v in vs)
+        # Каждый третий набор фильтров «пустой» — чтобы проверке ссылок было что отсеивать
+        if zlib.crc32("&".join(selected).encode()) % 3 == 0:
+            return _html("Каталог", '<div class="fr-alert fr-alert-warning">Товаров с указанными параметрами не найдено</div>')
+        return _html("Каталог", f'<div class="goods">Группа {group}: {len(selected)} фильтров</div>')
+    boxes = "".join(
+        f'<input type="checkbox" name="property[{key}][]" value="{value}">'
+        for key, values in filter_values(catalog).items() for value in values
+    )
+    return _html("Каталог", f'<form id="catalog-form">{boxes}</form>')
+
+def filters_json(catalog: Catalog, query: dict) -> str:
+    excluded = (query.get("excluded") or [""])[0]
+    values = filter_values(catalog)
+    return json.dumps({excluded: values.get(excluded, [])} if excluded else values)
+
+# === HTTP ===
+class Stats:
+    """Счётчики сервера: запросы, уникальные адреса, исходы и задержки ответов."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.outcomes: Counter = Counter()
+            self.hosts: Counter = Counter()
+            self.paths: set[str] = set()
+            self.latencies: list[float] = []
+            self.started = time.monotonic()
+
+    def record(self, host: str, path: str, outcome: str, latency: float) -> int:
+        with self._lock:
+            self.requests += 1
+            self.hosts[host] += 1
+            self.outcomes[outcome] += 1
+            self.paths.add(path)
+            self.latencies.append(latency)
+            return self.hosts[host]
+
+    def served(self, host: str) -> int:
+        with self._lock:
+            return self.hosts[host]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "unique": len(self.paths),
+                "outcomes": dict(self.outcomes),
+                "hosts": dict(self.hosts),
+                "latencies": list(self.latencies),
+                "elapsed": time.monotonic() - self.started,
+            }
+
+class FakeZapoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server: FakeZapoServer = self.server
+        started = time.monotonic()
+        host = (self.headers.get("Host") or "").lower()
+        outcome, status, body, content_type = server.respond(host, self.path)
+        delay = server.faults.latency + server.random() * server.faults.jitter
+        if delay > 0:
+            time.sleep(delay)
+
+        data = body.encode(server.encoding)
+        truncated = outcome == "truncated"
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset={server.encoding}")
+        if truncated:
+            # Обрыв соединения: заголовок обещает больше, чем придёт
+            self.send_header("Content-Length", str(len(data)))
+            data = data[: len(data) // 2]
+            self.close_connection = True
+        else:
+            self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except OSError:
+            outcome = "disconnected"
+        server.stats.record(host, self.path, outcome, time.monotonic() - started)
+
+class FakeZapoServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address=(HOST, PORT), *, faults: Faults = Faults(), catalog: Catalog = Catalog(),
+                 recorded_dir: str | None = RECORDED_DIR, encoding: str = "utf-8"):
+        super().__init__(address, FakeZapoHandler)
+        self.faults = faults
+        self.catalog = catalog
+        self.recorded_dir = recorded_dir
+        self.encoding = encoding
+        self.stats = Stats()
+        self._random = random.Random(faults.seed)
+        self._random_lock = Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def random(self) -> float:
+        with self._random_lock:
+            return self._random.random()
+
+    def respond(self, host: str, path: str) -> tuple[str, int, str, str]:
+        """(исход, статус, тело, тип) для запроса с учётом неисправностей."""
+        faults = self.faults
+        if faults.limit_after is not None and self.stats.served(host) >= faults.limit_after:
+            return "limited", 200, LIMIT_PAGE, "text/html"
+        roll = self.random()
+        for outcome, rate, status, body in (
+            ("error", faults.error_rate, 500, "Internal Server Error"),
+            ("blocked", faults.block_rate, 403, BLOCK_PAGE),
+            ("challenge", faults.challenge_rate, 200, CHALLENGE_PAGE),
+            ("soft_blocked", faults.soft_block_rate, 200, SOFT_BLOCK_PAGE),
+        ):
+            if roll < rate:
+                return outcome, status, body, "text/html"
+            roll -= rate
+
+        page = self.page(f"http://{host}", path)
+        if page is None:
+            return "missing", 404, _html("404", "Страница не найдена"), "text/html"
+        body, content_type = page
+        if roll < faults.truncate_rate:
+            return "truncated", 200, body, content_type
+        return "ok", 200, body, content_type
+
+    def page(self, base: str, path: str) -> tuple[str, str] | None:
+        """Записанная или шаблонная страница по пути; None — 404."""
+        if self.recorded_dir:
+            recorded = os.path.join(self.recorded_dir, quote(path, safe=""))
+            if os.path.exists(recorded):
+                with open(recorded, "r", encoding="utf-8") as f:
+                    return f.read(), "text/html"
+
+        catalog = self.catalog
+        parts = urlsplit(path)
+        query = parse_qs(parts.query)
+        segments = [s for s in parts.path.split("/") if s]
+        ints = [int(s) for s in segments[1:] if s.isdigit()]
+
+        if segments == ["brandslist"]:
+            return brandslist_page(catalog), "text/html"
+        if segments[:1] == ["brand"] and len(ints) == 1 and ints[0] < catalog.brands:
+            return brand_page(base, ints[0]), "text/html"
+        if segments[:1] == ["site"] and ints:
+            return site_page(ints[0], segments[-1] == "contacts"), "text/html"
+        if segments == ["carbase"]:
+            return carbase_page(catalog), "text/html"
+        if segments[:1] == ["carbase"] and len(ints) == 1 and ints[0] < catalog.brands:
+            return carbase_brand_page(catalog, ints[0]), "text/html"
+        if segments[:1] == ["carbase"] and len(ints) == 3:
+            return version_page(catalog, *ints), "text/html"
+        if segments[:1] == ["mod"] and len(ints) == 4:
+            return modification_page(catalog, parts.path), "text/html"
+        if segments == ["auto2dV2"]:
+            action = (query.get("action") or [""])[0]
+            type_catalog = (query.get("typeCatalog") or [CATALOG_TYPES[0]])[0]
+            mark = (query.get("mark") or ["0"])[0]
+            if action == "marks":
+                return marks_page(catalog, type_catalog), "text/html"
+            if action == "models":
+                return models_page(catalog, type_catalog, mark), "text/html"
+            if action == "modifications":
+                page = int((query.get("page") or ["1"])[0])
+                return data_table_page(catalog, mark, (query.get("model") or ["0"])[0], page), "text/html"
+        match = re.fullmatch(r"(\d+)_catalog", segments[0]) if len(segments) == 1 else None
+        if match:
+            if query.get("action") == ["goods_catalog/goods_catalog/getFilters"]:
+                return filters_json(catalog, query), "application/json"
+            return catalog_page(catalog, match.group(1), query), "text/html"
+        return None
+
+def start_fake_zapo(address=(HOST, 0), **kwargs) -> FakeZapoServer:
+    """Поднять сервер в фоновом потоке (порт 0 — любой свободный)."""
+    server = FakeZapoServer(address, **kwargs)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# === SOCKS5 ===
+class FakeSocksHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server: FakeSocks = self.server
+        client = self.request
+        try:
+            version, methods = struct.unpack("!BB", _recv_exact(client, 2))
+            _recv_exact(client, methods)
+            if version != 5:
+                return
+            client.sendall(b"\x05\x00")
+            _, command, _, atyp = struct.unpack("!BBBB", _recv_exact(client, 4))
+            if atyp == 1:
+                host = socket.inet_ntoa(_recv_exact(client, 4))
+            elif atyp == 3:
+                host = _recv_exact(client, _recv_exact(client, 1)[0]).decode("idna")
+            elif atyp == 4:
+                host = socket.inet_ntop(socket.AF_INET6, _recv_exact(client, 16))
+            else:
+                return
+            port = struct.unpack("!H", _recv_exact(client, 2))[0]
+        except (OSError, struct.error):
+            return
+
+        if server.latency:
+            time.sleep(server.latency)
+        # «Мёртвый» прокси и чужие адреса — отказ; наружу стенд не ходит
+        if command != 1 or host.lower() not in LOCAL_HOSTS or server.random() < server.fail_rate:
+            server.count("refused")
+            client.sendall(b"\x05\x02\x00\x01" + bytes(6))
+            return
+        try:
+            upstream = socket.create_connection((host, port), timeout=10)
+        except OSError:
+            server.count("refused")
+            client.sendall(b"\x05\x05\x00\x01" + bytes(6))
+            return
+        server.count("connected")
+        client.sendall(b"\x05\x00\x00\x01" + bytes(6))
+        with upstream:
+            _pipe(client, upstream)
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise OSError("соединение закрыто")
+        data += chunk
+    return data
+
+def _pipe(a: socket.socket, b: socket.socket):
+    peers = {a: b, b: a}
+    while True:
+        readable, _, _ = select.select(list(peers), [], [], 60)
+        if not readable:
+            return
+        for sock in readable:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            peers[sock].sendall(data)
+
+class FakeSocks(socketserver.ThreadingTCPServer):
+    """SOCKS5-стенд: задержка на рукопожатие и доля отказов как у живого/мёртвого прокси."""
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address=(HOST, SOCKS_PORT), *, latency: float = 0.0, fail_rate: float = 0.0,
+                 seed: int | None = None):
+        super().__init__(address, FakeSocksHandler)
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.counts: Counter = Counter()
+        self._lock = Lock()
+        self._random = random.Random(seed)
+
+    @property
+    def proxy(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def random(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def count(self, outcome: str):
+        with self._lock:
+            self.counts[outcome] += 1
+
+def start_fake_socks(count: int = SOCKS_COUNT, *, latency: float = 0.0, fail_rate: float = 0.0,
+                     seed: int | None = None) -> list[FakeSocks]:
+    """Поднять count SOCKS5-стендов на свободных портах."""
+    servers = []
+    for n in range(count):
+        server = FakeSocks((HOST, 0), latency=latency, fail_rate=fail_rate,
+                           seed=None if seed is None else seed + n)
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+def main():
+    server = FakeZapoServer((HOST, PORT), faults=Faults(seed=0))
+    Thread(target=server.serve_forever, daemon=True).start()
+    socks = [FakeSocks((HOST, SOCKS_PORT + n)) for n in range(SOCKS_COUNT)]
+    for proxy in socks:
+        Thread(target=proxy.serve_forever, daemon=True).start()
+    print(f"🧪 Подделка zapo: {server.base_url}")
+    print(f"🧦 SOCKS5: {', '.join(proxy.proxy for proxy in socks)}")
+    print(f"   ZAPO_MIRRORS={server.base_url},http://localhost:{PORT}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("⏹️ Остановка")
+        server.shutdown()
+        for proxy in socks:
+            proxy.shutdown()
+
+if __name__ == "__main__":
+    main()
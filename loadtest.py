@@ -0,0 +1,232 @@
+"""
+Нагрузочный прогон против локального стенда (fake_zapo.py).
+
+    python loadtest.py                        # fetch_page_with_proxies по всем видам страниц
+    python loadtest.py stage5 stage6 stage7   # этапы целиком, по цепочке
+
+Стенд и SOCKS5-прокси поднимаются в этом же процессе, этапы работают во
+временном каталоге (LOADTEST_DIR): зеркала подменяются через ZAPO_MIRRORS,
+ссылки https://zapo.ru в константах этапов и в их JSON-выходе переписываются
+на стенд, а разрешение имён ограничено локальными адресами — на настоящие
+зеркала прогон не ходит. В отчёте: запросы в секунду, p50/p99 задержки,
+число повторов на задачу (запросы к стенду + отказы SOCKS сверх одного на задачу)
+и соединения через SOCKS-стенд. Если прокси заданы, а через стенд не прошло ни
+одного соединения (например, нет PySocks и все запросы ушли напрямую), прогон
+считается неудачным: код выхода — 1.
+"""
+import importlib
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from fake_zapo import CATALOG_TYPES, LOCAL_HOSTS, Catalog, Faults, start_fake_socks, start_fake_zapo
+
+FAULTS = Faults(
+    latency=0.05, jitter=0.05,
+    error_rate=0.05, block_rate=0.02, challenge_rate=0.01, soft_block_rate=0.02, truncate_rate=0.01,
+    seed=1,
+)
+CATALOG = Catalog()
+SOCKS_COUNT = 8
+SOCKS_LATENCY = 0.01
+SOCKS_FAIL_RATE = 0.1  # доля «мёртвых» соединений через прокси
+FETCH_ITEMS = 500
+FETCH_WORKERS = 32
+FETCH_RETRIES = 5
+LOADTEST_DIR = None  # None — новый временный каталог
+ORIGIN = "https://zapo.ru"
+PROXY_FILE = "proxies_cleaned.txt"
+
+STAGES = {
+    "stage1": "stage1_brands_scraper",
+    "stage2": "stage2_contacts_scraper",
+    "stage3": "stage3_contacts_scraper",
+    "stage5": "stage5_carbase_scraper",
+    "stage6": "stage6_parse_modifications",
+    "stage7": "stage7_parse_parts",
+    "stage8": "stage8_export_parts_to_excel",
+    "stage9": "stage9_parse_catalog_brands",
+    "stage10": "stage10_parse_models",
+    "stage11": "stage11_parse_modification_table",
+    "stage12": "stage12_export_modifications_to_excel",
+    "stage13": "stage13_catalog_sitemaps",
+}
+
+def isolate_network():
+    """Разрешать только локальные имена: прогон не должен уйти на настоящие зеркала."""
+    resolve = socket.getaddrinfo
+
+    def local_only(host, *args, **kwargs):
+        name = host.decode() if isinstance(host, bytes) else host
+        if name is not None and name.lower() not in LOCAL_HOSTS:
+            raise socket.gaierror(f"loadtest: внешний адрес запрещён: {name}")
+        return resolve(host, *args, **kwargs)
+
+    socket.getaddrinfo = local_only
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def report(title: str, items: int, wall: float, server, socks, latencies: list[float] | None = None) -> bool:
+    """Напечатать отчёт; False — прокси заданы, но путь через них не проверен."""
+    stats = server.stats.snapshot()
+    refused = sum(proxy.counts["refused"] for proxy in socks)
+    connected = sum(proxy.counts["connected"] for proxy in socks)
+    attempts = stats["requests"] + refused
+    served = stats["latencies"]
+    print(f"\n📊 {title}: {items} задач за {wall:.1f} с")
+    print(f"  запросов к стенду: {stats['requests']} ({stats['requests'] / max(wall, 1e-9):.1f}/с), отказов SOCKS: {refused}")
+    print(f"  соединений через SOCKS-стенд: {connected + refused} (проксировано: {connected})")
+    print(f"  ответ стенда p50/p99: {percentile(served, 0.5) * 1000:.0f} / {percentile(served, 0.99) * 1000:.0f} мс")
+    if latencies:
+        print(f"  задача p50/p99: {percentile(latencies, 0.5) * 1000:.0f} / {percentile(latencies, 0.99) * 1000:.0f} мс")
+    print(f"  повторов на задачу: {max(attempts - items, 0) / max(items, 1):.2f}")
+    print(f"  исходы: {stats['outcomes']}")
+    if socks and stats["requests"] and not connected + refused:
+        print("  ❌ Через SOCKS-стенд не прошло ни одного соединения: все запросы ушли напрямую,"
+              " путь через прокси не проверен (установлен ли PySocks?)")
+        return False
+    return True
+
+def sample_urls(base: str, catalog: Catalog, count: int, seed: int = 0):
+    """Адреса всех видов страниц стенда вперемешку."""
+    rnd = random.Random(seed)
+    kinds = [
+        lambda: "/brandslist",
+        lambda: "/carbase",
+        lambda: f"/carbase/{rnd.randrange(catalog.brands)}",
+        lambda: f"/carbase/{rnd.randrange(catalog.brands)}/{rnd.randrange(catalog.models)}/{rnd.randrange(catalog.versions)}",
+        lambda: f"/mod/{rnd.randrange(catalog.brands)}/0/0/{rnd.randrange(catalog.modifications)}",
+        lambda: f"/auto2dV2/?action=marks&typeCatalog={rnd.choice(CATALOG_TYPES)}",
+        lambda: f"/auto2dV2/?action=models&typeCatalog=CARS_FOREIGN&mark={rnd.randrange(catalog.brands)}",
+        lambda: (
+            f"/auto2dV2/?action=modifications&typeCatalog=CARS_FOREIGN&mark={rnd.randrange(catalog.brands)}"
+            f"&model={rnd.randrange(catalog.models)}&page={rnd.randint(1, catalog.table_pages)}"
+        ),
+        lambda: f"/{1000 + rnd.randrange(catalog.groups)}_catalog",
+        lambda: (
+            f"/{1000 + rnd.randrange(catalog.groups)}_catalog?goods_group=1000"
+            f"&action=goods_catalog/goods_catalog/getFilters&excluded=k{rnd.randrange(catalog.filter_keys)}"
+        ),
+    ]
+    for n in range(count):
+        # Уникальный хвост, чтобы SingleFlight и кеш не склеивали задачи
+        path = rnd.choice(kinds)()
+        yield f"{base}{path}{'&' if '?' in path else '?'}n={n}"
+
+def run_fetch(server, socks) -> bool:
+    """fetch_page_with_proxies на FETCH_ITEMS адресах через пул потоков run_bounded."""
+    # utils импортируется после подмены ZAPO_MIRRORS и каталога
+    from utils import fetch_page_with_proxies, mirror_router, open_proxy_pool, run_bounded
+
+    proxies = open_proxy_pool(PROXY_FILE, daemon=False)
+    working: list[str] = []
+
+    def fetch(url: str):
+        started = time.monotonic()
+        page, _ = fetch_page_with_proxies(
+            mirror_router.route(url), proxies, working, retries=FETCH_RETRIES, cache_ttl=None,
+        )
+        return page is not None, time.monotonic() - started
+
+    server.stats.reset()
+    for proxy in socks:
+        proxy.counts.clear()
+    started = time.monotonic()
+    latencies, failed = [], 0
+    for _, result in run_bounded(fetch, sample_urls(server.base_url, CATALOG, FETCH_ITEMS), max_workers=FETCH_WORKERS):
+        if isinstance(result, Exception):
+            failed += 1
+            continue
+        ok, elapsed = result
+        latencies.append(elapsed)
+        failed += not ok
+    ok = report("fetch_page_with_proxies", FETCH_ITEMS, time.monotonic() - started, server, socks, latencies)
+    print(f"  не загружено: {failed}")
+    return ok
+
+def localize_outputs(base: str):
+    """Переписать https://zapo.ru в JSON-выходе этапа на стенд — его читает следующий этап."""
+    for name in os.listdir("."):
+        if not name.endswith(".json"):
+            continue
+        with open(name, "r", encoding="utf-8") as f:
+            text = f.read()
+        if ORIGIN in text:
+            with open(name, "w", encoding="utf-8") as f:
+                f.write(text.replace(ORIGIN, base))
+
+def localize_module(module, base: str):
+    """Направить константы адресов этапа на стенд."""
+    for attr in ("BASE_URL", "REMOTE_URL"):
+        value = getattr(module, attr, None)
+        if isinstance(value, str):
+            setattr(module, attr, value.replace(ORIGIN, base))
+    if isinstance(getattr(module, "URLS", None), dict):
+        module.URLS = {key: url.replace(ORIGIN, base) for key, url in module.URLS.items()}
+
+def run_stage(name: str, server, socks) -> bool:
+    base = server.base_url
+    if name == "stage13" and not os.path.exists("groups.json"):
+        with open("groups.json", "w", encoding="utf-8") as f:
+            json.dump([{"id": str(1000 + g), "name": f"Group {g}"} for g in range(CATALOG.groups)], f)
+    try:
+        module = importlib.import_module(STAGES[name])
+    except ImportError as e:
+        print(f"⚠️ {name}: пропуск — {e}")
+        return True
+    localize_module(module, base)
+
+    server.stats.reset()
+    for proxy in socks:
+        proxy.counts.clear()
+    started = time.monotonic()
+    try:
+        module.main()
+    except Exception as e:
+        print(f"❌ {name}: {type(e).__name__}: {e}")
+    wall = time.monotonic() - started
+    localize_outputs(base)
+    return report(name, server.stats.snapshot()["unique"], wall, server, socks)
+
+def main():
+    stages = sys.argv[1:]
+    unknown = [name for name in stages if name not in STAGES]
+    if unknown:
+        print(f"❌ Неизвестные этапы: {', '.join(unknown)}; доступны: {', '.join(STAGES)}")
+        return
+
+    workdir = LOADTEST_DIR or tempfile.mkdtemp(prefix="zapo_loadtest_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    isolate_network()
+
+    server = start_fake_zapo(faults=FAULTS, catalog=CATALOG)
+    socks = start_fake_socks(SOCKS_COUNT, latency=SOCKS_LATENCY, fail_rate=SOCKS_FAIL_RATE, seed=FAULTS.seed)
+    with open(PROXY_FILE, "w", encoding="utf-8") as f:
+        f.write("\n".join(proxy.proxy for proxy in socks))
+    port = server.server_address[1]
+    # Два «зеркала» на одном стенде: у этапов остаётся куда переключиться
+    os.environ["ZAPO_MIRRORS"] = f"{server.base_url},http://localhost:{port}"
+    os.environ["ZAPO_PROXY_DAEMON"] = os.path.join(workdir, "proxy_daemon.sock")
+    os.environ.pop("PROXY_API_KEY", None)
+    print(f"🧪 Стенд: {server.base_url}, прокси: {len(socks)}, каталог: {workdir}")
+
+    results = [run_fetch(server, socks)] if not stages else []
+    for name in stages:
+        results.append(run_stage(name, server, socks))
+
+    server.shutdown()
+    for proxy in socks:
+        proxy.shutdown()
+    if not all(results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
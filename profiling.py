@@ -0,0 +1,173 @@
+"""
+🔬 Профилирование этапа: ZAPO_PROFILE=cprofile,tracemalloc,sample.
+Импорт ничего не запускает и не тянет utils — этапы экспорта (4, 8, 12) берут
+profile_main отсюда; этапы со сетью — из utils, где к нему добавлен экспорт метрик.
+"""
+import os
+import sys
+import time
+from datetime import datetime
+from threading import Event, Thread, get_ident
+from typing import Callable
+
+PROFILE_DIR = os.path.join("zapo_logs", "profiles")
+PROFILE_TOP = 30
+SAMPLE_INTERVAL = 0.01
+TRACEMALLOC_FRAMES = 25
+
+def _script_name() -> str:
+    main_file = getattr(sys.modules["__main__"], "__file__", None) or "python"
+    return os.path.splitext(os.path.basename(main_file))[0]
+
+class StackSampler:
+    """
+    Сэмплирующий профайлер: раз в interval секунд снимает стеки всех потоков
+    (sys._current_frames). Видно, где стоят потоки, включая ожидание локов и сети,
+    чего cProfile в пуле из сотен потоков не покажет.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: dict[str, int] = {}
+        self.samples = 0
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def write_folded(self, path: str):
+        """Свёрнутые стеки («stack count») — вход для flamegraph.pl / speedscope."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, hits in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {hits}\n")
+
+    def summary(self, top: int = PROFILE_TOP) -> str:
+        own: dict[str, int] = {}
+        total: dict[str, int] = {}
+        for stack, hits in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] = own.get(frames[-1], 0) + hits
+            for frame in set(frames):
+                total[frame] = total.get(frame, 0) + hits
+        samples = max(self.samples, 1)
+        lines = [f"Сэмплов: {self.samples} (интервал {self.interval * 1000:.0f} мс, по всем потокам)", "", "Собственное время:"]
+        for frame, hits in sorted(own.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"{hits / samples:7.1%}  {frame}")
+        lines += ["", "С вложенными:"]
+        for frame, hits in sorted(total.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"{hits / samples:7.1%}  {frame}")
+        return "\n".join(lines) + "\n"
+
+def _thread_profiles(profiles: list):
+    """cProfile до 3.12 видит только свой поток — в каждом новом потоке включается свой профиль."""
+    import cProfile
+    import threading
+
+    def start(frame, event, arg):
+        profile = cProfile.Profile()
+        profiles.append(profile)
+        profile.enable()  # заменяет этот хук в потоке
+
+    threading.setprofile(start)
+
+def profile_main(main: Callable, name: str | None = None, logger: Callable[[str], None] | None = None):
+    """
+    Запустить main() этапа. ZAPO_PROFILE (через запятую) включает профилирование:
+    cprofile — .prof и топ по cumulative/tottime, tracemalloc — снимок и топ аллокаций,
+    sample — сэмплы стеков всех потоков (.folded и топ). Файлы — в PROFILE_DIR
+    с именем этапа и временем запуска; топ — ZAPO_PROFILE_TOP строк.
+    """
+    modes = {mode.strip().lower() for mode in os.getenv("ZAPO_PROFILE", "").split(",") if mode.strip()}
+    if not modes:
+        return main()
+    unknown = modes - {"cprofile", "tracemalloc", "sample"}
+    if unknown:
+        raise ValueError(f"ZAPO_PROFILE: неизвестные режимы {', '.join(sorted(unknown))}")
+
+    top = int(os.getenv("ZAPO_PROFILE_TOP", PROFILE_TOP))
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(PROFILE_DIR, f"{name or _script_name()}_{datetime.now():%Y%m%d_%H%M%S}")
+
+    profile = None
+    thread_profiles: list = []
+    sampler = None
+    if "tracemalloc" in modes:
+        import tracemalloc
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    if "sample" in modes:
+        sampler = StackSampler()
+        sampler.start()
+    if "cprofile" in modes:
+        import cProfile
+        if sys.version_info < (3, 12):
+            _thread_profiles(thread_profiles)
+        profile = cProfile.Profile()
+        profile.enable()
+
+    started = time.monotonic()
+    try:
+        return main()
+    finally:
+        elapsed = time.monotonic() - started
+        written = []
+        if profile is not None:
+            import io
+            import pstats
+            import threading
+
+            profile.disable()
+            threading.setprofile(None)
+            stats = pstats.Stats(profile)
+            for extra in thread_profiles:
+                extra.create_stats()
+                stats.add(extra)
+            stats.dump_stats(f"{prefix}.prof")
+            report = io.StringIO()
+            stats.stream = report
+            stats.sort_stats("cumulative").print_stats(top)
+            stats.sort_stats("tottime").print_stats(top)
+            with open(f"{prefix}_cprofile.txt", "w", encoding="utf-8") as f:
+                f.write(f"Потоков: {1 + len(thread_profiles)}, время этапа: {elapsed:.1f} с\n")
+                f.write(report.getvalue())
+            written += [f"{prefix}.prof", f"{prefix}_cprofile.txt"]
+        if sampler is not None:
+            sampler.stop()
+            sampler.write_folded(f"{prefix}.folded")
+            with open(f"{prefix}_sample.txt", "w", encoding="utf-8") as f:
+                f.write(sampler.summary(top))
+            written += [f"{prefix}.folded", f"{prefix}_sample.txt"]
+        if "tracemalloc" in modes:
+            import tracemalloc
+
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            snapshot.dump(f"{prefix}.tracemalloc")
+            with open(f"{prefix}_tracemalloc.txt", "w", encoding="utf-8") as f:
+                f.write(f"Сейчас: {current / 1024 / 1024:.1f} МБ, пик: {peak / 1024 / 1024:.1f} МБ\n\n")
+                for stat in snapshot.statistics("lineno")[:top]:
+                    f.write(f"{stat}\n")
+            written += [f"{prefix}.tracemalloc", f"{prefix}_tracemalloc.txt"]
+        (logger or print)(f"[ПРОФИЛЬ] {', '.join(sorted(modes))}: {elapsed:.1f} с → {', '.join(written)}")
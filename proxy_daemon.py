@@ -0,0 +1,145 @@
+"""
+Демон общего пула прокси для одновременно запущенных этапов.
+
+    python proxy_daemon.py
+
+Пока демон работает, open_proxy_pool() в каждом этапе возвращает RemoteProxyPool:
+списки прокси скачивает и обновляет только демон, аренда (lease/release) и
+здоровье прокси общие для всех процессов. Сокет — ZAPO_PROXY_DAEMON
+(по умолчанию proxy_daemon.sock в рабочем каталоге).
+"""
+import json
+import os
+import signal
+import socketserver
+from collections import Counter
+from datetime import datetime
+from threading import Event, Thread
+from utils import (
+    PROXY_DAEMON_SOCKET, ProxyPool, connect_proxy_daemon, open_proxy_pool, load_proxies, proxy_registry, metrics,
+)
+
+PROXY_FILE = "proxies_cleaned.txt"
+PROXY_ALIVE_FILE = "proxies_alive.txt"
+CHECK_ON_START = False
+REFRESH_INTERVAL = 15 * 60  # фоновое обновление списка через API с проверкой живости
+STATUS_INTERVAL = 60
+
+def log(message: str):
+    print(f"[{datetime.now():%H:%M:%S}] {message}", flush=True)
+
+class LeaseHandler(socketserver.StreamRequestHandler):
+    """Одно соединение — один поток процесса этапа. Незакрытые аренды возвращаются при разрыве."""
+
+    def handle(self):
+        leased: Counter = Counter()
+        try:
+            for line in self.rfile:
+                try:
+                    reply = {"result": self.dispatch(json.loads(line), leased)}
+                except Exception as e:
+                    reply = {"error": f"{type(e).__name__}: {e}"}
+                self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+        finally:
+            # Процесс завершился или упал посреди запроса — прокси не должен остаться «занятым»
+            pool = self.server.pool
+            for proxy, count in leased.items():
+                for _ in range(count):
+                    pool.release(proxy)
+
+    def dispatch(self, message: dict, leased: Counter):
+        pool: ProxyPool = self.server.pool
+        op = message.get("op")
+        if op == "lease":
+            proxy = pool.lease()
+            if proxy is not None:
+                leased[proxy] += 1
+            return proxy
+        if op == "release":
+            proxy = message["proxy"]
+            if leased[proxy] > 0:
+                leased[proxy] -= 1
+            pool.release(proxy, message.get("ok"), message.get("latency"))
+            return None
+        if op == "penalize":
+            return pool.penalize(message["proxy"])
+        if op == "contains":
+            return message["proxy"] in pool
+        if op == "remove":
+            return pool.remove(message["proxy"])
+        if op == "add":
+            return pool.add(message["proxies"])
+        if op == "replace":
+            return pool.replace(message["proxies"])
+        if op == "len":
+            return len(pool)
+        if op == "available":
+            return pool.available()
+        if op == "snapshot":
+            return pool.snapshot()
+        if op == "working":
+            return pool.working()
+        if op == "ping":
+            return "pong"
+        raise ValueError(f"unknown op {op!r}")
+
+class ProxyDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, pool: ProxyPool):
+        self.pool = pool
+        super().__init__(path, LeaseHandler)
+
+def refresh_loop(pool: ProxyPool, stop: Event):
+    """Периодически обновлять список прокси и писать статус пула."""
+    elapsed = 0
+    while not stop.wait(STATUS_INTERVAL):
+        elapsed += STATUS_INTERVAL
+        log(f"[STATUS] прокси: {len(pool)}, доступно: {pool.available()}, рабочих: {len(pool.working())}")
+        proxy_registry.flush()
+        if elapsed < REFRESH_INTERVAL:
+            continue
+        elapsed = 0
+        try:
+            fresh = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE, check_alive=True, logger=log)
+        except Exception as e:
+            log(f"[REFRESH] ❌ {e}")
+            continue
+        if not fresh:
+            log("[REFRESH] Новый список пуст — оставляем текущий")
+            continue
+        new = set(fresh) - set(pool.snapshot())
+        pool.replace(fresh)
+        pool.seed(proxy_registry.history(new))
+        log(f"[REFRESH] 🔁 В пуле {len(pool)} прокси, новых: {len(new)}")
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+def main():
+    path = PROXY_DAEMON_SOCKET
+    if connect_proxy_daemon(path) is not None:
+        log(f"❌ Демон уже запущен: {path}")
+        return
+    if os.path.exists(path):
+        os.remove(path)  # сокет от упавшего процесса
+
+    metrics.start_from_env(log)
+    pool = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE, logger=log, check_alive=CHECK_ON_START, daemon=False)
+    stop = Event()
+    signal.signal(signal.SIGTERM, _terminate)
+    Thread(target=refresh_loop, args=(pool, stop), daemon=True).start()
+
+    with ProxyDaemon(path, pool) as server:
+        log(f"🛰️ Демон прокси слушает {path}: {len(pool)} прокси")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log("⏹️ Остановка")
+        finally:
+            stop.set()
+            proxy_registry.flush()
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Офлайн-прогон цепочек каталога целиком: stage5→6→7→8 и stage9→10→11→12.
+
+    python replay_bench.py                 # обе цепочки
+    python replay_bench.py catalog         # только stage9→10→11→12
+
+Ответы отдаёт локальный стенд fake_zapo.py без задержек и ошибок: страницы из
+REPLAY_DIR (записанный корпус, имя файла — quote(путь?запрос, safe="")), а
+недостающие — из шаблонов. Каждый этап запускается отдельным процессом с
+настоящим кодом этапа, поэтому пик RSS свой у каждого. По этапу пишутся:
+время, пик RSS, прирост данных на диске, записанные байты (wchar, вместе с
+сокетами) и время по фазам — загрузка, разбор, JSON, экспорт в Excel. Фазы
+считаются без вложенности; в таблице — настенное время, когда фазой занят хотя бы
+один поток (не больше времени этапа, но фазы разных потоков перекрываются). Сумма
+по потокам пишется в JSON метрик этапа как phases_thread.
+
+Браузер записанный корпус не проиграет: в stage11 вместо закомментированной
+фазы requests в main() она запускается явно, а Selenium-фаза отключается.
+"""
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from threading import Lock, local
+from fake_zapo import Catalog, Faults, start_fake_socks, start_fake_zapo
+from loadtest import PROXY_FILE, STAGES, isolate_network, localize_module, localize_outputs
+
+PIPELINES = {
+    "carbase": ["stage5", "stage6", "stage7", "stage8"],
+    "catalog": ["stage9", "stage10", "stage11", "stage12"],
+}
+REPLAY_DIR = os.getenv("ZAPO_REPLAY_DIR")
+REPLAY_WORKDIR = None  # None — новый временный каталог
+CATALOG = Catalog(table_pages=1)
+PHASES = ("fetch", "parse", "serialize", "export")
+FETCHERS = ("fetch_page_with_proxies", "fetch_with_proxies", "stream_get")
+EXTRACTORS = (
+    "extract_models_and_versions", "extract_version_details", "extract_parts", "extract_models", "extract_rows",
+)
+EXPORT_STAGES = {"stage8", "stage12"}
+
+class PhaseTimer:
+    """
+    Время по фазам без вложенности: вложенная фаза ставит внешнюю на паузу.
+    totals — сумма по потокам, wall — время, когда фазой занят хотя бы один поток.
+    """
+
+    def __init__(self):
+        self.totals: dict[str, float] = defaultdict(float)
+        self.wall: dict[str, float] = defaultdict(float)
+        self._active: dict[str, int] = defaultdict(int)
+        self._since: dict[str, float] = {}
+        self._lock = Lock()
+        self._local = local()
+
+    def wrap(self, phase: str, fn):
+        def timed(*args, **kwargs):
+            stack = self._local.__dict__.setdefault("stack", [])
+            now = time.perf_counter()
+            if stack:
+                self._leave(stack[-1][0], now, now - stack[-1][1])
+            self._enter(phase, now)
+            stack.append([phase, now])
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                now = time.perf_counter()
+                self._leave(phase, now, now - stack.pop()[1])
+                if stack:
+                    self._enter(stack[-1][0], now)
+                    stack[-1][1] = now
+        timed.__wrapped__ = fn
+        return timed
+
+    def _enter(self, phase: str, now: float):
+        with self._lock:
+            if not self._active[phase]:
+                self._since[phase] = now
+            self._active[phase] += 1
+
+    def _leave(self, phase: str, now: float, elapsed: float):
+        with self._lock:
+            self.totals[phase] += elapsed
+            self._active[phase] -= 1
+            if not self._active[phase]:
+                self.wall[phase] += now - self._since.pop(phase)
+
+def _disk_usage(path: str) -> int:
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass
+    return total
+
+def _written_bytes() -> int | None:
+    try:
+        with open("/proc/self/io", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def instrument(module, timer: PhaseTimer):
+    """Обернуть загрузку, разбор и JSON в модуле этапа (и в utils.Page.soup)."""
+    import utils
+
+    for name in FETCHERS:
+        if callable(getattr(module, name, None)):
+            setattr(module, name, timer.wrap("fetch", getattr(module, name)))
+    for name in EXTRACTORS + ("BeautifulSoup",):
+        if callable(getattr(module, name, None)):
+            setattr(module, name, timer.wrap("parse", getattr(module, name)))
+    utils.Page.soup = timer.wrap("parse", utils.Page.soup)
+    for name in ("dump", "dumps", "load", "loads"):
+        setattr(json, name, timer.wrap("serialize", getattr(json, name)))
+
+def run_child(name: str, metrics_file: str):
+    """Один этап в отдельном процессе; метрики — в metrics_file."""
+    isolate_network()
+    timer = PhaseTimer()
+    disk_before, written_before = _disk_usage("."), _written_bytes()
+    started = time.monotonic()
+    error = None
+    try:
+        module = importlib.import_module(STAGES[name])
+        localize_module(module, os.environ["ZAPO_MIRRORS"].split(",")[0])
+        instrument(module, timer)
+        main = module.main
+        if name in EXPORT_STAGES:
+            main = timer.wrap("export", main)
+        if name == "stage11":
+            from utils import run_bounded
+
+            def main(stage_main=main):
+                for _ in run_bounded(module.prepare_requests_phase, _stage11_tasks(module), max_workers=module.THREADS_REQUESTS):
+                    pass
+                module.selenium_phase = lambda item: None
+                stage_main()
+        main()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall = time.monotonic() - started
+    written_after = _written_bytes()
+    metrics = {
+        "wall": wall,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "disk_bytes": _disk_usage(".") - disk_before,
+        "written_bytes": None if written_before is None else written_after - written_before,
+        "phases": {phase: timer.wall.get(phase, 0.0) for phase in PHASES},
+        "phases_thread": {phase: timer.totals.get(phase, 0.0) for phase in PHASES},
+        "error": error,
+    }
+    with open(metrics_file, "w", encoding="utf-8") as f:
+        json.dump(metrics, f)
+
+def _stage11_tasks(module):
+    with open(module.INPUT_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    for brand in data:
+        for model in brand.get("models", []):
+            yield {
+                "brand": brand.get("brand"),
+                "type": brand.get("type"),
+                "brand_image": brand.get("image_url"),
+                "model": model.get("name"),
+                "model_image": model.get("image_url"),
+                "modification_url": model.get("modification_url"),
+            }
+
+def _mb(size: int | None) -> str:
+    return "—" if size is None else f"{size / 1024 / 1024:.1f}"
+
+def main():
+    if sys.argv[1:2] == ["child"]:
+        run_child(sys.argv[2], sys.argv[3])
+        return
+
+    names = sys.argv[1:] or list(PIPELINES)
+    unknown = [name for name in names if name not in PIPELINES]
+    if unknown:
+        print(f"❌ Неизвестные цепочки: {', '.join(unknown)}; доступны: {', '.join(PIPELINES)}")
+        sys.exit(2)
+
+    workdir = REPLAY_WORKDIR or tempfile.mkdtemp(prefix="zapo_replay_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    server = start_fake_zapo(faults=Faults(latency=0, jitter=0), catalog=CATALOG, recorded_dir=REPLAY_DIR)
+    socks = start_fake_socks(2)
+    with open(PROXY_FILE, "w", encoding="utf-8") as f:
+        f.write("\n".join(proxy.proxy for proxy in socks))
+    env = dict(
+        os.environ,
+        ZAPO_MIRRORS=f"{server.base_url},http://localhost:{server.server_address[1]}",
+        ZAPO_PROXY_DAEMON=os.path.join(workdir, "proxy_daemon.sock"),
+    )
+    env.pop("PROXY_API_KEY", None)
+    print(f"🧪 Стенд: {server.base_url}, корпус: {REPLAY_DIR or 'шаблоны'}, каталог: {workdir}")
+
+    summary = []
+    for pipeline in names:
+        for name in PIPELINES[pipeline]:
+            metrics_file = os.path.join(workdir, f"replay_{name}.json")
+            server.stats.reset()
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "child", name, metrics_file],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+            )
+            # Выход этапа читает следующий — ссылки zapo.ru переписываются на стенд
+            localize_outputs(server.base_url)
+            if not os.path.exists(metrics_file):
+                print(f"❌ {name}: процесс этапа упал до записи метрик")
+                continue
+            with open(metrics_file, "r", encoding="utf-8") as f:
+                metrics = json.load(f)
+            metrics["requests"] = server.stats.snapshot()["requests"]
+            summary.append((pipeline, name, metrics))
+
+    print(f"\n{'этап':<9}{'время, с':>9}{'RSS, МБ':>9}{'диск, МБ':>10}{'запись, МБ':>12}{'запросы':>9}"
+          + "".join(f"{phase:>11}" for phase in PHASES))
+    totals: dict[str, float] = defaultdict(float)
+    for pipeline, name, metrics in summary:
+        print(
+            f"{name:<9}{metrics['wall']:>9.1f}{metrics['peak_rss_mb']:>9.0f}{_mb(metrics['disk_bytes']):>10}"
+            f"{_mb(metrics['written_bytes']):>12}{metrics['requests']:>9}"
+            + "".join(f"{metrics['phases'][phase]:>11.2f}" for phase in PHASES)
+        )
+        if metrics["error"]:
+            print(f"  ↳ ❌ {metrics['error']}")
+        totals[pipeline] += metrics["wall"]
+    print("Фазы — настенное время, с: пока фазой занят хотя бы один поток (сумма по потокам — phases_thread в replay_<этап>.json)")
+    for pipeline, wall in totals.items():
+        print(f"⏱️ {pipeline}: {wall:.1f} с")
+
+    server.shutdown()
+    for proxy in socks:
+        proxy.shutdown()
+
+if __name__ == "__main__":
+    main()
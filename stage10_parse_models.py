@@ -1,10 +1,12 @@
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 import os
 import json
 from datetime import datetime
 from threading import Lock
-from utils import load_proxies, proxy_lock, MIRRORS, with_mirror, fetch_with_proxies
+from utils import (
+    open_proxy_pool, proxy_lock, MIRRORS, mirror_router, fetch_page_with_proxies, response_cache,
+    RetryBudget, format_budget_stats, Page, PageClassifier, PAGE_OK, PAGE_EMPTY, RetryLater, run_bounded, profile_main,
+)
 
 INPUT_FILE = "stage9_brands.json"
 OUTPUT_FILE = "stage10_models_detailed.json"
@@ -14,6 +16,19 @@ TMP_DIR = "stage10_temp_results"
 LOG_DIR = "zapo_logs"
 BASE_URL = MIRRORS[1]  # default zapo.ru
 RETRIES = 15
+# Бренды идут по одному, как и раньше; неудачный откладывается в очередь с джиттером,
+# а поток тем временем берёт следующий бренд
+THREADS = 1
+RETRY_BACKOFF = 2
+RETRY_MAX_DELAY = 120
+# Общий лимит на страницу бренда: вложенные RETRIES × RETRIES × прокси иначе дают тысячи запросов
+RETRY_BUDGET_ATTEMPTS = 60
+RETRY_BUDGET_SECONDS = 10 * 60
+CACHE_TTL = 7 * 24 * 3600
+MAX_BODY_BYTES = 4 * 1024 * 1024  # страница модели бренда
+# Плитка модели — признак данных. Проверенного сообщения «моделей нет» у страницы бренда
+# нет, поэтому страница зеркала без плиток (PAGE_NO_DATA) повторяется, пока не кончится бюджет
+PAGE_CLASSIFIER = PageClassifier(["productTile"], empty=())
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
@@ -31,59 +46,92 @@ def log(message: str):
         with open(log_file_path, "a", encoding="utf-8") as f:
             f.write(message + "\n")
 
-proxies = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE)
+proxies = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE)
 working_proxies = []
+# Бюджет страницы бренда живёт между отложенными попытками
+budgets: dict[str, RetryBudget] = {}
 
-def fetch_html(url: str) -> str | None:
-    """Load *url* using :func:`utils.fetch_with_proxies`."""
-    html, _ = fetch_with_proxies(
-        url,
+def fetch_page(url: str, budget: RetryBudget | None = None) -> Page | None:
+    """Load *url* via a mirror chosen by :data:`utils.mirror_router`."""
+    page, _ = fetch_page_with_proxies(
+        mirror_router.route(url),
         proxies,
         working_proxies,
         headers=HEADERS,
         retries=RETRIES,
         logger=log,
+        cache_ttl=CACHE_TTL,
+        max_bytes=MAX_BODY_BYTES,
+        budget=budget,
     )
-    return html
+    return page
 
 def parse_models_page(url):
-    for attempt in range(1, RETRIES + 1):
-        html = fetch_html(url)
-        if not html:
-            continue
-
-        soup = BeautifulSoup(html, "html.parser")
-        blocks = soup.select("div.productTile a.goodDescriptionLink")
-        if not blocks:
-            log(f"[RETRY {attempt}] Блоки моделей не найдены в: {url}")
-            continue
-
-        results = []
-        for a_tag in blocks:
-            img_tag = a_tag.select_one("img.goodDescriptionImg")
-            name_tag = a_tag.select_one("span.goodDescriptionName")
-
-            results.append({
-                "name": name_tag.get_text(strip=True) if name_tag else "",
-                "image_url": img_tag["src"] if img_tag else "",
-                "modification_url": urljoin(BASE_URL, a_tag["href"])
-            })
-
-        return results
-
-    return []
+    """Модели бренда (одна попытка); RetryLater — run_bounded повторит страницу позже."""
+    budget = budgets.setdefault(url, RetryBudget(RETRY_BUDGET_ATTEMPTS, RETRY_BUDGET_SECONDS, name="stage10"))
+    if budget.exhausted:
+        log(f"[BUDGET] {url} — {budget}")
+        budgets.pop(url, None)
+        return []
+    page = fetch_page(url, budget)
+    if not page:
+        raise RetryLater(f"не загружено: {url}")
+
+    kind = PAGE_CLASSIFIER.classify(page)
+    if kind == PAGE_EMPTY:
+        log(f"[EMPTY] У бренда нет моделей: {url}")
+        budgets.pop(url, None)
+        return []
+    results = extract_models(page) if kind == PAGE_OK else []
+    if not results:
+        response_cache.invalidate(url)
+        raise RetryLater(f"блоки моделей не найдены ({kind}): {url}")
+
+    budgets.pop(url, None)
+    return results
+
+def extract_models(page: Page):
+    results = []
+    for a_tag in page.soup().select("div.productTile a.goodDescriptionLink"):
+        img_tag = a_tag.select_one("img.goodDescriptionImg")
+        name_tag = a_tag.select_one("span.goodDescriptionName")
+
+        results.append({
+            "name": name_tag.get_text(strip=True) if name_tag else "",
+            "image_url": img_tag["src"] if img_tag else "",
+            "modification_url": urljoin(BASE_URL, a_tag["href"])
+        })
+
+    return results
+
+def save_brand(task, models):
+    category, brand, tmp_file = task
+    brand_result = {
+        "brand": brand["name"],
+        "type": category,
+        "image_url": brand["image_url"],
+        "models": models
+    }
+
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(brand_result, f, ensure_ascii=False, indent=2)
+    return brand_result
+
+def process_brand(task):
+    category, brand, _ = task
+    log(f"🔍 {category.upper()} → {brand['name']}")
+    return save_brand(task, parse_models_page(brand["link"]))
 
 def main():
     with open(INPUT_FILE, "r", encoding="utf-8") as f:
         brands_data = json.load(f)
 
     all_results = []
+    tasks = []
 
     for category in ["foreign", "native", "moto"]:
         for brand in brands_data.get(category, []):
             name = brand["name"]
-            brand_url = brand["link"]
-            image_url = brand["image_url"]
             safe_name = name.replace(" ", "_").replace("/", "_")
             tmp_file = os.path.join(TMP_DIR, f"{category}_{safe_name}.json")
 
@@ -97,31 +145,37 @@ def main():
                     log(f"[WARNING] Повреждённый файл удалён: {tmp_file}")
                     os.remove(tmp_file)
 
-            log(f"🔍 {category.upper()} → {name}")
-            models = parse_models_page(brand_url)
-
-            brand_result = {
-                "brand": name,
-                "type": category,
-                "image_url": image_url,
-                "models": models
-            }
+            tasks.append((category, brand, tmp_file))
 
-            with open(tmp_file, "w", encoding="utf-8") as f:
-                json.dump(brand_result, f, ensure_ascii=False, indent=2)
+    def on_retry(task, attempt, delay, error):
+        log(f"[RETRY {attempt}] {error}, повтор через {delay:.0f} сек")
 
-            all_results.append(brand_result)
-            log(f"[OK] {name} — моделей: {len(models)}")
+    results = run_bounded(
+        process_brand, tasks, max_workers=THREADS,
+        retries=RETRIES - 1, backoff=RETRY_BACKOFF, max_delay=RETRY_MAX_DELAY, on_retry=on_retry,
+        name="stage10",
+    )
+    for task, brand_result in results:
+        if isinstance(brand_result, RetryLater):
+            # Все попытки неудачны — сохраняем бренд без моделей, как и раньше
+            budgets.pop(task[1]["link"], None)
+            brand_result = save_brand(task, [])
+        elif isinstance(brand_result, Exception):
+            log(f"[ERROR] {task[1]['name']} — {brand_result!r}")
+            continue
+        all_results.append(brand_result)
+        log(f"[OK] {brand_result['brand']} — моделей: {len(brand_result['models'])}")
 
     with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
         json.dump(all_results, f, ensure_ascii=False, indent=2)
 
     log(f"✅ Финальный результат сохранён в {OUTPUT_FILE}")
     log(f"📝 Рабочие прокси: {len(working_proxies)}")
+    log(format_budget_stats())
 
     with open(PROXY_ALIVE_FILE, "w", encoding="utf-8") as f:
         for proxy in working_proxies:
             f.write(proxy + "\n")
 
 if __name__ == "__main__":
-    main()
+    profile_main(main, logger=log)
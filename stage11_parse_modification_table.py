@@ -2,11 +2,16 @@ import json
 import os
 import re
 import time
-import requests
 from datetime import datetime
+from functools import lru_cache
 from threading import Lock
-from utils import load_proxies, get_proxy_dict, proxy_lock, MIRRORS, with_mirror
-from concurrent.futures import ThreadPoolExecutor
+from utils import (
+    open_proxy_pool, proxy_lock, with_mirror, stream_get,
+    mirror_router, quota_ledger, is_access_denied, is_rate_limited,
+    PageBlocked, MirrorUnavailable, ResponseTooLarge,
+    PageClassifier, PAGE_EMPTY, PAGE_SOFT_BLOCKED,
+    AdaptiveConcurrency, run_bounded, profile_main,
+)
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 from selenium import webdriver
@@ -16,7 +21,6 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-CHROME_DRIVER_PATH = ChromeDriverManager().install()
 
 # ---------- Константы ----------
 INPUT_FILE = "stage10_models_detailed.json"
@@ -25,13 +29,19 @@ OUTPUT_FILE = "stage11_modifications_detailed.json"
 PROXY_FILE = "proxies_cleaned.txt"
 TMP_DIR = "stage11_temp_results"
 LOG_DIR = "zapo_logs"
+# Жёсткие потолки; сколько задач реально в работе, решает AdaptiveConcurrency
 THREADS_REQUESTS = 100
 THREADS_SELENIUM = 10
+CONCURRENCY_START_REQUESTS = 20
+CONCURRENCY_START_SELENIUM = 3
 PAGE_TIMEOUT = 30
 RETRIES_REQUESTS = 10
-
-def is_rate_limited(html_text):
-    return 'Превышен лимит запросов в день' in html_text
+MAX_BODY_BYTES = 4 * 1024 * 1024  # страница таблицы модификаций заметно меньше
+# Строки таблицы или ненулевой счётчик — данные; «Модификаций: 0» — модель честно пустая
+PAGE_CLASSIFIER = PageClassifier(
+    [re.compile(r"Модификаций:\s*[1-9]"), re.compile(r"<tbody[^>]*>\s*<tr")],
+    empty=[re.compile(r"Модификаций:\s*0\D")],
+)
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
@@ -43,6 +53,7 @@ log_file_path = os.path.join(LOG_DIR, f"stage11_log_{datetime.now():%Y%m%d_%H%M%
 log_lock = Lock()
 save_lock = Lock()
 
+proxy_pool = open_proxy_pool(PROXY_FILE)
 good_proxies = []
 used_proxies = set()
 requests_phase_results = []
@@ -104,6 +115,11 @@ def get_pages_total(soup):
     except:
         return 1
 
+@lru_cache(maxsize=1)
+def chrome_driver_path() -> str:
+    """chromedriver скачивается при первом запуске браузера, а не при импорте модуля."""
+    return ChromeDriverManager().install()
+
 def setup_driver(proxy):
     options = Options()
     options.add_argument("--headless")
@@ -112,15 +128,14 @@ def setup_driver(proxy):
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument(f'--proxy-server=socks5://{proxy}')
     log(f"[PROXY] Используется: {proxy}")
-    service = Service(CHROME_DRIVER_PATH)
+    service = Service(chrome_driver_path())
     return webdriver.Chrome(service=service, options=options)
 
 def try_requests_first(url, proxy):
     try:
-        proxies = get_proxy_dict(proxy)
-        response = requests.get(url, headers=HEADERS, proxies=proxies, timeout=10)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, "html.parser")
+        response = stream_get(url, proxy, headers=HEADERS, max_bytes=MAX_BODY_BYTES)
+        if response.status == 200:
+            soup = response.soup()
             rows = extract_rows(soup)
             pages_total = get_pages_total(soup)
             table_found = bool(soup.select("table tr"))
@@ -147,9 +162,6 @@ def save_temp_file(item, rows, all_pages_loaded, pages_loaded, pages_total, tabl
             json.dump(enriched, f, ensure_ascii=False, indent=2)
     log(f"[SAVE] Временный файл сохранён: {filename}")
 
-def is_access_denied(html_text):
-    return "Access denied to" in html_text or "<title>Access Denied</title>" in html_text
-
 def prepare_requests_phase(item):
     filename = os.path.join(TMP_DIR, f"{safe_filename(item['brand'])}_{safe_filename(item['model'])}.json")
     if os.path.exists(filename):
@@ -159,42 +171,56 @@ def prepare_requests_phase(item):
             log(f"[SKIP] {item['brand']} | {item['model']} — уже полностью обработан.")
             return
 
-    proxy_list = load_proxies(PROXY_FILE)
     used_proxies_per_item = set()
     tried_mirrors = set()
 
-    for mirror in MIRRORS:
+    for mirror in mirror_router.order():
         url = with_mirror(item["modification_url"], mirror)
         mirror_limited = False
 
         for attempt in range(RETRIES_REQUESTS):
-            for proxy in proxy_list:
+            for _ in range(len(proxy_pool)):
+                proxy = proxy_pool.lease()
+                if proxy is None:
+                    break
                 if proxy in used_proxies_per_item:
+                    proxy_pool.release(proxy)
                     continue
                 used_proxies_per_item.add(proxy)
                 used_proxies.add(proxy)
+                started = time.monotonic()
+                released = False
 
                 try:
-                    proxies = get_proxy_dict(proxy)
-                    
-                    response = requests.get(url, headers=HEADERS, proxies=proxies, timeout=10)
-
-                    if is_access_denied(response.text):
-                        log(f"[ACCESS DENIED] {mirror} | {item['brand']} {item['model']} — доступ запрещён, пробуем другое зеркало.")
+                    # Лимит и отказ доступа распознаются по первым килобайтам, загрузка обрывается сразу.
+                    # Запрос привязан к своему прокси, поэтому одинаковые запросы из разных потоков не склеиваются.
+                    response = stream_get(url, proxy, headers=HEADERS, max_bytes=MAX_BODY_BYTES)
+                    elapsed = time.monotonic() - started
+                    released = True
+
+                    proxy_pool.release(proxy, ok=response.status == 200, latency=elapsed)
+                    mirror_router.report(mirror, response.status < 500, elapsed)
+                    kind = PAGE_CLASSIFIER.classify(response) if response.status == 200 else None
+                    if kind == PAGE_EMPTY:
+                        log(f"[EMPTY] {mirror} | {item['brand']} {item['model']} — у модели нет модификаций.")
+                        item["modification_url"] = with_mirror(item["modification_url"], "https://zapo.ru")
+                        save_temp_file(item, [], all_pages_loaded=True,
+                            pages_loaded=1, pages_total=1,
+                            table_found=False, modifications_expected=0)
+                        return
+                    if kind == PAGE_SOFT_BLOCKED:
+                        # Заглушка вместо страницы — дело в прокси, а не в зеркале
+                        proxy_pool.penalize(proxy)
+                        log(f"[SOFT BLOCK] {mirror} | {proxy} — страница без разметки сайта, пробуем другой прокси.")
                         continue
-
-                    if is_rate_limited(response.text):
-                        log(f"[LIMIT] {mirror} | {item['brand']} {item['model']} — превышен лимит, пробуем другое зеркало.")
-                        mirror_limited = True
-                        break  # выход из прокси-цикла, но не всей функции
-
-                    if response.status_code == 200:
-                        soup = BeautifulSoup(response.text, "html.parser")
+                    if response.status == 200:
+                        soup = response.soup()
                         expected_modifications = extract_expected_modifications(soup)
                         rows = extract_rows(soup)
                         
                         if len(rows) == 0:
                             log(f"[EMPTY TABLE] {mirror} | {item['brand']} {item['model']} — таблица пуста, пробуем другое зеркало.")
+                            mirror_router.report(mirror, False)
                             mirror_limited = True
                             break
                                                 
@@ -214,7 +240,27 @@ def prepare_requests_phase(item):
                             table_found=table_found, modifications_expected=expected_modifications)
                         requests_phase_results.append(item)
                         return
+                except PageBlocked as e:
+                    proxy_pool.release(proxy, ok=False, latency=time.monotonic() - started)
+                    if e.kind == "access_denied":
+                        log(f"[ACCESS DENIED] {mirror} | {item['brand']} {item['model']} — доступ запрещён, пробуем другое зеркало.")
+                    else:
+                        log(f"[ANTIBOT] {mirror} | {proxy} — {e}")
+                    continue
+                except MirrorUnavailable:
+                    # Страница лимита бывает и лимитом самого прокси
+                    proxy_pool.release(proxy, ok=False, latency=time.monotonic() - started)
+                    log(f"[LIMIT] {mirror} | {item['brand']} {item['model']} — превышен лимит, пробуем другое зеркало.")
+                    mirror_limited = True
+                    break  # выход из прокси-цикла, но не всей функции
+                except ResponseTooLarge as e:
+                    proxy_pool.release(proxy, ok=True, latency=time.monotonic() - started)
+                    log(f"[TOO LARGE] {mirror} | {item['brand']} {item['model']} — {e}")
+                    mirror_limited = True
+                    break
                 except Exception as e:
+                    if not released:
+                        proxy_pool.release(proxy, ok=False, latency=time.monotonic() - started)
                     log(f"[REQUESTS ERROR] {mirror} | {proxy} — {e}")
 
             if mirror_limited:
@@ -285,9 +331,9 @@ def selenium_phase(item):
     expected_modifications = None
 
     proxy_list_all = [item.get("proxy")] if "proxy" in item else []
-    proxy_list_all += [p for p in good_proxies + load_proxies(PROXY_FILE) if p not in proxy_list_all]
+    proxy_list_all += [p for p in good_proxies + proxy_pool.working() + proxy_pool.snapshot() if p not in proxy_list_all]
 
-    for mirror in MIRRORS:
+    for mirror in mirror_router.order():
         url = with_mirror(original_url, mirror)
         mirror_limited = False
 
@@ -338,11 +384,13 @@ def selenium_phase(item):
                     html = driver.page_source
                     
                     if is_access_denied(html):
+                        mirror_router.report_blocked(mirror, proxy)
                         log(f"[ACCESS DENIED] {mirror} | {item['brand']} {item['model']} — Selenium получил страницу отказа.")
                         continue
                     
                     driver.quit()
                     if is_rate_limited(html):
+                        mirror_router.report(mirror, False, blocked=quota_ledger.report_limit(mirror, proxy))
                         log(f"[LIMIT] {mirror} | {item['brand']} {item['model']} — лимит по зеркалу в Selenium.")
                         mirror_limited = True
                         break
@@ -382,8 +430,9 @@ def main():
     log(f"🔍 Всего моделей для обработки: {len(all_tasks)}")
 
     # 🔹 Фаза 1 — requests
-    # with ThreadPoolExecutor(max_workers=THREADS_REQUESTS) as executor:
-    #     list(tqdm(executor.map(prepare_requests_phase, all_tasks), total=len(all_tasks), desc="🌐 Requests-парсинг"))
+    # concurrency = AdaptiveConcurrency(CONCURRENCY_START_REQUESTS, ceiling=THREADS_REQUESTS, name="stage11/requests", logger=log)
+    # for _ in tqdm(run_bounded(concurrency.wrap(prepare_requests_phase), all_tasks, max_workers=THREADS_REQUESTS), total=len(all_tasks), desc="🌐 Requests-парсинг"):
+    #     pass
 
     # 🔹 Фаза 2 — читаем TMP-файлы, обрабатываем не завершённые
     requests_phase_results.clear()
@@ -398,8 +447,15 @@ def main():
     log(f"🧠 Передано в Selenium-фазу: {len(requests_phase_results)} моделей")
 
     # 🔹 Фаза 3 — Selenium
-    with ThreadPoolExecutor(max_workers=THREADS_SELENIUM) as executor:
-        list(tqdm(executor.map(selenium_phase, requests_phase_results), total=len(requests_phase_results), desc="🧠 Selenium-парсинг"))
+    concurrency = AdaptiveConcurrency(CONCURRENCY_START_SELENIUM, ceiling=THREADS_SELENIUM, name="stage11/selenium", logger=log)
+    selenium_results = run_bounded(
+        concurrency.wrap(selenium_phase), requests_phase_results, max_workers=THREADS_SELENIUM, name="stage11/selenium",
+        concurrency=concurrency,
+    )
+    for item, result in tqdm(selenium_results, total=len(requests_phase_results), desc="🧠 Selenium-парсинг"):
+        if isinstance(result, Exception):
+            log(f"[ERROR] {item.get('brand')} | {item.get('model')} — {result!r}")
+    log(f"[КОНКУРЕНТНОСТЬ] {concurrency}")
 
     # 🔹 Фаза 4 — сбор всех результатов
     final_data = []
@@ -422,4 +478,4 @@ def main():
         log("✅ Все модели успешно обработаны.")
 
 if __name__ == "__main__":
-    main()
+    profile_main(main, logger=log)
@@ -2,6 +2,7 @@ import json
 import pandas as pd
 from datetime import datetime
 import os
+from profiling import profile_main
 
 INPUT_DATA_FILE = "stage11_modifications_detailed.json"
 INPUT_BRANDS_FILE = "stage9_brands.json"
@@ -105,4 +106,4 @@ def main():
     write_log(df, LOG_DIR)
 
 if __name__ == "__main__":
-    main()
+    profile_main(main)
@@ -9,11 +9,13 @@ from itertools import product, combinations
 from collections import defaultdict
 from datetime import datetime
 from typing import List, Dict, Any
-from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from tqdm import tqdm
-from utils import load_proxies, fetch_with_proxies, MIRRORS, with_mirror
+from utils import (
+    load_proxies, fetch_page_with_proxies, mirror_router, with_mirror, open_proxy_pool, response_cache,
+    RetryBudget, format_budget_stats, Page, ProxyReplenisher, AdaptiveConcurrency, run_bounded, RetryLater, profile_main,
+)
 
 GROUPS_FILE = "groups.json"
 TEMP_DIR = "stage13_temp_results"
@@ -22,6 +24,7 @@ OUTPUT_DIR = os.path.join(TEMP_DIR, "sitemaps_output")
 ALL_FILTERS_JSON = os.path.join(TEMP_DIR, "all_filters.json")
 DONE_GROUPS_FILE = os.path.join(TEMP_DIR, "done_groups.json")
 
+# Жёсткие потолки; для сетевых задач сколько их реально в работе, решает AdaptiveConcurrency
 THREADS = 4
 LINK_VALIDATION_THREADS = 50
 
@@ -31,11 +34,23 @@ MAX_DYNAMIC_LINKS = 2_000_000
 
 PROXY_FILE = "proxies_cleaned.txt"
 PROXY_ALIVE_FILE = "proxies_alive.txt"
+PROXY_LOW_WATER = 50  # ниже этого числа доступных прокси запускается фоновое пополнение
 BASE_URL = "https://zapo.ru"
 MAX_URLS = 50_000
 MAX_XML_SIZE = 8 * 1024 * 1024
 REQUEST_TIMEOUT = 10
 RETRIES = 25
+# Неудачная группа откладывается в очередь с джиттером, поток берёт следующую
+RETRY_BACKOFF = 2
+RETRY_MAX_DELAY = 120
+# Бюджеты запросов: на группу (страница каталога со всеми повторами), на один вызов getFilters и на проверку ссылки
+GROUP_BUDGET_ATTEMPTS = 100
+GROUP_BUDGET_SECONDS = 15 * 60
+FILTERS_BUDGET_ATTEMPTS = 50
+FILTERS_BUDGET_SECONDS = 3 * 60
+VALIDATE_BUDGET_ATTEMPTS = 20
+CACHE_TTL = 7 * 24 * 3600
+MAX_BODY_BYTES = 8 * 1024 * 1024  # каталог и JSON фильтров
 HEADERS = {"User-Agent": "Mozilla/5.0"}
 USE_DYNAMIC_FILTERS = True
 FALLBACK_TO_STATIC_FILTERS = True
@@ -45,58 +60,62 @@ os.makedirs(TEMP_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(FILTERS_DIR, exist_ok=True)
 
-proxies = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE, logger=print)
+proxies = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE, logger=print)
 working_proxies: List[str] = []
 
 def reload_proxies():
     return load_proxies(PROXY_FILE, PROXY_ALIVE_FILE, check_alive=True, logger=print)
 
-def download_and_save_html(group_id: str) -> str:
-    url = f"{BASE_URL}/{group_id}_catalog"
-    html_path = os.path.join(TEMP_DIR, f"{group_id}.html")
-
-    for attempt in range(1, RETRIES + 1):
-        if os.path.exists(html_path):
-            with open(html_path, "r", encoding="utf-8") as f:
-                html = f.read()
-                if "<form" in html:
-                    return html
-            os.remove(html_path)
+# Перезагрузка (API + проверка живости) идёт в фоне, рабочие потоки её не ждут
+replenisher = ProxyReplenisher(proxies, reload_proxies, low_water=PROXY_LOW_WATER, logger=print)
+# Бюджет группы живёт между отложенными попытками
+group_budgets: Dict[str, RetryBudget] = {}
 
-        print(f"[{group_id}] Попытка загрузки #{attempt}")
-
-        try:
-            html, _ = fetch_with_proxies(
-                url, proxies, working_proxies,
-                headers=HEADERS,
-                retries=1,
-                timeout=REQUEST_TIMEOUT,
-                logger=print,
-                reload_proxies=reload_proxies,
-            )
-            if html and "<form" in html:
-                with open(html_path, "w", encoding="utf-8") as f:
-                    f.write(html)
-                return html
-        except Exception as e:
-            print(f"[{group_id}] ❌ Ошибка загрузки: {e}")
+def download_and_save_html(group_id: str, budget: RetryBudget | None = None) -> Page:
+    """
+    Загрузить страницу каталога группы (повторные запуски берут её из response_cache).
+    Одна попытка: повторы делает run_bounded через RetryLater в load_or_parse_filters.
+    """
+    url = f"{BASE_URL}/{group_id}_catalog"
+    if budget is not None and budget.exhausted:
+        raise RuntimeError(f"❌ Пропуск {group_id}: исчерпан бюджет запросов ({budget})")
 
-    raise RuntimeError(f"❌ Пропуск {group_id}: Не удалось загрузить HTML после {RETRIES} попыток")
+    page, _ = fetch_page_with_proxies(
+        mirror_router.route(url), proxies, working_proxies,
+        headers=HEADERS,
+        retries=1,
+        timeout=REQUEST_TIMEOUT,
+        logger=print,
+        reload_proxies=replenisher,
+        cache_ttl=CACHE_TTL,
+        max_bytes=MAX_BODY_BYTES,
+        budget=budget,
+    )
+    if page and b"<form" in page.content:
+        return page
+    response_cache.invalidate(url, HEADERS)
+    raise RuntimeError(f"❌ Не удалось загрузить HTML каталога {group_id}")
 
 def is_valid_catalog_url_with_mirrors(url: str) -> bool:
-    for mirror in MIRRORS:
+    budget = RetryBudget(VALIDATE_BUDGET_ATTEMPTS, name="stage13:validate")
+    for mirror in mirror_router.order():
+        if budget.exhausted:
+            break
         test_url = with_mirror(url, mirror)
-        html, _ = fetch_with_proxies(
+        page, _ = fetch_page_with_proxies(
             test_url, proxies, working_proxies,
             headers=HEADERS,
             retries=3,
             timeout=REQUEST_TIMEOUT,
             logger=print,
-            reload_proxies=reload_proxies,
+            reload_proxies=replenisher,
+            cache_ttl=CACHE_TTL,
+            max_bytes=MAX_BODY_BYTES,
+            budget=budget,
         )
-        if not html:
+        if not page:
             continue
-        soup = BeautifulSoup(html, "lxml")
+        soup = page.soup("lxml")
         warning_div = soup.select_one("div.fr-alert.fr-alert-warning")
         if warning_div and "Товаров с указанными параметрами не найдено" in warning_div.text:
             continue
@@ -107,19 +126,17 @@ def validate_links_parallel(urls: List[str], max_workers: int = LINK_VALIDATION_
     if not urls:
         return []    
     valid = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(is_valid_catalog_url_with_mirrors, url): url for url in urls}
-        for future in tqdm(as_completed(futures), total=len(futures), desc="🔍 Проверка ссылок"):
-            url = futures[future]
-            try:
-                if future.result():
-                    valid.append(url)
-            except Exception as e:
-                print(f"⚠️ Ошибка при проверке {url}: {e}")
+    concurrency = AdaptiveConcurrency(max(1, max_workers // 4), ceiling=max_workers, name="stage13/links", logger=print)
+    run = concurrency.wrap(is_valid_catalog_url_with_mirrors)
+    for url, result in tqdm(run_bounded(run, urls, max_workers=max_workers, name="stage13/links", concurrency=concurrency), total=len(urls), desc="🔍 Проверка ссылок"):
+        if isinstance(result, Exception):
+            print(f"⚠️ Ошибка при проверке {url}: {result}")
+        elif result:
+            valid.append(url)
     return valid
 
-def parse_filters(html: str) -> Dict[str, List[str]]:
-    soup = BeautifulSoup(html, "lxml")
+def parse_filters(page: Page) -> Dict[str, List[str]]:
+    soup = page.soup("lxml")
     form = soup.find("form", id="catalog-form")
     if not form:
         raise ValueError("Форма с id='catalog-form' не найдена")
@@ -134,24 +151,30 @@ def parse_filters(html: str) -> Dict[str, List[str]]:
 
 def load_or_parse_filters(group_id: str) -> Dict[str, List[str]]:
     json_path = os.path.join(FILTERS_DIR, f"{group_id}.json")
+    if os.path.exists(json_path):
+        with open(json_path, "r", encoding="utf-8") as f:
+            return json.load(f)
 
-    for attempt in range(1, RETRIES + 1):
-        if os.path.exists(json_path):
-            with open(json_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+    # Одна попытка; RetryLater — run_bounded повторит группу позже
+    budget = group_budgets.setdefault(
+        group_id, RetryBudget(GROUP_BUDGET_ATTEMPTS, GROUP_BUDGET_SECONDS, name="stage13:group")
+    )
+    if budget.exhausted:
+        group_budgets.pop(group_id, None)
+        raise RuntimeError(f"❌ Пропуск {group_id}: Не удалось получить фильтры ({budget})")
 
-        print(f"[{group_id}] Парсинг попытка #{attempt}")
-        try:
-            html = download_and_save_html(group_id)
-            filters = parse_filters(html)
-            with open(json_path, "w", encoding="utf-8") as f:
-                json.dump(filters, f, indent=2, ensure_ascii=False)
-            return filters
-        except Exception as e:
-            print(f"❌ Ошибка при парсинге фильтров для {group_id}: {e}")
-            continue
+    print(f"[{group_id}] Парсинг фильтров")
+    try:
+        page = download_and_save_html(group_id, budget)
+        filters = parse_filters(page)
+    except Exception as e:
+        print(f"❌ Ошибка при парсинге фильтров для {group_id}: {e}")
+        raise RetryLater(f"{group_id}: {e}")
 
-    raise RuntimeError(f"❌ Пропуск {group_id}: Не удалось получить фильтры")
+    group_budgets.pop(group_id, None)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(filters, f, indent=2, ensure_ascii=False)
+    return filters
 
 
 def generate_links_progressively(
@@ -183,6 +206,11 @@ def _fetch_dynamic_filters_cached(
     selected_tuple: tuple,
     exclude: str,
 ) -> Dict[str, Any]:
+    """
+    Фильтры getFilters для выбранных значений. Пустой или битый ответ — RetryLater:
+    lru_cache не запоминает исключения, поэтому при повторе группы запрос уйдёт снова,
+    а удачные ответы возьмутся из кеша.
+    """
     from urllib.parse import urlencode
 
     params = {
@@ -195,8 +223,8 @@ def _fetch_dynamic_filters_cached(
     for k, v in dict(selected_tuple).items():
         params.setdefault(f"property[{k}][]", []).append(v)
 
-    # 👉 Сформировать полный URL с query-параметрами
-    base_url = f"{BASE_URL}/{group_id}_catalog"
+    # 👉 Сформировать полный URL с query-параметрами (на зеркале от mirror_router)
+    base_url = mirror_router.route(f"{BASE_URL}/{group_id}_catalog")
     full_url = f"{base_url}?{urlencode(params, doseq=True)}"
 
     headers = {
@@ -206,7 +234,7 @@ def _fetch_dynamic_filters_cached(
         "Referer": base_url,
     }
 
-    html, _ = fetch_with_proxies(
+    page, _ = fetch_page_with_proxies(
         full_url,
         proxies,
         working_proxies,
@@ -214,19 +242,21 @@ def _fetch_dynamic_filters_cached(
         retries=RETRIES,
         timeout=REQUEST_TIMEOUT,
         logger=print,
-        reload_proxies=reload_proxies,
+        reload_proxies=replenisher,
+        cache_ttl=CACHE_TTL,
+        max_bytes=MAX_BODY_BYTES,
+        budget=RetryBudget(FILTERS_BUDGET_ATTEMPTS, FILTERS_BUDGET_SECONDS, name="stage13:filters"),
     )
 
-    if not html:
-        print(f"⚠️ Пустой ответ на fetchFilters для {group_id} с {selected_tuple=}, {exclude=}")
-        return {}
+    if not page:
+        raise RetryLater(f"пустой ответ на fetchFilters для {group_id} с {selected_tuple=}, {exclude=}")
 
     try:
-        return json.loads(html)
+        return json.loads(page.content)
     except Exception as e:
-        print(f"❌ Ошибка парсинга JSON для {group_id}: {e}")
-        print(f"↩️ Ответ: {html[:200]}...")
-        return {}
+        response_cache.invalidate(full_url, headers)
+        print(f"↩️ Ответ: {page.content[:200]!r}...")
+        raise RetryLater(f"ошибка парсинга JSON fetchFilters для {group_id}: {e}") from e
 
 def fetch_dynamic_filters(
     group_id: str,
@@ -243,7 +273,10 @@ def generate_links_dynamic(
     keys: List[str],
     max_depth: int = MAX_DEPTH,
 ) -> List[str]:
-    """Рекурсивная генерация ссылок, используя API getFilters с контролем глубины и количества."""
+    """
+    Рекурсивная генерация ссылок, используя API getFilters с контролем глубины и количества.
+    Незагруженные фильтры — RetryLater: неполный набор ссылок не сохраняется.
+    """
 
     links: List[str] = []
     seen: set[str] = set()
@@ -411,6 +444,8 @@ def process_group(
 
         return gz_files
 
+    except RetryLater:
+        raise
     except Exception as e:
         print(f"❌ Ошибка в группе {gid}: {e}")
         return []
@@ -450,30 +485,54 @@ def main():
         try:
             filters = load_or_parse_filters(gid)
             return gid, filters
+        except RetryLater:
+            raise
         except Exception as e:
             print(f"❌ Пропуск {gid}: {e}")
             return gid, None
 
-    with ThreadPoolExecutor(max_workers=THREADS) as executor:
-        futures = {executor.submit(fetch_and_cache, g): g["id"] for g in groups}
-        for future in as_completed(futures):
-            gid, filters = future.result()
-            if filters:
-                all_filters[gid] = filters
+    concurrency = AdaptiveConcurrency(2, ceiling=THREADS, name="stage13/filters", logger=print)
+    run = concurrency.wrap(fetch_and_cache, succeeded=lambda result: result[1] is not None)
+    def on_retry(group, attempt, delay, error):
+        print(f"[{group['id']}] 🔁 Попытка {attempt} неудачна, повтор через {delay:.0f} сек")
+
+    filter_results = run_bounded(
+        run, groups, max_workers=THREADS,
+        retries=RETRIES - 1, backoff=RETRY_BACKOFF, max_delay=RETRY_MAX_DELAY, on_retry=on_retry,
+        name="stage13/filters", concurrency=concurrency,
+    )
+    for group, result in filter_results:
+        if isinstance(result, Exception):
+            group_budgets.pop(group["id"], None)
+            print(f"❌ Пропуск {group['id']}: {result}")
+            continue
+        gid, filters = result
+        if filters:
+            all_filters[gid] = filters
 
     with open(ALL_FILTERS_JSON, "w", encoding="utf-8") as f:
         json.dump(all_filters, f, indent=2, ensure_ascii=False)
 
-    with ThreadPoolExecutor(max_workers=THREADS) as executor:
-        futures = {
-            executor.submit(process_group, g, validate_links=VALIDATE_LINKS, remove_old=False): g["id"]
-            for g in groups
-        }
-        for future in as_completed(futures):
-            all_gz.extend(future.result())
+    concurrency = AdaptiveConcurrency(2, ceiling=THREADS, name="stage13/groups", logger=print)
+    run = concurrency.wrap(process_group)
+    def run_group(g: Dict[str, Any]) -> List[str]:
+        return run(g, validate_links=VALIDATE_LINKS, remove_old=False)
+
+    # Группа с незагруженными фильтрами откладывается целиком; удачные getFilters уже в кеше
+    group_results = run_bounded(
+        run_group, groups, max_workers=THREADS,
+        retries=RETRIES - 1, backoff=RETRY_BACKOFF, max_delay=RETRY_MAX_DELAY, on_retry=on_retry,
+        name="stage13/groups", concurrency=concurrency,
+    )
+    for g, result in group_results:
+        if isinstance(result, Exception):
+            print(f"❌ Группа {g['id']}: {result}")
+            continue
+        all_gz.extend(result)
 
     generate_index(all_gz)
+    print(format_budget_stats())
     print("🏁 Sitemap генерация завершена.")
 
 if __name__ == "__main__":
-    main()
+    profile_main(main, logger=print)
@@ -3,7 +3,7 @@ import requests
 from bs4 import BeautifulSoup
 import json
 from tqdm import tqdm
-from utils import load_proxies, fetch_with_proxies, MIRRORS, with_mirror
+from utils import open_proxy_pool, fetch_with_proxies, mirror_router, with_mirror, profile_main
 
 LOCAL_HTML = "base.html"
 REMOTE_URL = "https://zapo.ru/brandslist"
@@ -11,15 +11,17 @@ OUTPUT_JSON = "brands.json"
 PROXY_FILE = "proxies_cleaned.txt"
 PROXY_ALIVE_FILE = "proxies_alive.txt"
 HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
-proxies = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE)
+CACHE_TTL = 24 * 3600  # список брендов меняется редко
+proxies = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE)
 working_proxies: list[str] = []
 
 def fetch_html_from_site():
     print("🌐 Файл не найден — пробуем загрузить с сайта...")
-    for mirror in MIRRORS:
+    for mirror in mirror_router.order():
         url = with_mirror(REMOTE_URL, mirror)
         html, _ = fetch_with_proxies(
-            url, proxies, working_proxies, headers=HEADERS, retries=3, logger=print
+            url, proxies, working_proxies, headers=HEADERS, retries=3, logger=print,
+            cache_ttl=CACHE_TTL,
         )
         if html:
             return html
@@ -64,4 +66,4 @@ def main():
     print(f"✅ Успешно сохранено брендов: {len(brands)} → {OUTPUT_JSON}")
 
 if __name__ == "__main__":
-    main()
+    profile_main(main, logger=print)
@@ -3,25 +3,39 @@ import json
 import time
 import requests
 from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import re
 import idna
 from urllib.parse import urlparse, urlunparse
-from utils import load_proxies, fetch_with_proxies
+from utils import (
+    open_proxy_pool, fetch_with_proxies, RetryBudget, RoutingPolicy, AdaptiveConcurrency, format_budget_stats,
+    run_bounded, RetryLater, DIRECT, PROXIED, profile_main,
+)
 
 INPUT_FILE = 'brands.json'
 OUTPUT_FILE = 'stage2_sites.json'
 ERROR_LOG = 'stage2_errors.log'
-MAX_WORKERS = 10
+MAX_WORKERS = 10  # жёсткий потолок; сколько задач реально в работе, решает AdaptiveConcurrency
+CONCURRENCY_START = 5
 SAVE_EVERY = 5
 MAX_RETRIES = 25
+# Неудачный бренд откладывается в очередь (2, 4, 8… сек с джиттером), поток берёт следующий
+RETRY_BACKOFF = 2
+RETRY_MAX_DELAY = 120
+# Общий лимит на бренд: запросы внутри fetch_with_proxies и время с учётом отложенных повторов
+RETRY_BUDGET_ATTEMPTS = 60
+RETRY_BUDGET_SECONDS = 5 * 60
 BASE_URL = 'https://zapo.ru'
 PROXY_FILE = 'proxies_cleaned.txt'
 PROXY_ALIVE_FILE = 'proxies_alive.txt'
 HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
-proxies = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE)
+CACHE_TTL = 7 * 24 * 3600
+# Страницы брендов на zapo.ru — через прокси, абсолютные ссылки на чужие сайты — напрямую
+ROUTING = RoutingPolicy(mirrors=PROXIED, others=DIRECT)
+proxies = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE)
 working_proxies: list[str] = []
+# Бюджет бренда живёт между отложенными попытками
+budgets: dict[str, RetryBudget] = {}
 
 
 def load_json_file(filename):
@@ -104,7 +118,8 @@ def extract_company_site(html: str) -> str | None:
     return None
 
 
-def fetch_with_retries(brand, retries=MAX_RETRIES) -> dict | None:
+def fetch_with_retries(brand) -> dict | None:
+    """Одна попытка для бренда; RetryLater — run_bounded повторит её позже."""
     name = brand['name']
     brand_url = clean_url(brand['brand_page'])
     if not brand_url.startswith("http"):
@@ -123,30 +138,28 @@ def fetch_with_retries(brand, retries=MAX_RETRIES) -> dict | None:
         "Upgrade-Insecure-Requests": "1",
     }
 
-    backoff = 2  # стартовая задержка
-
-    for attempt in range(1, retries + 1):
-        try:
-            html, _ = fetch_with_proxies(
-                brand_url, proxies, working_proxies, headers=headers, retries=1
-            )
-            if not html:
-                raise Exception("empty response")
-            site = extract_company_site(html)
-            return {
-                'name': name,
-                'brand_page': brand_url,
-                'company_site': site
-            }
-
-        except Exception as e:
-            if attempt == retries:
-                log_error(f"{name} | {brand_url} | {str(e)}")
-                return None
-            else:
-                wait_time = backoff ** attempt
-                tqdm.write(f"⚠️ Ошибка для '{name}', попытка {attempt}/{retries}, ожидание {wait_time} сек...")
-                time.sleep(wait_time)
+    budget = budgets.setdefault(name, RetryBudget(RETRY_BUDGET_ATTEMPTS, RETRY_BUDGET_SECONDS, name="stage2"))
+    try:
+        html, _ = fetch_with_proxies(
+            brand_url, proxies, working_proxies, headers=headers, retries=1,
+            cache_ttl=CACHE_TTL, budget=budget, routing=ROUTING,
+        )
+        if not html:
+            raise Exception("empty response")
+        site = extract_company_site(html)
+    except Exception as e:
+        if budget.exhausted:
+            log_error(f"{name} | {brand_url} | {str(e)} | {budget}")
+            budgets.pop(name, None)
+            return None
+        raise RetryLater(f"{brand_url} | {e}")
+
+    budgets.pop(name, None)
+    return {
+        'name': name,
+        'brand_page': brand_url,
+        'company_site': site
+    }
 
 
 def merge_results(existing: list, new: list) -> list:
@@ -175,22 +188,33 @@ def main():
     results = []
     counter = 0
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(fetch_with_retries, brand): brand for brand in to_process}
+    concurrency = AdaptiveConcurrency(CONCURRENCY_START, ceiling=MAX_WORKERS, name="stage2", logger=tqdm.write)
+    run = concurrency.wrap(fetch_with_retries, succeeded=lambda result: result is not None)
+    def on_retry(brand, attempt, delay, error):
+        tqdm.write(f"⚠️ Ошибка для '{brand['name']}', попытка {attempt}/{MAX_RETRIES}, повтор через {delay:.0f} сек")
 
-        for future in tqdm(as_completed(futures), total=len(futures), desc="🔍 Сбор сайтов"):
-            result = future.result()
-            if result:
-                results.append(result)
-                counter += 1
-                if counter % SAVE_EVERY == 0:
-                    merged = merge_results(processed, results)
-                    save_json_file(OUTPUT_FILE, merged)
+    tasks = run_bounded(
+        run, to_process, max_workers=MAX_WORKERS,
+        retries=MAX_RETRIES - 1, backoff=RETRY_BACKOFF, max_delay=RETRY_MAX_DELAY, on_retry=on_retry,
+        name="stage2", concurrency=concurrency,
+    )
+    for brand, result in tqdm(tasks, total=len(to_process), desc="🔍 Сбор сайтов"):
+        if isinstance(result, Exception):
+            budget = budgets.pop(brand['name'], None)
+            log_error(f"{brand['name']} | {brand.get('brand_page')} | {str(result)} | {budget}")
+        elif result:
+            results.append(result)
+            counter += 1
+            if counter % SAVE_EVERY == 0:
+                merged = merge_results(processed, results)
+                save_json_file(OUTPUT_FILE, merged)
 
     merged = merge_results(processed, results)
     save_json_file(OUTPUT_FILE, merged)
     print(f"✅ Завершено. Всего сайтов собрано: {len(merged)}")
+    print(format_budget_stats())
+    print(f"[КОНКУРЕНТНОСТЬ] {concurrency}")
 
 
 if __name__ == '__main__':
-    main()
+    profile_main(main, logger=log_error)
@@ -3,22 +3,29 @@ import json
 import re
 import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin, urlsplit
 from tqdm import tqdm
 import phonenumbers
-from utils import load_proxies, fetch_with_proxies
+from utils import open_proxy_pool, fetch_page_with_proxies, RoutingPolicy, DIRECT, AdaptiveConcurrency, run_per_host, profile_main
 
 INPUT_FILE = 'stage2_sites.json'
 OUTPUT_FILE = 'stage3_contacts.json'
 PROCESSED_LOG = 'stage3_contacts_processed.json'
 ERROR_LOG = 'stage3_errors.log'
-MAX_WORKERS = 25
+MAX_WORKERS = 25  # жёсткий потолок; сколько задач реально в работе, решает AdaptiveConcurrency
+CONCURRENCY_START = 10
+# Вежливость к сайтам брендов: не больше PER_HOST задач на хост и старт не чаще раза в HOST_INTERVAL сек
+PER_HOST = 2
+HOST_INTERVAL = 1.0
 SAVE_EVERY = 5
 PROXY_FILE = 'proxies_cleaned.txt'
 PROXY_ALIVE_FILE = 'proxies_alive.txt'
 HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
-proxies = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE)
+CACHE_TTL = 7 * 24 * 3600
+MAX_BODY_BYTES = 2 * 1024 * 1024  # страница контактов — небольшой HTML
+# Сайты брендов — напрямую, прокси только после неудач хоста; пул прокси остаётся этапам zapo
+ROUTING = RoutingPolicy(others=DIRECT, fallback_after=2, fallback_for=30 * 60)
+proxies = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE)
 working_proxies: list[str] = []
 
 
@@ -58,10 +65,19 @@ def extract_contacts(html: str) -> dict:
 
 
 def try_fetch(url):
-    html, _ = fetch_with_proxies(
-        url, proxies, working_proxies, headers=HEADERS, retries=1
+    page, _ = fetch_page_with_proxies(
+        url, proxies, working_proxies, headers=HEADERS, retries=1,
+        cache_ttl=CACHE_TTL,
+        max_bytes=MAX_BODY_BYTES,
+        routing=ROUTING,
     )
-    return html
+    return page
+
+
+def site_host(brand) -> str:
+    """Хост сайта бренда — ключ для планировщика (www. и без него — один сайт)."""
+    host = urlsplit(brand.get('company_site') or '').netloc.lower()
+    return host[4:] if host.startswith('www.') else host
 
 
 def find_contact_page(base_url, html):
@@ -87,17 +103,20 @@ def process_site(brand):
         return None
 
     try:
-        html_main = try_fetch(site)
-        if not html_main:
+        page_main = try_fetch(site)
+        if not page_main:
             raise Exception('Главная страница недоступна')
+        html_main = page_main.text
 
         contact_data = extract_contacts(html_main)
 
-        contact_url = find_contact_page(site, html_main)
-        if contact_url and contact_url != site:
-            html_contact = try_fetch(contact_url)
-            if html_contact:
-                extra_data = extract_contacts(html_contact)
+        # Ссылка на контакты — от адреса после редиректов: запрос пойдёт по уже открытому соединению
+        base_url = page_main.final_url or site
+        contact_url = find_contact_page(base_url, html_main)
+        if contact_url and contact_url not in (site, base_url):
+            page_contact = try_fetch(contact_url)
+            if page_contact:
+                extra_data = extract_contacts(page_contact.text)
                 contact_data['emails'].extend(extra_data['emails'])
                 contact_data['phones'].extend(extra_data['phones'])
 
@@ -126,20 +145,23 @@ def main():
     results = []
     counter = 0
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_site, brand): brand for brand in to_process}
-        for future in tqdm(as_completed(futures), total=len(futures), desc="📥 Сбор контактов"):
-            try:
-                result = future.result(timeout=60)
-                if result:
-                    results.append(result)
-                    counter += 1
-                    if counter % SAVE_EVERY == 0:
-                        save_json(OUTPUT_FILE, results)
-                        save_json(PROCESSED_LOG, processed + results)
-            except Exception as e:
-                brand = futures[future]
-                log_error(f"{brand['name']} | {brand.get('company_site')} | future timeout/error: {str(e)}")
+    concurrency = AdaptiveConcurrency(CONCURRENCY_START, ceiling=MAX_WORKERS, name="stage3", logger=tqdm.write)
+    # Недоступный или медленный сайт бренда — забота run_per_host и ROUTING, а не общего лимита:
+    # неудачи в статистику не идут (None), лимит следит только за задержкой удачных загрузок
+    run = concurrency.wrap(process_site, succeeded=lambda result: True if result is not None else None)
+    tasks = run_per_host(
+        run, to_process, host=site_host,
+        max_workers=MAX_WORKERS, per_host=PER_HOST, min_interval=HOST_INTERVAL, name="stage3",
+    )
+    for brand, result in tqdm(tasks, total=len(to_process), desc="📥 Сбор контактов"):
+        if isinstance(result, Exception):
+            log_error(f"{brand['name']} | {brand.get('company_site')} | task error: {str(result)}")
+        elif result:
+            results.append(result)
+            counter += 1
+            if counter % SAVE_EVERY == 0:
+                save_json(OUTPUT_FILE, results)
+                save_json(PROCESSED_LOG, processed + results)
 
     save_json(OUTPUT_FILE, results)
     save_json(PROCESSED_LOG, processed + results)
@@ -147,4 +169,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    profile_main(main, logger=log_error)
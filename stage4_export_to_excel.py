@@ -4,6 +4,7 @@ import re
 from tqdm import tqdm
 from datetime import datetime
 import os
+from profiling import profile_main
 
 CONTACTS_FILE = 'stage3_contacts_processed.json'
 BRANDS_FILE = 'brands.json'
@@ -110,4 +111,4 @@ def split_and_export():
     write_log(log_text)
 
 if __name__ == '__main__':
-    split_and_export()
+    profile_main(split_and_export)
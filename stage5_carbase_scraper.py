@@ -1,20 +1,20 @@
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 import json
 from tqdm import tqdm
 import os
 from datetime import datetime
 import re
-from utils import load_proxies, fetch_with_proxies, MIRRORS, with_mirror
+from utils import open_proxy_pool, fetch_page_with_proxies, mirror_router, with_mirror, Page, profile_main
 
 BASE_URL = "https://zapo.ru"
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
 }
+CACHE_TTL = 7 * 24 * 3600
 PROXY_FILE = "proxies_cleaned.txt"
 PROXY_ALIVE_FILE = "proxies_alive.txt"
-proxies = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE)
+proxies = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE)
 working_proxies: list[str] = []
 OUTPUT_FILE = "stage5_carbase.json"
 LOG_DIR = "zapo_logs"
@@ -29,13 +29,14 @@ def log(message: str):
 
 
 def get_brands():
-    for mirror in MIRRORS:
+    for mirror in mirror_router.order():
         url = with_mirror(f"{BASE_URL}/carbase", mirror)
-        html, _ = fetch_with_proxies(
-            url, proxies, working_proxies, headers=HEADERS, retries=3, logger=log
+        page, _ = fetch_page_with_proxies(
+            url, proxies, working_proxies, headers=HEADERS, retries=3, logger=log,
+            cache_ttl=CACHE_TTL,
         )
-        if html:
-            soup = BeautifulSoup(html, 'html.parser')
+        if page:
+            soup = page.soup()
             break
     else:
         raise RuntimeError("Failed to load brands from all mirrors")
@@ -52,13 +53,18 @@ def get_brands():
 
 
 def get_models_and_versions(brand_name, brand_url):
-    html, _ = fetch_with_proxies(
-        brand_url, proxies, working_proxies, headers=HEADERS, retries=3, logger=log
+    page, _ = fetch_page_with_proxies(
+        mirror_router.route(brand_url), proxies, working_proxies, headers=HEADERS, retries=3, logger=log,
+        cache_ttl=CACHE_TTL,
     )
-    if not html:
+    if not page:
         log(f"[ERROR] {brand_name}: unable to load {brand_url}")
         return []
-    soup = BeautifulSoup(html, 'html.parser')
+    return extract_models_and_versions(page, brand_name, brand_url)
+
+
+def extract_models_and_versions(page: Page, brand_name, brand_url):
+    soup = page.soup()
 
     model_groups = {
         group['href'].replace("#group_", ""): group.get_text(strip=True)
@@ -126,4 +132,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    profile_main(main, logger=log)
@@ -1,13 +1,15 @@
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
+import asyncio
 import json
 import os
 import re
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from threading import Lock
-from utils import load_proxies, proxy_lock, fetch_with_proxies
+from utils import (
+    open_proxy_pool, proxy_lock, fetch_page_with_proxies, fetch_page_with_proxies_async, gather_bounded,
+    response_cache, Page, PageClassifier, PAGE_OK, PAGE_EMPTY, PAGE_SOFT_BLOCKED, AdaptiveConcurrency, run_bounded, RetryLater, profile_main,
+)
 import hashlib
 
 INPUT_FILE = "stage5_carbase.json"
@@ -16,7 +18,20 @@ TEMP_DIR = "stage6_temp_results"
 LOG_DIR = "zapo_logs"
 PROXY_FILE = "proxies_cleaned.txt"
 PROXY_ALIVE_FILE = "proxies_alive.txt"
-THREADS = 100
+THREADS = 100  # жёсткий потолок; сколько задач реально в работе, решает AdaptiveConcurrency
+CONCURRENCY_START = 20
+# Попытки на версию: неудачная откладывается в очередь с джиттером, поток берёт следующую
+RETRIES = 3
+RETRY_BACKOFF = 2
+CACHE_TTL = 7 * 24 * 3600
+MAX_BODY_BYTES = 4 * 1024 * 1024  # страница версии с таблицей модификаций
+# Строка таблицы модификаций — признак данных. Проверенного сообщения «модификаций нет»
+# у страницы версии нет: страница без строк повторяется (PAGE_NO_DATA) и лишь после
+# всех попыток сохраняется пустой
+PAGE_CLASSIFIER = PageClassifier([re.compile(r"<tr[^>]*onclick=")], empty=())
+# Асинхронный режим: один event loop вместо пула потоков
+ASYNC_MODE = os.getenv("ZAPO_ASYNC") == "1"
+ASYNC_CONCURRENCY = 10_000
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
@@ -27,6 +42,7 @@ os.makedirs(TEMP_DIR, exist_ok=True)
 log_file_path = os.path.join(LOG_DIR, f"carbase_versions_log_{datetime.now():%Y%m%d_%H%M%S}.txt")
 
 log_lock = Lock()
+alive_file_lock = Lock()
 alive_proxies = set()
 used_proxies = []
 
@@ -36,72 +52,119 @@ def log(message: str):
         with open(log_file_path, "a", encoding="utf-8") as f:
             f.write(message + "\n")
 
-proxies = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE)
+proxies = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE)
 
-def fetch_html(url: str) -> tuple[str | None, str | None]:
-    """Load *url* using :func:`utils.fetch_with_proxies` and track good proxies."""
-    html, proxy_used = fetch_with_proxies(
+def remember_alive(proxy_used: str | None):
+    """Дописать прокси в PROXY_ALIVE_FILE один раз; файл пишется уже без proxy_lock."""
+    if not proxy_used:
+        return
+    with proxy_lock:
+        if proxy_used in alive_proxies:
+            return
+        alive_proxies.add(proxy_used)
+    with alive_file_lock:
+        with open(PROXY_ALIVE_FILE, "a", encoding="utf-8") as f:
+            f.write(proxy_used + "\n")
+
+def fetch_page(url: str) -> tuple[Page | None, str | None]:
+    """Load *url* using :func:`utils.fetch_page_with_proxies` and track good proxies."""
+    page, proxy_used = fetch_page_with_proxies(
+        url,
+        proxies,
+        used_proxies,
+        headers=HEADERS,
+        retries=3,
+        logger=log,
+        cache_ttl=CACHE_TTL,
+        max_bytes=MAX_BODY_BYTES,
+    )
+    remember_alive(proxy_used)
+    return page, proxy_used
+
+async def fetch_page_async(url: str) -> tuple[Page | None, str | None]:
+    """Load *url* using :func:`utils.fetch_page_with_proxies_async` and track good proxies."""
+    page, proxy_used = await fetch_page_with_proxies_async(
         url,
         proxies,
         used_proxies,
         headers=HEADERS,
         retries=3,
         logger=log,
+        cache_ttl=CACHE_TTL,
+        max_bytes=MAX_BODY_BYTES,
     )
-    if proxy_used:
-        with proxy_lock:
-            if proxy_used not in alive_proxies:
-                alive_proxies.add(proxy_used)
-                with open(PROXY_ALIVE_FILE, "a", encoding="utf-8") as f:
-                    f.write(proxy_used + "\n")
-    return html, proxy_used
-
-def parse_version_details(version_url, exclude_proxy=None):
-    tried_proxies = set()
-    attempt = 0
-    while attempt < 3:
-        html, proxy_used = fetch_html(version_url)
-        if not html:
-            attempt += 1
+    # Известный прокси проверяется в памяти; запись нового — не на event loop
+    if proxy_used and proxy_used not in alive_proxies:
+        await asyncio.to_thread(remember_alive, proxy_used)
+    return page, proxy_used
+
+def extract_version_details(page: Page):
+    soup = page.soup()
+    rows = soup.select("table tr[onclick]")
+    details = []
+
+    for row in rows:
+        cols = row.find_all("td")
+        if len(cols) < 6:
             continue
 
-        soup = BeautifulSoup(html, "html.parser")
-        rows = soup.select("table tr[onclick]")
-        details = []
+        detail = {
+            "modification": cols[0].get_text(strip=True),
+            "production_years": cols[1].get_text(strip=True),
+            "fuel": cols[2].get_text(strip=True),
+            "power_hp": cols[3].get_text(strip=True),
+            "engine_code": cols[4].get_text(strip=True),
+            "engine_volume": cols[5].get_text(strip=True),
+        }
+
+        onclick = row.get("onclick", "")
+        match = re.search(r"location\.href='([^']+)'", onclick)
+        if match:
+            detail["modification_url"] = urljoin("https://zapo.ru", match.group(1))
+
+        details.append(detail)
 
-        for row in rows:
-            cols = row.find_all("td")
-            if len(cols) < 6:
-                continue
+    return details
 
-            detail = {
-                "modification": cols[0].get_text(strip=True),
-                "production_years": cols[1].get_text(strip=True),
-                "fuel": cols[2].get_text(strip=True),
-                "power_hp": cols[3].get_text(strip=True),
-                "engine_code": cols[4].get_text(strip=True),
-                "engine_volume": cols[5].get_text(strip=True),
-            }
+def parse_version_details(version_url):
+    """Модификации версии (одна попытка); RetryLater — run_bounded повторит её позже."""
+    page, proxy_used = fetch_page(version_url)
+    if not page:
+        raise RetryLater(f"не загружено: {version_url}")
 
-            onclick = row.get("onclick", "")
-            match = re.search(r"location\.href='([^']+)'", onclick)
-            if match:
-                detail["modification_url"] = urljoin("https://zapo.ru", match.group(1))
+    kind = PAGE_CLASSIFIER.classify(page)
+    if kind == PAGE_EMPTY:
+        log(f"[EMPTY] У версии нет модификаций: {version_url}")
+        return []
+    details = extract_version_details(page) if kind == PAGE_OK else []
+    if details:
+        return details
 
-            details.append(detail)
+    # Заглушка вместо страницы (или страница без данных) — в следующий раз с другим прокси
+    response_cache.invalidate(version_url)
+    if proxy_used and kind == PAGE_SOFT_BLOCKED:
+        proxies.penalize(proxy_used)
+    raise RetryLater(f"{kind}: {version_url}")
 
-        if details:
-            return details
+async def parse_version_details_async(version_url):
+    """Асинхронный вариант :func:`parse_version_details`; RetryLater повторит gather_bounded."""
+    page, proxy_used = await fetch_page_async(version_url)
+    if not page:
+        raise RetryLater(f"не загружено: {version_url}")
 
-        # 0 модификаций — пробуем с другим прокси
-        attempt += 1
-        if proxy_used:
-            tried_proxies.add(proxy_used)
-            with proxy_lock:
-                if proxy_used in proxies:
-                    proxies.remove(proxy_used)
+    kind = PAGE_CLASSIFIER.classify(page)
+    if kind == PAGE_EMPTY:
+        log(f"[EMPTY] У версии нет модификаций: {version_url}")
+        return []
+    details = await asyncio.to_thread(extract_version_details, page) if kind == PAGE_OK else []
+    if details:
+        return details
 
-    return []
+    # Заглушка вместо страницы (или страница без данных) — в следующий раз с другим прокси
+    response_cache.invalidate(version_url)
+    if proxy_used and kind == PAGE_SOFT_BLOCKED:
+        proxies.penalize(proxy_used)
+    raise RetryLater(f"{kind}: {version_url}")
 
 def hash_filename(url):
     return hashlib.md5(url.encode("utf-8")).hexdigest() + ".json"
@@ -115,7 +178,24 @@ def process_item(item):
     if os.path.exists(file_name):
         return  # Уже обработан
 
-    details = parse_version_details(version_url)
+    save_item(item, parse_version_details(version_url), file_name)
+    return True
+
+async def process_item_async(item):
+    """Асинхронный вариант :func:`process_item`."""
+    version_url = item.get("version_url")
+    if not version_url:
+        return
+
+    file_name = os.path.join(TEMP_DIR, hash_filename(version_url))
+    if os.path.exists(file_name):
+        return  # Уже обработан
+
+    details = await parse_version_details_async(version_url)
+    await asyncio.to_thread(save_item, item, details, file_name)
+    return True
+
+def save_item(item, details, file_name):
     item["modifications"] = details
 
     with open(file_name, "w", encoding="utf-8") as f:
@@ -123,6 +203,29 @@ def process_item(item):
 
     log(f"[OK] {item['brand']} | {item['model']} | {item['version']} — {len(details)} модификаций")
 
+async def run_async(remaining):
+    """Обработать все версии на одном event loop."""
+    failed = []
+    with tqdm(total=len(remaining), desc="📦 Модификации (async)") as progress:
+        def on_done(item, result):
+            progress.update()
+            if isinstance(result, RetryLater):
+                failed.append(item)
+            elif isinstance(result, Exception):
+                log(f"[ERROR] {item.get('version_url')} — {result!r}")
+
+        await gather_bounded(
+            process_item_async, remaining, concurrency=ASYNC_CONCURRENCY,
+            retries=RETRIES - 1, backoff=RETRY_BACKOFF, on_done=on_done,
+        )
+
+    # Все попытки — заглушки или ошибки: сохраняем пустой результат, как и раньше
+    def save_failed():
+        for item in failed:
+            save_item(item, [], os.path.join(TEMP_DIR, hash_filename(item["version_url"])))
+
+    await asyncio.to_thread(save_failed)
+
 def main():
     with open(INPUT_FILE, "r", encoding="utf-8") as f:
         versions = json.load(f)
@@ -133,8 +236,22 @@ def main():
     log(f"🔍 Всего версий: {len(versions)}")
     log(f"➡️ Осталось обработать: {len(remaining)}")
 
-    with ThreadPoolExecutor(max_workers=THREADS) as executor:
-        list(tqdm(executor.map(process_item, remaining), total=len(remaining), desc="📦 Модификации"))
+    if ASYNC_MODE:
+        asyncio.run(run_async(remaining))
+    else:
+        concurrency = AdaptiveConcurrency(CONCURRENCY_START, ceiling=THREADS, name="stage6", logger=log)
+        run = concurrency.wrap(process_item, succeeded=lambda result: result)
+        tasks = run_bounded(
+            run, remaining, max_workers=THREADS, retries=RETRIES - 1, backoff=RETRY_BACKOFF, name="stage6",
+            concurrency=concurrency,
+        )
+        for item, result in tqdm(tasks, total=len(remaining), desc="📦 Модификации"):
+            if isinstance(result, RetryLater):
+                # Все попытки — заглушки или ошибки: сохраняем пустой результат, как и раньше
+                save_item(item, [], os.path.join(TEMP_DIR, hash_filename(item["version_url"])))
+            elif isinstance(result, Exception):
+                log(f"[ERROR] {item.get('version_url')} — {result!r}")
+        log(f"[КОНКУРЕНТНОСТЬ] {concurrency}")
 
     # Финальное объединение
     all_data = []
@@ -149,4 +266,4 @@ def main():
     log(f"📝 Лог файл: {log_file_path}")
 
 if __name__ == "__main__":
-    main()
+    profile_main(main, logger=log)
@@ -1,12 +1,15 @@
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
+import asyncio
 import json
 import os
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from threading import Lock
-from utils import load_proxies, proxy_lock, fetch_with_proxies
+from utils import (
+    open_proxy_pool, proxy_lock, fetch_page_with_proxies, fetch_page_with_proxies_async, gather_bounded,
+    response_cache, RetryBudget, format_budget_stats, Page, PageClassifier, PAGE_OK, PAGE_EMPTY,
+    AdaptiveConcurrency, run_bounded, RetryLater, profile_main,
+)
 
 # === Настройки ===
 INPUT_FILE = "stage6_versions_detailed.json"
@@ -15,8 +18,24 @@ PROXY_FILE = "proxies_cleaned.txt"
 PROXY_ALIVE_FILE = "proxies_alive.txt"
 TMP_DIR = "stage7_temp_results"
 LOG_DIR = "zapo_logs"
-THREADS = 1000
+THREADS = 1000  # жёсткий потолок; сколько задач (и потоков) реально в работе, решает AdaptiveConcurrency
+CONCURRENCY_START = 100
 RETRIES = 10
+# Неудачная модификация откладывается в очередь с джиттером, поток берёт следующую
+RETRY_BACKOFF = 1
+RETRY_MAX_DELAY = 60
+# Общий лимит запросов и времени на одну модификацию
+RETRY_BUDGET_ATTEMPTS = 40
+RETRY_BUDGET_SECONDS = 5 * 60
+CACHE_TTL = 7 * 24 * 3600
+MAX_BODY_BYTES = 16 * 1024 * 1024  # списки запчастей бывают очень длинными
+# Строка детали — признак данных. Проверенного сообщения «деталей нет» у страницы
+# модификации нет: страница без строк повторяется (PAGE_NO_DATA), а no_parts пишется,
+# только если такое сообщение добавят в empty
+PAGE_CLASSIFIER = PageClassifier(["data-goodsgroup"], empty=())
+# Асинхронный режим: один event loop вместо тысячи потоков
+ASYNC_MODE = os.getenv("ZAPO_ASYNC") == "1"
+ASYNC_CONCURRENCY = 20_000
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
@@ -37,29 +56,63 @@ def log(message: str):
             f.write(message + "\n")
 
 # === Загрузка прокси ===
-proxies = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE)
+proxies = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE)
 working_proxies = []
+# Бюджет модификации живёт между отложенными попытками (ключ — временный файл)
+budgets: dict[str, RetryBudget] = {}
 
 # === Получение HTML с прокси ===
-def fetch_html(url: str) -> str | None:
-    """Load *url* using :func:`utils.fetch_with_proxies`."""
-    html, _ = fetch_with_proxies(
+def fetch_page(url: str, budget: RetryBudget | None = None) -> Page | None:
+    """Load *url* using :func:`utils.fetch_page_with_proxies`."""
+    page, _ = fetch_page_with_proxies(
         url,
         proxies,
         working_proxies,
         headers=HEADERS,
         retries=1,
         logger=log,
+        cache_ttl=CACHE_TTL,
+        max_bytes=MAX_BODY_BYTES,
+        budget=budget,
     )
-    return html
+    return page
 
-# === Парсинг деталей на странице ===
-def parse_parts(modification_url):
-    html = fetch_html(modification_url)
-    if not html:
-        return []
+async def fetch_page_async(url: str, budget: RetryBudget | None = None) -> Page | None:
+    """Load *url* using :func:`utils.fetch_page_with_proxies_async`."""
+    page, _ = await fetch_page_with_proxies_async(
+        url,
+        proxies,
+        working_proxies,
+        headers=HEADERS,
+        retries=1,
+        logger=log,
+        cache_ttl=CACHE_TTL,
+        max_bytes=MAX_BODY_BYTES,
+        budget=budget,
+    )
+    return page
 
-    soup = BeautifulSoup(html, "html.parser")
+# === Парсинг деталей на странице ===
+def parse_parts(modification_url, budget=None):
+    """(разметка страницы, детали); разметка None — страницу загрузить не удалось."""
+    page = fetch_page(modification_url, budget)
+    if not page:
+        return None, []
+    kind = PAGE_CLASSIFIER.classify(page)
+    return kind, (extract_parts(page) if kind == PAGE_OK else [])
+
+async def parse_parts_async(modification_url, budget=None):
+    page = await fetch_page_async(modification_url, budget)
+    if not page:
+        return None, []
+    kind = PAGE_CLASSIFIER.classify(page)
+    if kind != PAGE_OK:
+        return kind, []
+    # Разбор HTML — в отдельном потоке, чтобы не задерживать event loop
+    return kind, await asyncio.to_thread(extract_parts, page)
+
+def extract_parts(page: Page):
+    soup = page.soup()
     rows = soup.select("tr[data-goodsgroup]")
     parts = []
 
@@ -93,8 +146,35 @@ def get_tmp_filename(brand, model, version, mod_name):
     safe_name = f"{brand}_{model}_{version}_{mod_name}".replace(" ", "_")
     return os.path.join(TMP_DIR, f"{safe_name}.json")
 
+# === Проверка уже обработанного файла ===
+def is_processed(filename):
+    """True, если во временном файле уже есть валидный результат (иначе файл удаляется)."""
+    if not os.path.exists(filename):
+        return False
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+        mods = existing.get("modifications", [])
+        if not mods or not (mods[0].get("parts") or mods[0].get("no_parts")):
+            raise ValueError("Empty parts in cached result")
+    except Exception:
+        log(f"[WARNING] Удаляю повреждённый файл: {filename}")
+        os.remove(filename)
+        return False
+    return True
+
+# === Сохранение результата модификации ===
+def save_parts(mod, parent_item, parts, filename):
+    mod["parts"] = parts
+    with save_lock:
+        full_structure = parent_item.copy()
+        full_structure["modifications"] = [mod]
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(full_structure, f, ensure_ascii=False, indent=2)
+
 # === Обработка одной модификации ===
-def process_modification(mod, parent_item, max_retries=RETRIES):
+def process_modification(mod, parent_item):
+    """Одна попытка; RetryLater — run_bounded повторит модификацию позже."""
     brand = parent_item["brand"]
     model = parent_item["model"]
     version = parent_item["version"]
@@ -102,40 +182,87 @@ def process_modification(mod, parent_item, max_retries=RETRIES):
     url = mod.get("modification_url")
     filename = get_tmp_filename(brand, model, version, mod_name)
 
-    # Проверка на уже обработанный и валидный файл
-    if os.path.exists(filename):
-        try:
-            with open(filename, "r", encoding="utf-8") as f:
-                existing = json.load(f)
-            mods = existing.get("modifications", [])
-            if not mods or not mods[0].get("parts"):
-                raise ValueError("Empty parts in cached result")
-        except Exception:
-            log(f"[WARNING] Удаляю повреждённый файл: {filename}")
-            os.remove(filename)
-        else:
-            return None
-
-    if not url:
+    if filename not in budgets and (is_processed(filename) or not url):
         return None
 
-    for attempt in range(1, max_retries + 1):
-        parts = parse_parts(url)
-        if parts:
-            mod["parts"] = parts
-            with save_lock:
-                full_structure = parent_item.copy()
-                full_structure["modifications"] = [mod]
-                with open(filename, "w", encoding="utf-8") as f:
-                    json.dump(full_structure, f, ensure_ascii=False, indent=2)
+    budget = budgets.setdefault(filename, RetryBudget(RETRY_BUDGET_ATTEMPTS, RETRY_BUDGET_SECONDS, name="stage7"))
+    kind, parts = parse_parts(url, budget) if not budget.exhausted else (None, [])
+    if parts:
+        save_parts(mod, parent_item, parts, filename)
+        log(f"[OK] {brand} | {model} | {version} | {mod_name} — {len(parts)} деталей")
+    elif kind == PAGE_EMPTY:
+        mod["no_parts"] = True
+        save_parts(mod, parent_item, [], filename)
+        log(f"[EMPTY] {brand} | {model} | {version} | {mod_name} — у модификации нет деталей")
+    elif budget.exhausted:
+        budgets.pop(filename, None)
+        log(f"[FAILED] {brand} | {model} | {version} | {mod_name} — исчерпан бюджет ({budget}, URL {url})")
+        return False
+    else:
+        response_cache.invalidate(url)
+        raise RetryLater(f"{brand} | {model} | {version} | {mod_name} — нет деталей ({kind or 'не загружено'})")
+    budgets.pop(filename, None)
+    return True
+
+async def process_modification_async(mod, parent_item):
+    """Асинхронный вариант :func:`process_modification`; RetryLater повторит gather_bounded."""
+    brand = parent_item["brand"]
+    model = parent_item["model"]
+    version = parent_item["version"]
+    mod_name = mod["modification"]
+    url = mod.get("modification_url")
+    filename = get_tmp_filename(brand, model, version, mod_name)
 
-            log(f"[OK] {brand} | {model} | {version} | {mod_name} — {len(parts)} деталей")
-            return True
-        else:
-            log(f"[RETRY {attempt}] {brand} | {model} | {version} | {mod_name} — нет деталей")
+    # Чтение файла — в отдельном потоке, чтобы не задерживать event loop
+    if filename not in budgets and (not url or await asyncio.to_thread(is_processed, filename)):
+        return None
 
-    log(f"[FAILED] {brand} | {model} | {version} | {mod_name} — не удалось после {max_retries} попыток (URL {url})")
-    return False
+    budget = budgets.setdefault(filename, RetryBudget(RETRY_BUDGET_ATTEMPTS, RETRY_BUDGET_SECONDS, name="stage7"))
+    kind, parts = await parse_parts_async(url, budget) if not budget.exhausted else (None, [])
+    if parts:
+        await asyncio.to_thread(save_parts, mod, parent_item, parts, filename)
+        log(f"[OK] {brand} | {model} | {version} | {mod_name} — {len(parts)} деталей")
+    elif kind == PAGE_EMPTY:
+        mod["no_parts"] = True
+        await asyncio.to_thread(save_parts, mod, parent_item, [], filename)
+        log(f"[EMPTY] {brand} | {model} | {version} | {mod_name} — у модификации нет деталей")
+    elif budget.exhausted:
+        budgets.pop(filename, None)
+        log(f"[FAILED] {brand} | {model} | {version} | {mod_name} — исчерпан бюджет ({budget}, URL {url})")
+        return False
+    else:
+        response_cache.invalidate(url)
+        raise RetryLater(f"{brand} | {model} | {version} | {mod_name} — нет деталей ({kind or 'не загружено'})")
+    budgets.pop(filename, None)
+    return True
+
+def on_retry(task, attempt, delay, error):
+    log(f"[RETRY {attempt}] {error}, повтор через {delay:.0f} сек")
+
+def report_result(task, result):
+    """Итог задачи: RetryLater после всех попыток — модификация не загружена."""
+    mod, parent = task
+    if isinstance(result, RetryLater):
+        fname = get_tmp_filename(parent["brand"], parent["model"], parent["version"], mod["modification"])
+        budgets.pop(fname, None)
+        log(f"[FAILED] {result} — не удалось после {RETRIES} попыток (URL {mod.get('modification_url')})")
+    elif isinstance(result, Exception):
+        log(f"[ERROR] {mod.get('modification')} — {result!r}")
+
+async def run_async(tasks, total):
+    """Обработать все модификации на одном event loop."""
+    with tqdm(total=total, desc="🔧 Обработка модификаций (async)") as progress:
+        def on_done(task, result):
+            progress.update()
+            report_result(task, result)
+
+        await gather_bounded(
+            lambda task: process_modification_async(*task),
+            tasks,
+            concurrency=ASYNC_CONCURRENCY,
+            retries=RETRIES - 1, backoff=RETRY_BACKOFF, max_delay=RETRY_MAX_DELAY, on_retry=on_retry,
+            on_done=on_done,
+        )
 
 # === Основной запуск ===
 def main():
@@ -145,19 +272,33 @@ def main():
     total_modifications = sum(len(v.get("modifications", [])) for v in versions)
     log(f"🔍 Загружено моделей: {len(versions)}, модификаций: {total_modifications}")
 
-    tasks = []
-    for item in versions:
-        for mod in item.get("modifications", []):
-            fname = get_tmp_filename(item["brand"], item["model"], item["version"], mod["modification"])
-            if not os.path.exists(fname):
-                tasks.append((mod, item))
-
-    log(f"➡️ К обработке осталось: {len(tasks)} модификаций")
-
-    with ThreadPoolExecutor(max_workers=THREADS) as executor:
-        futures = [executor.submit(process_modification, mod, parent) for mod, parent in tasks]
-        for _ in tqdm(as_completed(futures), total=len(futures), desc="🔧 Обработка модификаций"):
-            pass
+    # Задачи выдаются лениво: список из миллионов пар (mod, item) в памяти не строится
+    done_files = set(os.listdir(TMP_DIR))
+
+    def pending_tasks():
+        for item in versions:
+            for mod in item.get("modifications", []):
+                fname = get_tmp_filename(item["brand"], item["model"], item["version"], mod["modification"])
+                if os.path.basename(fname) not in done_files:
+                    yield mod, item
+
+    total = sum(1 for _ in pending_tasks())
+    log(f"➡️ К обработке осталось: {total} модификаций")
+
+    if ASYNC_MODE:
+        asyncio.run(run_async(pending_tasks(), total))
+    else:
+        concurrency = AdaptiveConcurrency(CONCURRENCY_START, ceiling=THREADS, name="stage7", logger=log)
+        # None — модификация уже обработана, в статистику не идёт
+        run = concurrency.wrap(lambda task: process_modification(*task), succeeded=lambda result: result)
+        results = run_bounded(
+            run, pending_tasks(), max_workers=THREADS,
+            retries=RETRIES - 1, backoff=RETRY_BACKOFF, max_delay=RETRY_MAX_DELAY, on_retry=on_retry,
+            name="stage7", concurrency=concurrency,
+        )
+        for task, result in tqdm(results, total=total, desc="🔧 Обработка модификаций"):
+            report_result(task, result)
+        log(f"[КОНКУРЕНТНОСТЬ] {concurrency}")
 
     # Сборка итогового JSON с защитой от повреждённых файлов
     final_data = []
@@ -174,10 +315,11 @@ def main():
 
     log(f"✅ Данные сохранены в {OUTPUT_FILE}")
     log(f"📝 Рабочие прокси: {len(working_proxies)}")
+    log(format_budget_stats())
 
     with open(PROXY_ALIVE_FILE, "w", encoding="utf-8") as f:
         for proxy in working_proxies:
             f.write(proxy + "\n")
 
 if __name__ == "__main__":
-    main()
+    profile_main(main, logger=log)
@@ -5,6 +5,7 @@ import pandas as pd
 from tqdm import tqdm
 from datetime import datetime
 import os
+from profiling import profile_main
 
 STAGE6_FILE = "stage6_versions_detailed.json"
 STAGE7_FILE = "stage7_parts_detailed.json"
@@ -147,4 +148,4 @@ def main():
     write_log(df, LOGS_DIR)
 
 if __name__ == "__main__":
-    main()
+    profile_main(main)
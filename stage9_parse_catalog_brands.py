@@ -1,12 +1,13 @@
 # stage1_parse_catalog_brands.py
 
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 import os
 import json
 from datetime import datetime
 from threading import Lock
-from utils import load_proxies, proxy_lock, fetch_with_proxies
+from utils import (
+    open_proxy_pool, proxy_lock, fetch_page_with_proxies, response_cache, RetryBudget, format_budget_stats, Page, profile_main,
+)
 
 # === Константы ===
 URLS = {
@@ -27,6 +28,10 @@ TMP_DIR = "stage9_temp_results"
 LOG_DIR = "zapo_logs"
 OUTPUT_FILE = "stage9_brands.json"
 RETRIES = 10
+# Общий лимит на категорию вместо RETRIES × RETRIES × число прокси
+RETRY_BUDGET_ATTEMPTS = 50
+RETRY_BUDGET_SECONDS = 10 * 60
+CACHE_TTL = 24 * 3600
 
 # === Инициализация ===
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -43,31 +48,36 @@ def log(message: str):
             f.write(message + "\n")
 
 # === Загрузка прокси ===
-proxies = load_proxies(PROXY_FILE, PROXY_ALIVE_FILE)
+proxies = open_proxy_pool(PROXY_FILE, PROXY_ALIVE_FILE)
 working_proxies = []
 
 # === Получение HTML через SOCKS5 прокси ===
-def fetch_html(url: str) -> str | None:
-    """Load *url* using :func:`utils.fetch_with_proxies`."""
-    html, _ = fetch_with_proxies(
+def fetch_page(url: str, budget: RetryBudget | None = None) -> Page | None:
+    """Load *url* using :func:`utils.fetch_page_with_proxies`."""
+    page, _ = fetch_page_with_proxies(
         url,
         proxies,
         working_proxies,
         headers=HEADERS,
         retries=RETRIES,
         logger=log,
+        cache_ttl=CACHE_TTL,
+        budget=budget,
     )
-    return html
+    return page
 
 # === Парсинг одной категории (foreign/native/moto) ===
 def parse_catalog(url):
+    budget = RetryBudget(RETRY_BUDGET_ATTEMPTS, RETRY_BUDGET_SECONDS, name="stage9")
     for attempt in range(1, RETRIES + 1):
-        html = fetch_html(url)
-        if not html:
+        if budget.exhausted:
+            break
+        page = fetch_page(url, budget)
+        if not page:
             log(f"[RETRY {attempt}] Не удалось получить HTML: {url}")
             continue
 
-        soup = BeautifulSoup(html, "html.parser")
+        soup = page.soup()
         blocks = soup.select("a.catalogAuto2dMarkLink")
 
         if blocks:
@@ -85,6 +95,7 @@ def parse_catalog(url):
             return results
 
         else:
+            response_cache.invalidate(url)
             log(f"[RETRY {attempt}] Блоки брендов не найдены в HTML: {url}")
 
     log(f"[FAILED] Не удалось получить данные по ссылке: {url}")
@@ -110,10 +121,11 @@ def main():
 
     log(f"✅ Финальный результат сохранён в {OUTPUT_FILE}")
     log(f"📝 Рабочие прокси: {len(working_proxies)}")
+    log(format_budget_stats())
 
     with open(PROXY_ALIVE_FILE, "w", encoding="utf-8") as f:
         for proxy in working_proxies:
             f.write(proxy + "\n")
 
 if __name__ == "__main__":
-    main()
+    profile_main(main, logger=log)
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+from utils import MirrorRouter, QuotaLedger
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Файлы, которые utils создаёт в рабочем каталоге (SQLite, http_cache), — во временном каталоге теста."""
+    monkeypatch.delenv("PROXY_API_KEY", raising=False)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def ledger(tmp_path):
+    """Свежий QuotaLedger в каталоге теста."""
+    return QuotaLedger(str(tmp_path / "quota.sqlite3"), refresh_interval=0)
+
+@pytest.fixture
+def routing(monkeypatch, ledger):
+    """Свежие quota_ledger и mirror_router (по utils.MIRRORS) вместо общих."""
+    monkeypatch.setattr(utils, "quota_ledger", ledger)
+    router = MirrorRouter(utils.MIRRORS, quota=ledger)
+    monkeypatch.setattr(utils, "mirror_router", router)
+    return router
+
+@pytest.fixture
+def serve(monkeypatch, routing):
+    """
+    serve(handler) подменяет utils.stream_get: handler(url, proxy, headers) возвращает Page
+    или бросает исключение. Возвращается список запросов (url, proxy, headers).
+    """
+    def install(handler):
+        requested = []
+
+        def fake_stream_get(url, proxy=None, *, headers=None, **kwargs):
+            requested.append((url, proxy, dict(headers or {})))
+            return handler(url, proxy, headers or {})
+
+        monkeypatch.setattr(utils, "stream_get", fake_stream_get)
+        return requested
+
+    return install
@@ -0,0 +1,59 @@
+import threading
+import time
+
+from utils import AdaptiveConcurrency, run_bounded
+
+def test_successes_raise_limit_up_to_ceiling():
+    concurrency = AdaptiveConcurrency(2, ceiling=4)
+    for _ in range(50):
+        concurrency.acquire()
+        concurrency.release(True, 0.1)
+    assert concurrency.limit == 4
+
+def test_failures_decrease_limit_multiplicatively():
+    concurrency = AdaptiveConcurrency(10, ceiling=10, decrease=0.5, cooldown=0, alpha=0.5)
+    for _ in range(3):
+        concurrency.acquire()
+        concurrency.release(False)
+    assert concurrency.limit < 10
+    assert concurrency.limit >= concurrency.floor
+
+def test_skipped_tasks_do_not_count():
+    concurrency = AdaptiveConcurrency(10, ceiling=10, cooldown=0, alpha=0.5)
+    for _ in range(20):
+        concurrency.acquire()
+        concurrency.release(None)
+    assert concurrency.limit == 10
+
+def test_wrap_reports_exceptions_as_failures():
+    concurrency = AdaptiveConcurrency(10, ceiling=10, decrease=0.5, cooldown=0, alpha=0.9)
+
+    @concurrency.wrap
+    def task():
+        raise ValueError("boom")
+
+    try:
+        task()
+    except ValueError:
+        pass
+    assert concurrency.limit == 5
+
+def test_run_bounded_starts_threads_only_up_to_limit():
+    concurrency = AdaptiveConcurrency(3, ceiling=3)
+    threads, lock = set(), threading.Lock()
+    running, peak = [0], [0]
+
+    def task(n):
+        with lock:
+            threads.add(threading.current_thread().name)
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return n
+
+    results = dict(run_bounded(concurrency.wrap(task), range(30), max_workers=100, concurrency=concurrency))
+    assert results == {n: n for n in range(30)}
+    assert peak[0] <= 3
+    assert len(threads) <= 3
@@ -0,0 +1,29 @@
+import socket
+
+import utils
+from utils import Metrics
+
+def test_import_does_not_start_exporter():
+    assert utils.metrics._writer is None
+    assert not utils.metrics._exporting
+
+def test_busy_port_is_reported_to_logger_once(monkeypatch):
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", 0))
+        busy.listen()
+        monkeypatch.setattr(utils, "METRICS_PORT", str(busy.getsockname()[1]))
+        messages = []
+        registry = Metrics()
+        registry.start_from_env(messages.append)
+        registry.start_from_env(messages.append)
+    assert len(messages) == 1 and "[МЕТРИКИ]" in messages[0]
+
+def test_render_prometheus_text():
+    registry = Metrics()
+    registry.describe("zapo_fetches_total", "counter", "Загрузки")
+    registry.inc("zapo_fetches_total", result="ok")
+    registry.observe("zapo_http_request_seconds", 0.3)
+    text = registry.render()
+    assert '# TYPE zapo_fetches_total counter' in text
+    assert 'zapo_fetches_total{result="ok"} 1' in text
+    assert 'zapo_http_request_seconds_bucket{le="0.5"} 1' in text
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+import utils
+from utils import MirrorRouter
+
+A = "https://a.example"
+B = "https://b.example"
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое time.monotonic: clock[0] — текущее время."""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(utils, "MIRRORS", [A, B])
+    return MirrorRouter([A, B], failure_threshold=3, open_for=60, max_open_for=600, probe_grace=5)
+
+def test_opens_after_threshold(router, clock):
+    for _ in range(2):
+        router.report(A, False)
+    assert not router.is_open(A)
+    router.report(A, False)
+    assert router.is_open(A)
+    assert router.order() == [B]
+
+def test_blocked_opens_immediately(router, clock):
+    router.report(A, False, blocked=True)
+    assert router.is_open(A)
+    assert router.pick() == B
+
+def test_half_open_mirror_gets_probe_before_healthy_ones(router, clock):
+    router.report(A, False, blocked=True)
+    clock[0] += 61
+    assert router.snapshot()[A]["state"] == "half-open"
+    assert router.pick() == A
+    # Проба отдана одному вызывающему — остальные идут на здоровое зеркало
+    assert router.order() == [B]
+
+def test_probe_reoffered_if_not_sent(router, clock):
+    router.report(A, False, blocked=True)
+    clock[0] += 61
+    assert router.pick() == A
+    clock[0] += 6  # за probe_grace запрос так и не ушёл
+    assert router.pick() == A
+
+def test_probe_in_flight_is_not_reoffered(router, clock):
+    router.report(A, False, blocked=True)
+    clock[0] += 61
+    assert router.pick() == A
+    router.started(A)
+    clock[0] += 30
+    assert router.order() == [B]
+
+def test_order_alone_does_not_start_probe(router, clock):
+    router.report(A, False, blocked=True)
+    clock[0] += 61
+    router.order(exclude=[A])  # зеркало даже не предлагалось
+    assert router.pick() == A
+
+def test_successful_probe_closes(router, clock):
+    router.report(A, False, blocked=True)
+    clock[0] += 61
+    router.started(router.pick())
+    router.report(A, True, 0.2)
+    assert router.snapshot()[A]["state"] == "closed"
+    assert set(router.order()) == {A, B}
+
+def test_failed_probe_doubles_open_time(router, clock):
+    router.report(A, False, blocked=True)
+    clock[0] += 61
+    router.started(router.pick())
+    router.report(A, False)
+    clock[0] += 61
+    assert router.is_open(A)
+    clock[0] += 60
+    assert router.pick() == A
+
+def test_late_failures_do_not_extend_open_circuit(router, clock):
+    router.report(A, False, blocked=True)
+    clock[0] += 30
+    router.report(A, False)
+    clock[0] += 31
+    assert not router.is_open(A)
+
+def test_route_rewrites_to_picked_mirror(router, clock):
+    router.report(A, False, blocked=True)
+    assert router.route(f"{A}/carbase/1?x=1") == f"{B}/carbase/1?x=1"
+
+def test_route_keeps_url_when_all_open(router, clock):
+    router.report(A, False, blocked=True)
+    router.report(B, False, blocked=True)
+    assert router.route(f"{A}/carbase/1") == f"{A}/carbase/1"
+
+def test_access_denied_from_one_proxy_does_not_open(router, clock):
+    assert not router.report_blocked(A, "10.0.0.1:1080")
+    assert not router.report_blocked(A, "10.0.0.1:1080")
+    assert not router.is_open(A)
+
+def test_access_denied_from_two_sources_opens(router, clock):
+    assert not router.report_blocked(A, "10.0.0.1:1080")
+    assert router.report_blocked(A, None)
+    assert router.is_open(A)
+
+def test_success_forgets_block_sources(router, clock):
+    router.report_blocked(A, "10.0.0.1:1080")
+    router.report(A, True, 0.2)
+    assert not router.report_blocked(A, "10.0.0.2:1080")
+    assert not router.is_open(A)
+
+def test_block_pages_count_as_failures(router, clock):
+    for n in range(3):
+        router.report_blocked(A, "10.0.0.1:1080")
+    assert router.is_open(A)
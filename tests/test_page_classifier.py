@@ -0,0 +1,53 @@
+import re
+
+import fake_zapo
+from fake_zapo import Catalog
+from utils import (
+    PAGE_EMPTY, PAGE_NO_DATA, PAGE_OK, PAGE_SOFT_BLOCKED, Page, PageClassifier,
+)
+
+CATALOG = Catalog()
+# Те же признаки, что у этапов 7 и 11
+PARTS = PageClassifier(["data-goodsgroup"], empty=())
+TABLE = PageClassifier(
+    [re.compile(r"Модификаций:\s*[1-9]"), re.compile(r"<tbody[^>]*>\s*<tr")],
+    empty=[re.compile(r"Модификаций:\s*0\D")],
+)
+
+def page(html: str, encoding: str = "utf-8") -> Page:
+    return Page("https://zapo.ru/x", 200, html.encode(encoding), encoding, {})
+
+def test_page_with_data_is_ok():
+    assert PARTS.classify(page(fake_zapo.modification_page(CATALOG, "/mod/0/0/0/0"))) == PAGE_OK
+    assert TABLE.classify(page(fake_zapo.data_table_page(CATALOG, "1", "0", 1))) == PAGE_OK
+
+def test_verified_empty_marker_is_empty():
+    empty_table = fake_zapo.data_table_page(CATALOG._replace(table_rows=0), "1", "0", 1)
+    assert TABLE.classify(page(empty_table)) == PAGE_EMPTY
+
+def test_empty_marker_in_cp1251():
+    empty_table = fake_zapo.data_table_page(CATALOG._replace(table_rows=0), "1", "0", 1)
+    assert TABLE.classify(page(empty_table, "cp1251")) == PAGE_EMPTY
+
+def test_not_found_text_alone_is_not_empty():
+    # Предупреждение фильтра каталога — не ответ «деталей нет»
+    alert = fake_zapo.catalog_page(CATALOG, "1000", {"action": ["search"]})
+    assert "не найдено" in alert
+    assert PARTS.classify(page(alert)) == PAGE_NO_DATA
+    assert TABLE.classify(page(alert)) == PAGE_NO_DATA
+
+def test_mirror_page_without_data_is_no_data():
+    assert PARTS.classify(page(fake_zapo.models_page(CATALOG, "CARS_FOREIGN", "1"))) == PAGE_NO_DATA
+
+def test_stub_and_truncated_pages_are_soft_blocked():
+    assert PARTS.classify(page(fake_zapo.SOFT_BLOCK_PAGE)) == PAGE_SOFT_BLOCKED
+    truncated = fake_zapo.models_page(CATALOG, "CARS_FOREIGN", "1")[:200]
+    assert PARTS.classify(page(truncated)) == PAGE_SOFT_BLOCKED
+
+def test_block_pages_are_reported_by_kind():
+    assert PARTS.classify(page(fake_zapo.LIMIT_PAGE)) == "rate_limited"
+    assert PARTS.classify(page(fake_zapo.BLOCK_PAGE)) == "access_denied"
+    assert PARTS.classify(page(fake_zapo.CHALLENGE_PAGE)) == "challenge"
+
+def test_classify_accepts_bytes():
+    assert PARTS.classify(fake_zapo.modification_page(CATALOG, "/m").encode()) == PAGE_OK
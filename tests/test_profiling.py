@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+import profiling
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_import_does_not_load_utils():
+    code = "import sys, profiling; print('utils' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
+
+def test_sample_mode_writes_reports(monkeypatch, workdir):
+    monkeypatch.setenv("ZAPO_PROFILE", "sample")
+    messages = []
+    assert profiling.profile_main(lambda: 42, name="stage_test", logger=messages.append) == 42
+    written = os.listdir(workdir / profiling.PROFILE_DIR)
+    assert sorted(os.path.splitext(name)[1] for name in written) == [".folded", ".txt"]
+    assert messages and messages[0].startswith("[ПРОФИЛЬ] sample")
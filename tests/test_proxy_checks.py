@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+import utils
+from utils import MirrorRouter, QuotaLedger
+
+A = "https://a.example"
+B = "https://b.example"
+
+@pytest.fixture
+def ledger(monkeypatch, tmp_path):
+    ledger = QuotaLedger(str(tmp_path / "quota.sqlite3"))
+    monkeypatch.setattr(utils, "quota_ledger", ledger)
+    return ledger
+
+def test_probe_target_with_single_mirror(monkeypatch, ledger):
+    monkeypatch.setattr(utils, "MIRRORS", [A])
+    monkeypatch.setattr(utils, "mirror_router", MirrorRouter([A], quota=ledger))
+    assert utils._probe_target() == A
+    utils.mirror_router.report(A, False, blocked=True)
+    assert utils._probe_target() == A
+
+def test_probe_target_skips_exhausted_mirror(monkeypatch, ledger):
+    monkeypatch.setattr(utils, "MIRRORS", [A, B])
+    monkeypatch.setattr(utils, "mirror_router", MirrorRouter([A, B], quota=ledger))
+    ledger.mark_limited(A)
+    assert utils._probe_target() == B
+
+def test_filter_alive_proxies_probes_one_mirror(monkeypatch, ledger):
+    monkeypatch.setattr(utils, "MIRRORS", [A, B])
+    monkeypatch.setattr(utils, "mirror_router", MirrorRouter([A, B], quota=ledger))
+    calls = []
+
+    async def fake_check(proxies, targets=None, *, concurrency=2000, **kwargs):
+        calls.append((list(proxies), targets, concurrency))
+        return list(proxies)[:1]
+
+    monkeypatch.setattr(utils, "check_proxies_async", fake_check)
+    if utils.aiohttp is None:
+        pytest.skip("aiohttp не установлен")
+    assert utils.filter_alive_proxies(["p1", "p2"], threads=7) == ["p1"]
+    (proxies, targets, concurrency), = calls
+    assert len(targets) == 1 and targets[0] in (A, B)
+    assert concurrency == 7
@@ -0,0 +1,98 @@
+import time
+
+import utils
+from utils import ProxyPool
+
+PROXIES = ["10.0.0.1:1080", "10.0.0.2:1080", "10.0.0.3:1080"]
+
+def test_lease_returns_known_proxy_and_tracks_in_flight():
+    pool = ProxyPool(PROXIES)
+    proxy = pool.lease()
+    assert proxy in PROXIES
+    pool.release(proxy)
+    assert pool.available() == len(PROXIES)
+
+def test_failure_puts_proxy_on_cooldown():
+    pool = ProxyPool(PROXIES, cooldown=60)
+    pool.release(PROXIES[0], ok=False)
+    assert pool.available() == len(PROXIES) - 1
+    leased = {pool.lease() for _ in range(50)}
+    assert PROXIES[0] not in leased
+
+def test_cooldown_expires(monkeypatch):
+    pool = ProxyPool(PROXIES[:1], cooldown=30)
+    pool.release(PROXIES[0], ok=False)
+    assert pool.lease() is None
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 31)
+    assert pool.lease() == PROXIES[0]
+
+def test_cooldown_grows_with_consecutive_failures_and_resets_on_success(monkeypatch):
+    pool = ProxyPool(PROXIES[:1], cooldown=10, max_cooldown=25)
+    pool.release(PROXIES[0], ok=False)
+    pool.release(PROXIES[0], ok=False)  # вторая ошибка подряд — 20 с
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 15)
+    assert pool.available() == 0
+    monkeypatch.setattr(time, "monotonic", lambda: now + 21)
+    assert pool.available() == 1
+    pool.release(PROXIES[0], ok=True, latency=0.1)
+    pool.release(PROXIES[0], ok=False)  # после успеха снова с 10 с
+    monkeypatch.setattr(time, "monotonic", lambda: now + 32)
+    assert pool.available() == 1
+
+def test_weighted_choice_prefers_fast_reliable_proxy():
+    pool = ProxyPool(PROXIES[:2], alpha=0.5)
+    for _ in range(10):
+        pool.release(PROXIES[0], ok=True, latency=0.1)
+        pool.release(PROXIES[1], ok=True, latency=3.0)
+    picks = []
+    for _ in range(500):
+        proxy = pool.lease()
+        picks.append(proxy)
+        pool.release(proxy)
+    assert picks.count(PROXIES[0]) > picks.count(PROXIES[1]) * 3
+
+def test_all_cooling_returns_none():
+    pool = ProxyPool(PROXIES)
+    for proxy in PROXIES:
+        pool.release(proxy, ok=False)
+    assert pool.lease() is None
+
+def test_replace_keeps_stats_of_surviving_proxies():
+    pool = ProxyPool(PROXIES)
+    pool.release(PROXIES[0], ok=True, latency=0.2)
+    pool.release(PROXIES[1], ok=False)
+    pool.replace([PROXIES[0], PROXIES[1], "10.0.0.9:1080"])
+    assert set(pool.snapshot()) == {PROXIES[0], PROXIES[1], "10.0.0.9:1080"}
+    assert pool.working() == [PROXIES[0]]
+    assert pool.available() == 2  # PROXIES[1] остался на cooldown
+
+def test_remove_and_readd_slot():
+    pool = ProxyPool(PROXIES)
+    assert pool.remove(PROXIES[1])
+    assert PROXIES[1] not in pool
+    assert pool.add(["10.0.0.9:1080"]) == 1
+    assert len(pool) == 3
+    leased = {pool.lease() for _ in range(100)}
+    assert PROXIES[1] not in leased
+
+def test_penalize_after_release():
+    pool = ProxyPool(PROXIES[:1])
+    proxy = pool.lease()
+    pool.release(proxy, ok=True, latency=0.1)
+    pool.penalize(proxy)
+    assert pool.lease() is None
+
+def test_list_pool_keeps_stats_between_calls():
+    proxies = list(PROXIES)
+    pool = utils._pool_for_list(proxies)
+    pool.release(PROXIES[0], ok=True, latency=0.1)
+    assert utils._pool_for_list(proxies) is pool
+    assert pool.working() == [PROXIES[0]]
+    # Состав списка изменился — пул сверяется, статистика оставшихся сохраняется
+    proxies.remove(PROXIES[1])
+    assert utils._pool_for_list(proxies) is pool
+    assert set(pool) == {PROXIES[0], PROXIES[2]}
+    assert pool.working() == [PROXIES[0]]
+    assert utils._pool_for_list(list(PROXIES)) is not pool
@@ -0,0 +1,77 @@
+import pytest
+
+import utils
+from utils import MirrorUnavailable, Page, ProxyPool, QuotaLedger
+
+A = "https://a.example"
+B = "https://b.example"
+
+@pytest.fixture(autouse=True)
+def mirrors(monkeypatch):
+    monkeypatch.setattr(utils, "MIRRORS", [A, B])
+
+def test_single_source_does_not_exhaust_mirror(ledger):
+    assert not ledger.report_limit(f"{A}/carbase", "10.0.0.1:1080")
+    assert not ledger.report_limit(f"{A}/carbase", "10.0.0.1:1080")
+    assert not ledger.is_exhausted(A)
+
+def test_second_source_confirms_limit(ledger):
+    assert not ledger.report_limit(A, "10.0.0.1:1080")
+    assert ledger.report_limit(A, None)
+    assert ledger.is_exhausted(f"{A}/carbase/1")
+    assert not ledger.is_exhausted(B)
+    assert ledger.exhausted() == {A}
+
+def test_third_party_urls_are_ignored(ledger):
+    assert not ledger.report_limit("https://brand.example/", None)
+    ledger.count("https://brand.example/")
+    assert ledger.usage() == {}
+
+def test_limit_is_shared_through_database(ledger, tmp_path):
+    ledger.mark_limited(A)
+    other = QuotaLedger(str(tmp_path / "quota.sqlite3"), refresh_interval=0)
+    assert other.is_exhausted(A)
+
+def test_requests_are_counted_per_day(ledger):
+    ledger.count(f"{A}/x")
+    ledger.count(f"{A}/y", 2)
+    assert ledger.usage() == {A: 3}
+
+def test_day_rollover_resets_limit(ledger, monkeypatch):
+    monkeypatch.setattr(ledger, "today", lambda: "2026-01-01")
+    ledger.mark_limited(A)
+    ledger.report_limit(B, "10.0.0.1:1080")
+    assert ledger.is_exhausted(A)
+    monkeypatch.setattr(ledger, "today", lambda: "2026-01-02")
+    assert not ledger.is_exhausted(A)
+    # Источники лимита прошлых суток тоже не считаются
+    assert not ledger.report_limit(B, None)
+
+@pytest.fixture
+def routed(serve):
+    """Запросы через fake stream_get: зеркало A отвечает страницей лимита."""
+    def handler(url, proxy, headers):
+        if url.startswith(A):
+            raise MirrorUnavailable("дневной лимит")
+        return Page(url, 200, b"<html>ok</html>", "utf-8", {})
+
+    return serve(handler)
+
+def test_fetch_goes_to_other_mirror_when_exhausted(routed, ledger):
+    ledger.mark_limited(A)
+    page, proxy = utils.fetch_page_with_proxies(f"{A}/carbase/1", ProxyPool([]), retries=1)
+    assert page.url == f"{B}/carbase/1"
+    assert proxy is None
+    assert [url for url, _, _ in routed] == [f"{B}/carbase/1"]
+
+def test_fetch_reroutes_on_limit_page(routed):
+    # Попытка со страницей лимита потрачена, следующая идёт уже на другое зеркало
+    page, _ = utils.fetch_page_with_proxies(f"{A}/carbase/1", ProxyPool([]), retries=2)
+    assert page.url == f"{B}/carbase/1"
+    assert [url for url, _, _ in routed] == [f"{A}/carbase/1", f"{B}/carbase/1"]
+
+def test_fetch_gives_up_when_all_mirrors_exhausted(routed, ledger):
+    ledger.mark_limited(A)
+    ledger.mark_limited(B)
+    assert utils.fetch_page_with_proxies(f"{A}/carbase/1", ProxyPool([]), retries=1) == (None, None)
+    assert routed == []
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+import utils
+from utils import Page, ProxyPool, ResponseCache
+
+ZAPO = "https://zapo.ru/carbase/1"
+VINDOC = "https://vindoc.ru/carbase/1"
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / "http_cache"))
+
+def test_put_and_get(cache):
+    cache.put(ZAPO, None, b"<html>1</html>", "utf-8", '"v1"', "Mon, 01 Jan 2026 00:00:00 GMT")
+    entry = cache.get(ZAPO)
+    assert entry.content == b"<html>1</html>"
+    assert entry.page().status == 200
+    assert entry.is_fresh(60)
+    assert cache.get("https://zapo.ru/carbase/2") is None
+
+def test_key_is_shared_by_mirrors_and_varies_by_headers(cache):
+    assert cache.key(ZAPO) == cache.key(VINDOC)
+    assert cache.key(ZAPO, {"User-Agent": "a"}) == cache.key(ZAPO, {"User-Agent": "b"})
+    assert cache.key(ZAPO) != cache.key(ZAPO, {"X-Requested-With": "XMLHttpRequest"})
+    assert cache.key(ZAPO, {"accept": "application/json"}) == cache.key(ZAPO, {"Accept": "application/json"})
+
+def test_conditional_headers(cache):
+    headers = {"User-Agent": "ua"}
+    entry = cache.put(ZAPO, headers, b"x", None, '"v1"', "Mon, 01 Jan 2026 00:00:00 GMT")
+    conditional = entry.conditional_headers(headers)
+    assert conditional["If-None-Match"] == '"v1"'
+    assert conditional["If-Modified-Since"] == "Mon, 01 Jan 2026 00:00:00 GMT"
+    assert "If-None-Match" not in headers
+    plain = cache.put(ZAPO, None, b"x", None)
+    assert plain.conditional_headers(headers) is headers
+
+def test_invalidate(cache):
+    cache.put(ZAPO, None, b"x", None)
+    cache.invalidate(VINDOC)
+    assert cache.get(ZAPO) is None
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "http_cache"), max_bytes=10)
+    cache.put("https://zapo.ru/a", None, b"12345", None)
+    cache.put("https://zapo.ru/b", None, b"12345", None)
+    cache.get("https://zapo.ru/a")
+    cache.put("https://zapo.ru/c", None, b"12345", None)
+    assert cache.get("https://zapo.ru/b") is None
+    assert cache.get("https://zapo.ru/a") is not None
+
+def test_not_modified_returns_cached_page_and_refreshes(cache, monkeypatch):
+    monkeypatch.setattr(utils, "response_cache", cache)
+    entry = cache.put(ZAPO, None, b"<html>cached</html>", "utf-8", '"v1"')
+    entry.stored_at -= 3600
+    page = utils._cache_response(ZAPO, None, Page(ZAPO, 304, b"", None, {}), entry, 60)
+    assert page.content == b"<html>cached</html>"
+    assert page.status == 200
+    assert cache.get(ZAPO).is_fresh(60)
+
+@pytest.fixture
+def revalidating(monkeypatch, serve, cache):
+    """fetch_page_with_proxies на свежем кеше; сервер отвечает 304 на If-None-Match."""
+    monkeypatch.setattr(utils, "response_cache", cache)
+
+    def handler(url, proxy, headers):
+        if headers.get("If-None-Match") == '"v1"':
+            return Page(url, 304, b"", None, {})
+        return Page(url, 200, b"<html>fresh</html>", "utf-8", {"ETag": '"v1"'})
+
+    return serve(handler)
+
+def test_fetch_revalidates_stale_entry(revalidating, cache, monkeypatch):
+    fetch = lambda url: utils.fetch_page_with_proxies(url, ProxyPool([]), retries=1, cache_ttl=60)[0]
+    assert fetch(ZAPO).content == b"<html>fresh</html>"
+    assert len(revalidating) == 1
+
+    # Свежая запись — без сети, даже через другое зеркало
+    assert fetch(VINDOC).content == b"<html>fresh</html>"
+    assert len(revalidating) == 1
+
+    # Через час запись устарела — условный GET, 304 отдаёт тело из кеша
+    later = time.time() + 3600
+    monkeypatch.setattr(time, "time", lambda: later)
+    page = fetch(ZAPO)
+    assert revalidating[-1][2]["If-None-Match"] == '"v1"'
+    assert page.content == b"<html>fresh</html>"
+    assert cache.get(ZAPO).is_fresh(60)
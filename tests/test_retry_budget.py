@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+import utils
+from utils import ProxyPool, RetryBudget
+
+@pytest.fixture(autouse=True)
+def stats(monkeypatch):
+    monkeypatch.setattr(utils, "retry_budget_stats", {})
+    return utils.retry_budget_stats
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+def test_attempts_run_out(stats):
+    budget = RetryBudget(2, name="stage")
+    assert budget.spend()
+    assert budget.spend()
+    assert not budget.spend()
+    assert budget.exhausted
+    assert budget.reason == "attempts"
+    assert budget.spent == 2
+    assert stats == {("stage", "attempts"): 1}
+
+def test_deadline(clock, stats):
+    budget = RetryBudget(100, 30, name="stage")
+    assert budget.remaining() == 30
+    assert budget.spend()
+    clock[0] += 30
+    assert budget.remaining() == 0
+    assert not budget.spend()
+    assert budget.reason == "deadline"
+    assert stats == {("stage", "deadline"): 1}
+
+def test_exhaustion_is_counted_once(stats):
+    budget = RetryBudget(0, name="stage")
+    assert budget.exhausted
+    assert not budget.spend()
+    assert stats == {("stage", "attempts"): 1}
+    assert "stage/attempts=1" in utils.format_budget_stats()
+
+def test_no_deadline_keeps_timeouts():
+    budget = RetryBudget(5)
+    assert budget.remaining() is None
+    assert budget.timeout(10) == 10
+    assert budget.timeout((3, 10)) == (3, 10)
+
+def test_timeout_is_clamped_to_remaining_time(clock):
+    budget = RetryBudget(5, 4)
+    assert budget.timeout(10) == 4
+    assert budget.timeout((3, 10)) == (3, 4)
+    clock[0] += 4
+    assert budget.timeout(10) == 0.1
+    assert budget.timeout((3, 10)) == (0.1, 0.1)
+
+def test_sleep_stops_at_deadline(clock, monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, "sleep", slept.append)
+    RetryBudget(5, 2).sleep(10)
+    RetryBudget(5).sleep(10)
+    assert slept == [2, 10]
+
+def test_fetch_stops_when_budget_is_spent(serve):
+    def handler(url, proxy, headers):
+        raise ConnectionError("refused")
+
+    requests = serve(handler)
+    budget = RetryBudget(3)
+    pool = ProxyPool(["10.0.0.1:1080", "10.0.0.2:1080"])
+    page, proxy = utils.fetch_page_with_proxies("https://zapo.ru/carbase/1", pool, retries=10, budget=budget)
+    assert (page, proxy) == (None, None)
+    assert len(requests) == 3
+    assert budget.reason == "attempts"
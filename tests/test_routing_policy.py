@@ -0,0 +1,39 @@
+import time
+
+from utils import DIRECT, PROXIED, RoutingPolicy
+
+MIRROR = "https://zapo.ru/carbase"
+SITE = "https://brand.example/contacts"
+
+def test_mirrors_through_proxies_and_sites_direct():
+    routing = RoutingPolicy(overrides={"override.example": PROXIED})
+    assert routing.route(MIRROR) == PROXIED
+    assert routing.route(SITE) == DIRECT
+    assert routing.route("https://override.example/") == PROXIED
+
+def test_failing_site_falls_back_to_proxies_for_a_while(monkeypatch):
+    routing = RoutingPolicy(fallback_after=2, fallback_for=60)
+    routing.report(SITE, False)
+    assert routing.route(SITE) == DIRECT
+    routing.report(SITE, False)
+    assert routing.route(SITE) == PROXIED
+    assert routing.fallen_back() == ["brand.example"]
+    later = time.monotonic() + 61
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    assert routing.route(SITE) == DIRECT
+
+def test_success_resets_direct_failures():
+    routing = RoutingPolicy(fallback_after=2)
+    routing.report(SITE, False)
+    routing.report(SITE, True)
+    routing.report(SITE, False)
+    assert routing.route(SITE) == DIRECT
+
+def test_site_down_through_proxies():
+    routing = RoutingPolicy(down_after=2)
+    routing.report_proxied(SITE, False)
+    assert not routing.is_down(SITE)
+    routing.report_proxied(SITE, False)
+    assert routing.is_down(SITE)
+    routing.report_proxied(SITE, True)
+    assert not routing.is_down(SITE)
@@ -0,0 +1,106 @@
+import asyncio
+
+from utils import RetryLater, _retry_delay, gather_bounded, run_bounded
+
+def test_gather_bounded_retries_later_and_reports_item():
+    attempts = {}
+    done = []
+
+    async def worker(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == "flaky" and attempts[item] < 3:
+            raise RetryLater("ещё нет", delay=0.01)
+        return item.upper()
+
+    asyncio.run(gather_bounded(worker, ["flaky", "ok"], concurrency=2, retries=2, on_done=lambda *pair: done.append(pair)))
+    assert sorted(done) == [("flaky", "FLAKY"), ("ok", "OK")]
+    assert attempts == {"flaky": 3, "ok": 1}
+
+def test_gather_bounded_gives_up_after_retries():
+    retried = []
+    done = []
+
+    async def worker(item):
+        raise RetryLater(item, delay=0)
+
+    asyncio.run(gather_bounded(
+        worker, ["a"], retries=2,
+        on_retry=lambda item, attempt, delay, error: retried.append(attempt),
+        on_done=lambda item, result: done.append((item, type(result))),
+    ))
+    assert retried == [1, 2]
+    assert done == [("a", RetryLater)]
+
+def test_gather_bounded_delayed_task_does_not_hold_slot():
+    order = []
+
+    async def worker(item):
+        if item == "slow" and "slow" not in order:
+            order.append("slow")
+            raise RetryLater("позже", delay=0.05)
+        order.append(item)
+
+    asyncio.run(gather_bounded(worker, ["slow", "b", "c"], concurrency=1, retries=1))
+    assert order == ["slow", "b", "c", "slow"]
+
+def test_run_bounded_returns_every_item_and_errors():
+    def worker(item):
+        if item == 3:
+            raise ValueError("плохой")
+        return item * 2
+
+    results = dict(run_bounded(worker, range(5), max_workers=2))
+    assert {item: result for item, result in results.items() if item != 3} == {0: 0, 1: 2, 2: 4, 4: 8}
+    assert isinstance(results[3], ValueError)
+
+def test_run_bounded_keeps_window_of_tasks():
+    started = []
+    window = 3
+
+    def items():
+        for item in range(10):
+            started.append(item)
+            yield item
+
+    for item, _ in run_bounded(lambda item: item, items(), max_workers=1, window=window):
+        # Из итератора взято не больше window задач сверх уже отданных
+        assert len(started) <= item + 1 + window
+
+def test_run_bounded_retries_later_with_own_delay():
+    attempts = {}
+    retried = []
+
+    def worker(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if attempts[item] < 3:
+            raise RetryLater("ещё нет", delay=0.01)
+        return attempts[item]
+
+    results = list(run_bounded(
+        worker, ["a"], max_workers=1, retries=2,
+        on_retry=lambda item, attempt, delay, error: retried.append((attempt, delay)),
+    ))
+    assert results == [("a", 3)]
+    assert retried == [(1, 0.01), (2, 0.01)]
+
+def test_run_bounded_gives_up_with_retry_later():
+    def worker(item):
+        raise RetryLater("никогда", delay=0)
+
+    [(item, result)] = run_bounded(worker, ["a"], max_workers=1, retries=1)
+    assert isinstance(result, RetryLater)
+
+def test_run_bounded_delayed_task_frees_thread():
+    order = []
+
+    def worker(item):
+        if item == "slow" and "slow" not in order:
+            order.append("slow")
+            raise RetryLater("позже", delay=0.05)
+        order.append(item)
+
+    list(run_bounded(worker, ["slow", "b", "c"], max_workers=1, window=1, retries=1))
+    assert order == ["slow", "b", "c", "slow"]
+
+def test_retry_delay_is_capped():
+    assert all(0 <= _retry_delay(attempt, 1.0, 5.0) <= min(5.0, 2 ** (attempt - 1)) for attempt in range(1, 10))
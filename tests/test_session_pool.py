@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from utils import SessionPool
+
+def test_session_is_reused_per_proxy_and_host():
+    pool = SessionPool()
+    with pool.session(None, "https://zapo.ru/a") as first:
+        pass
+    with pool.session(None, "https://ZAPO.ru/b") as again:
+        assert again is first
+    with pool.session("10.0.0.1:1080", "https://zapo.ru/a") as proxied:
+        assert proxied is not first
+    assert len(pool) == 2
+
+def test_failed_request_drops_session():
+    pool = SessionPool()
+    with pytest.raises(ConnectionError):
+        with pool.session(None, "https://zapo.ru/a"):
+            raise ConnectionError("reset")
+    assert len(pool) == 0
+
+def test_idle_sessions_expire_and_overflow_is_evicted(monkeypatch):
+    pool = SessionPool(max_idle=2, idle_ttl=60)
+    for host in ("a", "b", "c"):
+        with pool.session(None, f"https://{host}.example/"):
+            pass
+    assert len(pool) == 2
+    later = time.monotonic() + 61
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    with pool.session(None, "https://d.example/"):
+        assert len(pool) == 0
@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import utils
+from utils import RetryBudget, SingleFlight
+
+def test_concurrent_calls_run_once():
+    flights = SingleFlight()
+    calls, results = [], []
+    release = threading.Event()
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "page"
+
+    def caller():
+        results.append(flights.do("k", work))
+
+    threads = [threading.Thread(target=caller) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [1]
+    assert results == ["page"] * 5
+    assert len(flights) == 0
+
+def test_error_reaches_every_waiter():
+    flights = SingleFlight()
+    errors = []
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        raise ValueError("boom")
+
+    def caller():
+        try:
+            flights.do("k", work)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 3
+    # После ошибки ключ свободен — следующий вызов выполняется заново
+    assert flights.do("k", lambda: "retry") == "retry"
+
+def test_different_keys_are_independent():
+    flights = SingleFlight()
+    assert flights.do("a", lambda: 1) == 1
+    assert flights.do("b", lambda: 2) == 2
+
+def test_do_async_coalesces():
+    flights = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "page"
+
+    async def main():
+        return await asyncio.gather(*(flights.do_async("k", work) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["page"] * 5
+    assert calls == [1]
+    assert len(flights) == 0
+
+def test_do_async_cancelled_waiter_keeps_shared_task():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "page"
+
+    async def main():
+        waiter = asyncio.ensure_future(flights.do_async("k", work))
+        other = asyncio.ensure_future(flights.do_async("k", work))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        return await other
+
+    assert asyncio.run(main()) == "page"
+
+@pytest.fixture
+def coalesced(monkeypatch):
+    """Обёртка _coalesced над медленной загрузкой; возвращает (fetch, calls, release)."""
+    monkeypatch.setattr(utils, "inflight_requests", SingleFlight())
+    calls = []
+    release = threading.Event()
+
+    @utils._coalesced
+    def fetch(url, *, headers=None, **kwargs):
+        calls.append((url, headers, kwargs))
+        release.wait(5)
+        return url, "10.0.0.1:1080"
+
+    return fetch, calls, release
+
+def fetch_concurrently(fetch, release, requests):
+    """requests — (url, headers, kwargs); результаты в порядке запуска потоков."""
+    results = [None] * len(requests)
+
+    def run(n, url, headers, kwargs):
+        results[n] = fetch(url, headers=headers, **kwargs)
+
+    threads = [threading.Thread(target=run, args=(n, *request)) for n, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)  # первый запущенный — ведущий
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+def test_same_page_on_different_mirrors_is_coalesced(coalesced):
+    fetch, calls, release = coalesced
+    results = fetch_concurrently(fetch, release, [
+        ("https://zapo.ru/carbase/1", {"User-Agent": "ua"}, {}),
+        ("https://vindoc.ru/carbase/1", {"user-agent": "ua"}, {}),
+    ])
+    assert len(calls) == 1
+    assert results[0] == ("https://zapo.ru/carbase/1", "10.0.0.1:1080")
+    # Прокси ведущего ведомому не принадлежит
+    assert results[1] == ("https://zapo.ru/carbase/1", None)
+
+def test_headers_paths_and_limits_are_not_coalesced(coalesced):
+    fetch, calls, release = coalesced
+    url = "https://zapo.ru/carbase/1"
+    fetch_concurrently(fetch, release, [
+        (url, None, {}),
+        (url, {"X-Requested-With": "XMLHttpRequest"}, {}),
+        (url, {"User-Agent": "other"}, {}),
+        ("https://zapo.ru/carbase/2", None, {}),
+        (url, None, {"max_bytes": 1024}),
+        (url, None, {"cache_ttl": 60}),
+    ])
+    assert len(calls) == 6
+
+def test_third_party_hosts_are_not_merged(coalesced):
+    fetch, calls, release = coalesced
+    fetch_concurrently(fetch, release, [
+        ("https://brand-a.example/", None, {}),
+        ("https://brand-b.example/", None, {}),
+    ])
+    assert len(calls) == 2
+
+def test_follower_is_charged_to_its_own_budget(coalesced):
+    fetch, calls, release = coalesced
+    url = "https://zapo.ru/carbase/1"
+    leader_budget, follower_budget, spent_budget = RetryBudget(5), RetryBudget(5), RetryBudget(0)
+    results = fetch_concurrently(fetch, release, [
+        (url, None, {"budget": leader_budget}),
+        (url, None, {"budget": follower_budget}),
+        (url, None, {"budget": spent_budget}),
+    ])
+    assert len(calls) == 1
+    assert follower_budget.spent == 1
+    assert results[1] == (url, None)
+    # Исчерпанный бюджет страницу не получает — как и без склейки
+    assert results[2] == (None, None)
+
+def test_async_follower_gets_no_proxy(monkeypatch):
+    monkeypatch.setattr(utils, "inflight_requests", SingleFlight())
+    calls = []
+
+    @utils._coalesced_async
+    async def fetch(url, *, headers=None, **kwargs):
+        calls.append(url)
+        await asyncio.sleep(0.05)
+        return url, "10.0.0.1:1080"
+
+    async def main():
+        return await asyncio.gather(fetch("https://zapo.ru/a"), fetch("https://vindoc.ru/a"))
+
+    assert asyncio.run(main()) == [("https://zapo.ru/a", "10.0.0.1:1080"), ("https://zapo.ru/a", None)]
+    assert calls == ["https://zapo.ru/a"]
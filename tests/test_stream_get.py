@@ -0,0 +1,59 @@
+import pytest
+
+import utils
+from fake_zapo import Faults, start_fake_zapo
+from utils import HEAD_BYTES, MirrorUnavailable, PageBlocked, ResponseTooLarge, _BodyReader
+
+@pytest.fixture
+def zapo(routing):
+    """Локальный fake_zapo без задержек; faults задаются через server.faults."""
+    server = start_fake_zapo(faults=Faults(latency=0, jitter=0))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_reads_page_with_encoding(zapo):
+    page = utils.stream_get(f"{zapo.base_url}/brandslist", timeout=5)
+    assert page.status == 200
+    assert page.encoding == "utf-8"
+    assert b"</html>" in page.content
+
+def test_limit_page_raises_mirror_unavailable(zapo):
+    zapo.faults = Faults(latency=0, jitter=0, limit_after=0)
+    with pytest.raises(MirrorUnavailable):
+        utils.stream_get(f"{zapo.base_url}/brandslist", timeout=5)
+
+@pytest.mark.parametrize("faults, kind", [
+    (Faults(latency=0, jitter=0, block_rate=1), "access_denied"),
+    (Faults(latency=0, jitter=0, challenge_rate=1), "challenge"),
+])
+def test_block_pages_raise_page_blocked(zapo, faults, kind):
+    zapo.faults = faults
+    with pytest.raises(PageBlocked) as error:
+        utils.stream_get(f"{zapo.base_url}/brandslist", timeout=5)
+    assert error.value.kind == kind
+
+def test_declared_length_over_max_bytes(zapo):
+    with pytest.raises(ResponseTooLarge):
+        utils.stream_get(f"{zapo.base_url}/brandslist", timeout=5, max_bytes=100)
+
+def test_body_over_max_bytes_without_length():
+    reader = _BodyReader("https://zapo.ru/", 100, None)
+    reader.feed(b"x" * 100)
+    with pytest.raises(ResponseTooLarge):
+        reader.feed(b"x")
+
+def test_marker_after_head_is_found_on_finish():
+    reader = _BodyReader("https://zapo.ru/", None, None)
+    reader.feed(b"<html>" + b" " * HEAD_BYTES)
+    reader.feed("Превышен лимит запросов в день".encode("cp1251"))
+    with pytest.raises(MirrorUnavailable):
+        reader.finish()
+
+def test_marker_split_at_head_boundary():
+    marker = b"<title>Access Denied</title>"
+    reader = _BodyReader("https://zapo.ru/", None, None)
+    reader.feed(b" " * (HEAD_BYTES - 10) + marker[:10])
+    reader.feed(marker[10:] + b"</html>")
+    with pytest.raises(PageBlocked):
+        reader.finish()
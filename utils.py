@@ -1,19 +1,105 @@
-from threading import Lock
+from threading import Condition, Event, Lock, Thread, local
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial, wraps
+import asyncio
+import atexit
+import hashlib
+import heapq
+import json
 import os
 import random
 import re
-from typing import Callable, Tuple
+import socket
+import sqlite3
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator, NamedTuple, Tuple
+from urllib.parse import urlsplit
 import requests
-from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from profiling import StackSampler, _script_name, profile_main as _profile_main
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import count, islice
+from weakref import WeakKeyDictionary
+
+try:
+    import aiohttp
+    from aiohttp_socks import ProxyConnector
+except ImportError:  # асинхронный режим необязателен
+    aiohttp = None
+    ProxyConnector = None
 
 __all__ = [
     "proxy_lock",
+    "ProxyPool",
+    "ProxyReplenisher",
+    "AdaptiveConcurrency",
+    "RoutingPolicy",
+    "default_routing",
+    "DIRECT",
+    "PROXIED",
+    "RemoteProxyPool",
+    "connect_proxy_daemon",
+    "PROXY_DAEMON_SOCKET",
+    "session_pool",
     "load_proxies",
     "download_proxies",
+    "ProxyRegistry",
+    "proxy_registry",
+    "check_proxies_async",
+    "open_proxy_pool",
     "get_proxy_dict",
+    "SessionPool",
+    "http_get",
+    "canonical_url",
+    "ResponseCache",
+    "response_cache",
     "fetch_with_proxies",
+    "fetch_page_with_proxies",
+    "SingleFlight",
+    "RetryBudget",
+    "retry_budget_stats",
+    "format_budget_stats",
+    "inflight_requests",
+    "AsyncSessionPool",
+    "fetch_with_proxies_async",
+    "fetch_page_with_proxies_async",
+    "gather_bounded",
+    "run_bounded",
+    "RetryLater",
+    "run_per_host",
+    "Metrics",
+    "metrics",
+    "StackSampler",
+    "profile_main",
     "MIRRORS",
     "with_mirror",
+    "mirror_of",
+    "is_access_denied",
+    "is_rate_limited",
+    "FetchAborted",
+    "MirrorUnavailable",
+    "ResponseTooLarge",
+    "PageBlocked",
+    "PageMissing",
+    "PageClassifier",
+    "PAGE_OK",
+    "PAGE_EMPTY",
+    "PAGE_NO_DATA",
+    "PAGE_SOFT_BLOCKED",
+    "Page",
+    "MAX_BODY_BYTES",
+    "stream_get",
+    "AdaptiveTimeouts",
+    "adaptive_timeouts",
+    "MirrorRouter",
+    "mirror_router",
+    "QuotaLedger",
+    "quota_ledger",
 ]
 
 # 🔒 Глобальный лок для потокобезопасной работы с прокси
@@ -25,6 +111,408 @@ PROXY_API_URL = (
     "?key={key}&type=socks5&level=1&speed=1&limit=0"
 )
 
+# 🔁 Список зеркал для обхода ограничений
+MIRRORS = [
+    "https://part.avtomir.ru",
+    "https://zapo.ru",
+    "https://vindoc.ru",
+    "https://autona88.ru",
+    "https://b2b.autorus.ru",
+    "https://xxauto.pro",
+    "https://motexc.ru",
+]
+# Подмена списка зеркал (через запятую), например на локальный стенд fake_zapo.py
+if os.getenv("ZAPO_MIRRORS"):
+    MIRRORS = [mirror.strip().rstrip("/") for mirror in os.environ["ZAPO_MIRRORS"].split(",") if mirror.strip()]
+
+def with_mirror(url: str, mirror: str) -> str:
+    """Заменить домен в URL на указанный mirror."""
+    return re.sub(r"https?://[^/]+", mirror, url)
+
+def mirror_of(url: str) -> str | None:
+    """Вернуть зеркало из MIRRORS, на которое указывает url, либо None."""
+    host = urlsplit(url).netloc.lower()
+    for mirror in MIRRORS:
+        if urlsplit(mirror).netloc == host:
+            return mirror
+    return None
+
+def is_access_denied(html_text: str) -> bool:
+    return "Access denied to" in html_text or "<title>Access Denied</title>" in html_text
+
+def is_rate_limited(html_text: str) -> bool:
+    return "Превышен лимит запросов в день" in html_text
+
+class FetchAborted(RuntimeError):
+    """Повторять загрузку через другой прокси бессмысленно."""
+
+class MirrorUnavailable(FetchAborted):
+    """Зеркало отказало в обслуживании (например, исчерпан дневной лимит) — менять прокси бессмысленно."""
+
+class ResponseTooLarge(FetchAborted):
+    """Тело ответа больше допустимого max_bytes."""
+
+class PageBlocked(RuntimeError):
+    """Страница отказа доступа или антибота; kind — "access_denied" / "challenge". Другой прокси может помочь."""
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+# Отказ доступа часто касается одного прокси (его IP), а не зеркала — цепь открывается,
+# когда его увидели столько разных источников
+MIRROR_BLOCK_SOURCES = 2
+
+class _MirrorState:
+    __slots__ = (
+        "success", "latency", "failures", "open_until", "open_for", "probe_offered", "probe_started", "blocked_by",
+    )
+
+    def __init__(self):
+        self.success = 1.0
+        self.latency = 1.0
+        self.failures = 0
+        self.open_until = 0.0
+        self.open_for = 0.0
+        self.probe_offered = 0.0
+        self.probe_started = 0.0
+        self.blocked_by: set[str] = set()
+
+class MirrorRouter:
+    """
+    Балансировщик зеркал: выбор взвешен по EWMA успешности и задержки.
+    Circuit breaker: после failure_threshold ошибок подряд, отказа доступа от block_sources
+    разных прокси (report_blocked) или подтверждённого лимита (report(blocked=True))
+    зеркало «открывается» на open_for секунд (удваивается при повторе),
+    затем пропускает один пробный запрос (half-open) и закрывается при успехе.
+    Пробу получает первым в order() один вызывающий; если за probe_grace секунд он
+    не отправил запрос (started()), проба достаётся следующему.
+    """
+
+    def __init__(
+        self,
+        mirrors: Iterable[str],
+        *,
+        alpha: float = 0.2,
+        failure_threshold: int = 5,
+        open_for: float = 120.0,
+        max_open_for: float = 3600.0,
+        probe_grace: float = 10.0,
+        block_sources: int = MIRROR_BLOCK_SOURCES,
+        quota: "QuotaLedger | None" = None,
+    ):
+        self.mirrors = list(mirrors)
+        self.quota = quota
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.base_open_for = open_for
+        self.max_open_for = max_open_for
+        self.probe_grace = probe_grace
+        self.block_sources = block_sources
+        self._lock = Lock()
+        self._states = {mirror: _MirrorState() for mirror in self.mirrors}
+
+    def order(self, exclude: Iterable[str] = ()) -> list[str]:
+        """
+        Порядок обхода зеркал: сначала зеркало, готовое к пробе (half-open), — оно отдаётся
+        первым одному вызывающему, затем закрытые — взвешенно-случайно. Открытые зеркала,
+        зеркала с пробой в работе и исчерпавшие дневной лимит (по quota) не возвращаются.
+        """
+        excluded = set(exclude)
+        if self.quota is not None:
+            excluded |= self.quota.exhausted()
+        now = time.monotonic()
+        closed, probes = [], []
+        with self._lock:
+            for mirror, state in self._states.items():
+                if mirror in excluded:
+                    continue
+                if state.open_until <= 0:
+                    # Ключ Эфраимидиса–Спиракиса: взвешенная случайная перестановка
+                    key = random.random() ** (1.0 / self._weight(state))
+                    closed.append((key, mirror))
+                elif state.open_until <= now and not probes and self._probe_free(state, now):
+                    state.probe_offered = now
+                    probes.append(mirror)
+        return probes + [mirror for _, mirror in sorted(closed, reverse=True)]
+
+    def pick(self, exclude: Iterable[str] = ()) -> str | None:
+        order = self.order(exclude)
+        return order[0] if order else None
+
+    def route(self, url: str, exclude: Iterable[str] = ()) -> str:
+        """Переписать url на выбранное зеркало (если все открыты — оставить как есть)."""
+        mirror = self.pick(exclude)
+        return with_mirror(url, mirror) if mirror else url
+
+    def started(self, mirror_or_url: str):
+        """Запрос к зеркалу отправлен: для half-open зеркала это и есть проба."""
+        mirror = mirror_of(mirror_or_url)
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(mirror)
+            if state is not None and 0 < state.open_until <= now and now - state.probe_started >= self.base_open_for:
+                state.probe_started = now
+
+    def report_blocked(self, mirror_or_url: str, source: str | None = None) -> bool:
+        """
+        Отказ доступа через прокси source (None — напрямую): обычная ошибка зеркала, а когда
+        отказ видели block_sources разных источников — открыть цепь. True — цепь открыта.
+        """
+        mirror = mirror_of(mirror_or_url)
+        if mirror is None:
+            return False
+        with self._lock:
+            state = self._states.setdefault(mirror, _MirrorState())
+            state.blocked_by.add(source or DIRECT)
+            confirmed = len(state.blocked_by) >= self.block_sources
+        self.report(mirror, False, blocked=confirmed)
+        return confirmed
+
+    def report(self, mirror_or_url: str, ok: bool, latency: float | None = None, *, blocked: bool = False):
+        """Учесть исход запроса к зеркалу; blocked=True (блокировка подтверждена) сразу открывает цепь."""
+        mirror = mirror_of(mirror_or_url)
+        if mirror is None:
+            return
+        a = self.alpha
+        with self._lock:
+            state = self._states.setdefault(mirror, _MirrorState())
+            state.success = (1 - a) * state.success + a * (1.0 if ok else 0.0)
+            if latency is not None:
+                state.latency = (1 - a) * state.latency + a * latency
+            if ok:
+                state.failures = 0
+                state.open_until = 0.0
+                state.open_for = 0.0
+                state.blocked_by.clear()
+                return
+            state.failures += 1
+            now = time.monotonic()
+            if state.open_until > now:
+                return  # цепь уже открыта — запоздавшие ответы ничего не меняют
+            if state.open_until > 0:
+                state.open_for = min(self.max_open_for, state.open_for * 2)  # проба не удалась
+            elif blocked or state.failures >= self.failure_threshold:
+                state.open_for = self.base_open_for
+            else:
+                return
+            state.open_until = now + state.open_for
+            state.probe_offered = 0.0
+            state.probe_started = 0.0
+            state.blocked_by.clear()
+
+    def is_open(self, mirror_or_url: str) -> bool:
+        mirror = mirror_of(mirror_or_url)
+        with self._lock:
+            state = self._states.get(mirror)
+            return bool(state and state.open_until > time.monotonic())
+
+    def snapshot(self) -> dict[str, dict]:
+        """Текущее состояние зеркал (для логов)."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                mirror: {
+                    "success": round(state.success, 3),
+                    "latency": round(state.latency, 3),
+                    "state": "closed" if state.open_until <= 0 else ("open" if state.open_until > now else "half-open"),
+                }
+                for mirror, state in self._states.items()
+            }
+
+    def _probe_free(self, state: _MirrorState, now: float) -> bool:
+        # Проба без ответа дольше base_open_for считается потерянной
+        return now - state.probe_started >= self.base_open_for and now - state.probe_offered >= self.probe_grace
+
+    @staticmethod
+    def _weight(state: _MirrorState) -> float:
+        return max(0.01, (0.05 + state.success) / max(state.latency, 0.05))
+
+def _open_sqlite(path: str) -> sqlite3.Connection:
+    """Открыть SQLite для общего доступа из потоков и процессов (WAL, ожидание блокировки)."""
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+# 📒 Дневные лимиты зеркал
+QUOTA_DB_FILE = "mirror_quota.sqlite3"
+QUOTA_UTC_OFFSET_HOURS = 3  # лимиты сбрасываются в полночь по Москве
+QUOTA_LIMIT_SOURCES = 2  # столько разных прокси должны увидеть страницу лимита
+
+class QuotaLedger:
+    """
+    Общий для потоков и процессов учёт запросов к зеркалам по дням (SQLite).
+    Когда страницу дневного лимита зеркала получили limit_sources разных источников
+    (прокси или прямой запрос), зеркало считается исчерпанным до смены суток: одна
+    такая страница может оказаться лимитом самого прокси.
+    Состояние других процессов подхватывается не реже раза в refresh_interval секунд.
+    """
+
+    def __init__(
+        self,
+        path: str = QUOTA_DB_FILE,
+        *,
+        utc_offset_hours: float = QUOTA_UTC_OFFSET_HOURS,
+        refresh_interval: float = 5.0,
+        flush_every: int = 200,
+        limit_sources: int = QUOTA_LIMIT_SOURCES,
+    ):
+        self.path = path
+        self.tz = timezone(timedelta(hours=utc_offset_hours))
+        self.refresh_interval = refresh_interval
+        self.flush_every = flush_every
+        self.limit_sources = limit_sources
+        self._conn: sqlite3.Connection | None = None
+        self._db_lock = Lock()
+        self._lock = Lock()
+        self._pending: dict[tuple[str, str], int] = {}
+        self._pending_total = 0
+        self._exhausted: set[str] = set()
+        self._exhausted_day = ""
+        self._refreshed_at = 0.0
+        self._limit_seen: dict[str, set[str]] = {}
+        self._limit_day = ""
+
+    def today(self) -> str:
+        return datetime.now(self.tz).strftime("%Y-%m-%d")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = _open_sqlite(self.path)
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS mirror_quota (
+                    mirror TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    limited_at REAL,
+                    PRIMARY KEY (mirror, day)
+                )
+                """
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def count(self, mirror_or_url: str, n: int = 1):
+        """Учесть запрос(ы) к зеркалу за текущие сутки."""
+        mirror = mirror_of(mirror_or_url)
+        if mirror is None:
+            return
+        with self._lock:
+            key = (mirror, self.today())
+            self._pending[key] = self._pending.get(key, 0) + n
+            self._pending_total += n
+            due = self._pending_total >= self.flush_every
+        if due:
+            self.flush()
+
+    def report_limit(self, mirror_or_url: str, source: str | None = None) -> bool:
+        """
+        Страница лимита получена через прокси source (None — напрямую). Вернуть True,
+        если лимит подтверждён и зеркало отмечено исчерпанным (см. mark_limited).
+        """
+        mirror = mirror_of(mirror_or_url)
+        if mirror is None:
+            return False
+        day = self.today()
+        with self._lock:
+            if self._limit_day != day:
+                self._limit_seen, self._limit_day = {}, day
+            sources = self._limit_seen.setdefault(mirror, set())
+            sources.add(source or DIRECT)
+            confirmed = len(sources) >= self.limit_sources
+        if confirmed:
+            self.mark_limited(mirror)
+        return confirmed
+
+    def mark_limited(self, mirror_or_url: str):
+        """Зеркало сообщило о дневном лимите — сразу записать, чтобы увидели другие процессы."""
+        mirror = mirror_of(mirror_or_url)
+        if mirror is None:
+            return
+        day = self.today()
+        with self._lock:
+            if self._exhausted_day != day:
+                self._exhausted, self._exhausted_day = set(), day
+            self._exhausted.add(mirror)
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute(
+                """
+                INSERT INTO mirror_quota (mirror, day, limited_at) VALUES (?, ?, ?)
+                ON CONFLICT (mirror, day) DO UPDATE SET limited_at = COALESCE(limited_at, excluded.limited_at)
+                """,
+                (mirror, day, time.time()),
+            )
+            conn.commit()
+
+    def is_exhausted(self, mirror_or_url: str) -> bool:
+        mirror = mirror_of(mirror_or_url)
+        if mirror is None:
+            return False
+        day = self.today()
+        with self._lock:
+            stale = (
+                self._exhausted_day != day
+                or time.monotonic() - self._refreshed_at >= self.refresh_interval
+            )
+        if stale:
+            self._refresh(day)
+        with self._lock:
+            return mirror in self._exhausted
+
+    def exhausted(self) -> set[str]:
+        """Зеркала, исчерпавшие лимит сегодня."""
+        return {mirror for mirror in MIRRORS if self.is_exhausted(mirror)}
+
+    def usage(self, day: str | None = None) -> dict[str, int]:
+        """Число запросов к каждому зеркалу за сутки (по всем процессам)."""
+        self.flush()
+        with self._db_lock:
+            rows = self._connect().execute(
+                "SELECT mirror, requests FROM mirror_quota WHERE day = ?", (day or self.today(),)
+            ).fetchall()
+        return dict(rows)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_total = 0
+        if not pending:
+            return
+        with self._db_lock:
+            conn = self._connect()
+            conn.executemany(
+                """
+                INSERT INTO mirror_quota (mirror, day, requests) VALUES (?, ?, ?)
+                ON CONFLICT (mirror, day) DO UPDATE SET requests = requests + excluded.requests
+                """,
+                [(mirror, day, n) for (mirror, day), n in pending.items()],
+            )
+            conn.commit()
+
+    def _refresh(self, day: str):
+        self.flush()
+        try:
+            with self._db_lock:
+                rows = self._connect().execute(
+                    "SELECT mirror FROM mirror_quota WHERE day = ? AND limited_at IS NOT NULL", (day,)
+                ).fetchall()
+        except sqlite3.Error:
+            rows = []
+        with self._lock:
+            if self._exhausted_day != day:
+                self._exhausted, self._exhausted_day = set(), day
+            self._exhausted.update(mirror for (mirror,) in rows)
+            self._refreshed_at = time.monotonic()
+
+quota_ledger = QuotaLedger()
+atexit.register(quota_ledger.flush)
+
+# 🧭 Общий балансировщик зеркал
+mirror_router = MirrorRouter(MIRRORS, quota=quota_ledger)
+
 def download_proxies(api_key: str) -> list[str]:
     """Загрузить список SOCKS5-прокси по API-ключу с best-proxies.ru."""
     try:
@@ -34,23 +522,45 @@ def download_proxies(api_key: str) -> list[str]:
     except Exception:
         return []
 
-def check_proxy_alive(proxy: str, timeout: int = 5) -> bool:
-    """Проверить, работает ли прокси через запрос к Google."""
-    test_url = "https://www.google.com"
+def _probe_target() -> str:
+    """Зеркало для проверки прокси: выбранное mirror_router, а если все открыты — первое из MIRRORS."""
+    return mirror_router.pick() or MIRRORS[0]
+
+def check_proxy_alive(proxy: str, timeout: int = 5, test_url: str | None = None) -> bool:
+    """Проверить, работает ли прокси через запрос к зеркалу (по умолчанию — _probe_target)."""
+    test_url = test_url or _probe_target()
+    started = time.monotonic()
     try:
-        response = requests.get(
-            test_url,
-            proxies=get_proxy_dict(proxy),
-            timeout=timeout
-        )
-        return response.ok
+        # Для проверки достаточно начала страницы
+        with session_pool.session(proxy, test_url) as session:
+            with session.get(
+                test_url, timeout=adaptive_timeouts.timeout(proxy, test_url, timeout), stream=True
+            ) as response:
+                first_byte = time.monotonic() - started
+                quota_ledger.count(test_url)
+                head = response.raw.read(HEAD_BYTES, decode_content=True)
+                ok = response.ok and not _scan_markers(head)
+        if ok:
+            adaptive_timeouts.proxies.observe(proxy, first_byte)
     except Exception:
-        return False
+        ok = False
+    proxy_registry.record(proxy, test_url, ok, time.monotonic() - started if ok else None)
+    return ok
 
 def filter_alive_proxies(proxies: list[str], threads: int = 50) -> list[str]:
-    """Отфильтровать только рабочие прокси (многопоточно)."""
+    """
+    Отфильтровать только рабочие прокси: по одному запросу к зеркалу из _probe_target,
+    не больше threads одновременно. При наличии aiohttp — асинхронно, иначе в потоках.
+    """
+    target = _probe_target()
+    if aiohttp is not None:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(check_proxies_async(proxies, [target], concurrency=threads))
     with ThreadPoolExecutor(max_workers=threads) as executor:
-        results = list(executor.map(check_proxy_alive, proxies))
+        results = list(executor.map(partial(check_proxy_alive, test_url=target), proxies))
+    proxy_registry.flush()
     return [proxy for proxy, ok in zip(proxies, results) if ok]
 
 def load_proxies(
@@ -60,11 +570,19 @@ def load_proxies(
     api_key: str | None = None,
     logger: Callable[[str], None] | None = None,
     check_alive: bool = False,
+    warm_start: bool = False,
 ) -> list[str]:
     """
     Загрузка прокси с приоритетом API.
     При check_alive=True — оставляются только рабочие и сохраняются в alive_file.
+    При warm_start=True — результат упорядочен по истории из proxy_registry (лучшие первыми).
     """
+    if warm_start:
+        loaded = load_proxies(
+            proxy_file, alive_file, api_key=api_key, logger=logger, check_alive=check_alive
+        )
+        return proxy_registry.ranked(loaded)
+
     proxies: set[str] = set()
     api_key = api_key or os.getenv("PROXY_API_KEY")
 
@@ -137,103 +655,2849 @@ def get_proxy_dict(proxy: str) -> dict:
     """Вернуть словарь прокси для requests с SOCKS5."""
     return {"http": f"socks5h://{proxy}", "https": f"socks5h://{proxy}"}
 
-# 🔁 Список зеркал для обхода ограничений
-MIRRORS = [
-    "https://part.avtomir.ru",
-    "https://zapo.ru",
-    "https://vindoc.ru",
-    "https://autona88.ru",
-    "https://b2b.autorus.ru",
-    "https://xxauto.pro",
-    "https://motexc.ru",
-]
+class _WeightTree:
+    """Дерево Фенвика по весам: обновление и взвешенный выбор за O(log n)."""
 
-def with_mirror(url: str, mirror: str) -> str:
-    """Заменить домен в URL на указанный mirror."""
-    return re.sub(r"https://[^/]+", mirror, url)
+    def __init__(self):
+        self._weights: list[float] = []
+        self._tree: list[float] = [0.0]
+        self._updates = 0
 
-def fetch_with_proxies(
+    def __len__(self) -> int:
+        return len(self._weights)
+
+    def append(self, weight: float) -> int:
+        self._weights.append(weight)
+        if len(self._weights) >= len(self._tree):
+            self._rebuild(capacity=max(16, 2 * len(self._weights)))
+        else:
+            self._add(len(self._weights), weight)
+        return len(self._weights) - 1
+
+    def set(self, index: int, weight: float):
+        delta = weight - self._weights[index]
+        if delta:
+            self._weights[index] = weight
+            self._add(index + 1, delta)
+            self._updates += 1
+            # 🧹 Периодически пересобираем, чтобы не копилась ошибка float
+            if self._updates >= 100_000:
+                self._rebuild(capacity=len(self._tree) - 1)
+
+    def total(self) -> float:
+        return self._prefix(len(self._weights))
+
+    def sample(self) -> int | None:
+        """Выбрать индекс с вероятностью, пропорциональной весу."""
+        total = self.total()
+        if total <= 1e-12:
+            return None
+        target = random.random() * total
+        pos, step = 0, 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        # pos — число элементов с префиксной суммой <= target
+        index = min(pos, len(self._weights) - 1)
+        while index > 0 and self._weights[index] <= 0:
+            index -= 1
+        return index if self._weights[index] > 0 else None
+
+    def _add(self, pos: int, delta: float):
+        while pos < len(self._tree):
+            self._tree[pos] += delta
+            pos += pos & -pos
+
+    def _prefix(self, pos: int) -> float:
+        result = 0.0
+        while pos > 0:
+            result += self._tree[pos]
+            pos -= pos & -pos
+        return result
+
+    def _rebuild(self, capacity: int):
+        tree = [0.0] * (capacity + 1)
+        for i, weight in enumerate(self._weights, start=1):
+            tree[i] += weight
+            parent = i + (i & -i)
+            if parent <= capacity:
+                tree[parent] += tree[i]
+        # Узлы без элементов тоже должны передать сумму выше
+        for i in range(len(self._weights) + 1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._updates = 0
+
+class _ProxyStats:
+    __slots__ = ("success", "latency", "in_flight", "failures", "cooldown_until", "ok_count", "fail_count")
+
+    def __init__(self):
+        self.success = 0.5
+        self.latency = 1.0
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.ok_count = 0
+        self.fail_count = 0
+
+class ProxyPool:
+    """
+    Потокобезопасный пул прокси со взвешенным выбором.
+    Для каждого прокси ведётся EWMA успешности и задержки, вес = успешность / задержка.
+    Упавшие прокси не удаляются, а уходят на cooldown (растёт с каждой ошибкой подряд).
+    """
+
+    def __init__(
+        self,
+        proxies: Iterable[str] = (),
+        *,
+        cooldown: float = 30.0,
+        max_cooldown: float = 900.0,
+        alpha: float = 0.2,
+    ):
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        self._lock = Lock()
+        self._index: dict[str, int] = {}
+        self._slots: list[str | None] = []
+        self._stats: list[_ProxyStats] = []
+        self._free: list[int] = []
+        self._cooling: list[tuple[float, int]] = []
+        self._tree = _WeightTree()
+        self._replenishers: dict[Callable, "ProxyReplenisher"] = {}  # см. _replenisher_for
+        self.add(proxies)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, proxy: str) -> bool:
+        return proxy in self._index
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def snapshot(self) -> list[str]:
+        """Копия списка всех прокси пула."""
+        with self._lock:
+            return list(self._index)
+
+    def add(self, proxies: Iterable[str]) -> int:
+        """Добавить прокси (уже известные сохраняют статистику). Вернуть число новых."""
+        with self._lock:
+            return sum(self._add_locked(proxy.strip()) for proxy in proxies)
+
+    def remove(self, proxy: str) -> bool:
+        with self._lock:
+            return self._remove_locked(proxy)
+
+    def replace(self, proxies: Iterable[str]):
+        """
+        Атомарно заменить состав пула, сохранив статистику пересекающихся прокси:
+        параллельный lease() видит либо старый, либо новый состав.
+        """
+        new = {p.strip() for p in proxies if p.strip()}
+        with self._lock:
+            for proxy in [p for p in self._index if p not in new]:
+                self._remove_locked(proxy)
+            for proxy in new:
+                self._add_locked(proxy)
+
+    def _add_locked(self, proxy: str) -> bool:
+        if not proxy or proxy in self._index:
+            return False
+        stats = _ProxyStats()
+        if self._free:
+            idx = self._free.pop()
+            self._slots[idx] = proxy
+            self._stats[idx] = stats
+            self._tree.set(idx, self._weight(stats))
+        else:
+            idx = self._tree.append(self._weight(stats))
+            self._slots.append(proxy)
+            self._stats.append(stats)
+        self._index[proxy] = idx
+        return True
+
+    def _remove_locked(self, proxy: str) -> bool:
+        idx = self._index.pop(proxy, None)
+        if idx is None:
+            return False
+        self._slots[idx] = None
+        self._tree.set(idx, 0.0)
+        self._free.append(idx)
+        return True
+
+    def available(self) -> int:
+        """Сколько прокси сейчас не на cooldown."""
+        now = time.monotonic()
+        with self._lock:
+            self._restore_cooled(now)
+            return sum(1 for idx in self._index.values() if self._stats[idx].cooldown_until <= now)
+
+    def lease(self) -> str | None:
+        """Взять прокси (взвешенно), либо None, если все на cooldown. Вернуть через release()."""
+        with self._lock:
+            self._restore_cooled(time.monotonic())
+            idx = self._tree.sample()
+            if idx is None or self._slots[idx] is None:
+                return None
+            stats = self._stats[idx]
+            stats.in_flight += 1
+            self._tree.set(idx, self._weight(stats))
+            return self._slots[idx]
+
+    def release(self, proxy: str, ok: bool | None = None, latency: float | None = None):
+        """
+        Вернуть прокси после lease().
+        ok=True/False — учесть результат запроса, None — прокси не использовался.
+        """
+        with self._lock:
+            idx = self._index.get(proxy)
+            if idx is None:
+                return
+            stats = self._stats[idx]
+            stats.in_flight = max(0, stats.in_flight - 1)
+            if ok is not None:
+                self._record(stats, idx, ok, latency)
+            self._tree.set(idx, self._weight(stats))
+
+    def penalize(self, proxy: str):
+        """Учесть неудачу прокси, выявленную уже после release() (например, пустая страница)."""
+        with self._lock:
+            idx = self._index.get(proxy)
+            if idx is not None:
+                self._record(self._stats[idx], idx, False, None)
+                self._tree.set(idx, self._weight(self._stats[idx]))
+
+    def working(self) -> list[str]:
+        """Прокси, у которых был хотя бы один успешный запрос, — лучшие первыми."""
+        with self._lock:
+            items = [
+                (self._weight(self._stats[idx], ignore_state=True), proxy)
+                for proxy, idx in self._index.items()
+                if self._stats[idx].ok_count
+            ]
+        return [proxy for _, proxy in sorted(items, reverse=True)]
+
+    def seed(self, history: dict[str, tuple[float, float | None]]):
+        """Задать начальные успешность и задержку из истории: {прокси: (success, latency)}."""
+        with self._lock:
+            for proxy, (success, latency) in history.items():
+                idx = self._index.get(proxy)
+                if idx is None:
+                    continue
+                stats = self._stats[idx]
+                stats.success = success
+                if latency is not None:
+                    stats.latency = latency
+                self._tree.set(idx, self._weight(stats))
+
+    def _record(self, stats: _ProxyStats, idx: int, ok: bool, latency: float | None):
+        a = self.alpha
+        stats.success = (1 - a) * stats.success + a * (1.0 if ok else 0.0)
+        if latency is not None:
+            stats.latency = (1 - a) * stats.latency + a * latency
+        if ok:
+            stats.ok_count += 1
+            stats.failures = 0
+            stats.cooldown_until = 0.0
+        else:
+            stats.fail_count += 1
+            stats.failures += 1
+            delay = min(self.max_cooldown, self.cooldown * 2 ** min(stats.failures - 1, 16))
+            stats.cooldown_until = time.monotonic() + delay
+            heapq.heappush(self._cooling, (stats.cooldown_until, idx))
+
+    def _restore_cooled(self, now: float):
+        while self._cooling and self._cooling[0][0] <= now:
+            until, idx = heapq.heappop(self._cooling)
+            stats = self._stats[idx]
+            if self._slots[idx] is not None and stats.cooldown_until == until:
+                stats.cooldown_until = 0.0
+                self._tree.set(idx, self._weight(stats))
+
+    @staticmethod
+    def _weight(stats: _ProxyStats, ignore_state: bool = False) -> float:
+        if not ignore_state and stats.cooldown_until:
+            return 0.0
+        weight = (0.05 + stats.success) / max(stats.latency, 0.05)
+        if not ignore_state:
+            weight /= 1 + stats.in_flight
+        return weight
+
+# 🗄️ Реестр здоровья прокси между запусками
+PROXY_DB_FILE = "proxies_health.sqlite3"
+
+class ProxyRegistry:
+    """
+    SQLite-реестр исходов по паре (прокси, хост зеркала): успехи, ошибки, задержка (EWMA)
+    и время последней активности. Запись буферизуется и сбрасывается пачками;
+    WAL позволяет писать в одну базу из нескольких процессов.
+    """
+
+    def __init__(self, path: str = PROXY_DB_FILE, flush_every: int = 500, flush_interval: float = 10.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._conn: sqlite3.Connection | None = None
+        self._db_lock = Lock()
+        self._buffer_lock = Lock()
+        self._buffer: list[tuple] = []
+        self._last_flush = time.monotonic()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = _open_sqlite(self.path)
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS proxy_health (
+                    proxy TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    ok INTEGER NOT NULL DEFAULT 0,
+                    fail INTEGER NOT NULL DEFAULT 0,
+                    latency REAL,
+                    last_ok REAL,
+                    last_seen REAL NOT NULL,
+                    PRIMARY KEY (proxy, target)
+                )
+                """
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def record(self, proxy: str, target: str, ok: bool, latency: float | None = None):
+        """Учесть исход запроса; target — URL или хост зеркала."""
+        host = urlsplit(target).netloc or target
+        now = time.time()
+        with self._buffer_lock:
+            self._buffer.append((proxy, host.lower(), int(ok), int(not ok), latency, now if ok else None, now))
+            due = (
+                len(self._buffer) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._buffer_lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+        if not rows:
+            return
+        with self._db_lock:
+            conn = self._connect()
+            conn.executemany(
+                """
+                INSERT INTO proxy_health (proxy, target, ok, fail, latency, last_ok, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (proxy, target) DO UPDATE SET
+                    ok = ok + excluded.ok,
+                    fail = fail + excluded.fail,
+                    latency = CASE
+                        WHEN excluded.latency IS NULL THEN latency
+                        WHEN latency IS NULL THEN excluded.latency
+                        ELSE 0.8 * latency + 0.2 * excluded.latency
+                    END,
+                    last_ok = COALESCE(excluded.last_ok, last_ok),
+                    last_seen = excluded.last_seen
+                """,
+                rows,
+            )
+            conn.commit()
+
+    def history(self, proxies: Iterable[str] | None = None, target: str | None = None) -> dict[str, tuple[float, float | None]]:
+        """
+        Историческое качество прокси: {прокси: (успешность, задержка)}.
+        Успешность сглажена (ok + 1) / (ok + fail + 2); target ограничивает хостом зеркала.
+        """
+        self.flush()
+        query = "SELECT proxy, SUM(ok), SUM(fail), AVG(latency) FROM proxy_health"
+        params: tuple = ()
+        if target:
+            query += " WHERE target = ?"
+            params = ((urlsplit(target).netloc or target).lower(),)
+        query += " GROUP BY proxy"
+        with self._db_lock:
+            rows = self._connect().execute(query, params).fetchall()
+        wanted = set(proxies) if proxies is not None else None
+        return {
+            proxy: ((ok + 1) / (ok + fail + 2), latency)
+            for proxy, ok, fail, latency in rows
+            if wanted is None or proxy in wanted
+        }
+
+    def ranked(self, proxies: Iterable[str], target: str | None = None) -> list[str]:
+        """Упорядочить прокси по истории: лучшие первыми, неизвестные — между хорошими и плохими."""
+        proxies = list(proxies)
+        history = self.history(proxies, target)
+
+        def score(proxy: str) -> float:
+            success, latency = history.get(proxy, (0.5, None))
+            return success / max(latency or 1.0, 0.05)
+
+        return sorted(proxies, key=score, reverse=True)
+
+    def close(self):
+        self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+proxy_registry = ProxyRegistry()
+atexit.register(proxy_registry.flush)
+
+# 🛰️ Общий для всех процессов пул прокси (proxy_daemon.py)
+PROXY_DAEMON_SOCKET = os.getenv("ZAPO_PROXY_DAEMON", "proxy_daemon.sock")
+
+class RemoteProxyPool:
+    """
+    Клиент proxy_daemon.py с интерфейсом ProxyPool: lease/release и статистика
+    живут в демоне и общие для всех запущенных этапов. Протокол — JSON-строки
+    через Unix-сокет, одно соединение на поток.
+    Если демон пропал, lease() возвращает None (загрузка пойдёт без прокси),
+    а результаты release() теряются — этап при этом не падает. Так же обрабатываются
+    ответ демона с ошибкой и битый ответ; они пишутся в logger.
+    """
+
+    def __init__(
+        self,
+        path: str = PROXY_DAEMON_SOCKET,
+        timeout: float = 5.0,
+        logger: Callable[[str], None] | None = None,
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.logger = logger
+        self._local = local()
+        self._replenishers: dict[Callable, "ProxyReplenisher"] = {}  # см. _replenisher_for
+
+    def __len__(self) -> int:
+        return self._call("len", default=0)
+
+    def __contains__(self, proxy: str) -> bool:
+        return self._call("contains", proxy=proxy, default=False)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def snapshot(self) -> list[str]:
+        return self._call("snapshot", default=[])
+
+    def add(self, proxies: Iterable[str]) -> int:
+        return self._call("add", proxies=list(proxies), default=0)
+
+    def remove(self, proxy: str) -> bool:
+        return self._call("remove", proxy=proxy, default=False)
+
+    def replace(self, proxies: Iterable[str]):
+        self._call("replace", proxies=list(proxies))
+
+    def available(self) -> int:
+        return self._call("available", default=0)
+
+    def lease(self) -> str | None:
+        return self._call("lease")
+
+    def release(self, proxy: str, ok: bool | None = None, latency: float | None = None):
+        self._call("release", proxy=proxy, ok=ok, latency=latency)
+
+    def penalize(self, proxy: str):
+        self._call("penalize", proxy=proxy)
+
+    def working(self) -> list[str]:
+        return self._call("working", default=[])
+
+    def seed(self, history: dict[str, tuple[float, float | None]]):
+        """История уже учтена демоном при старте."""
+
+    def ping(self) -> bool:
+        try:
+            return self._request({"op": "ping"}) == "pong"
+        except (OSError, RuntimeError, ValueError):
+            return False
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn[0].close()
+
+    def _call(self, op: str, default=None, **args):
+        try:
+            return self._request({"op": op, **args})
+        except OSError:
+            return default
+        except (RuntimeError, ValueError) as e:
+            if self.logger:
+                self.logger(f"[PROXIES] ❌ Демон прокси, {op}: {e}")
+            return default
+
+    def _request(self, message: dict):
+        payload = (json.dumps(message) + "\n").encode("utf-8")
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            try:
+                if conn is None:
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.settimeout(self.timeout)
+                    sock.connect(self.path)
+                    conn = self._local.conn = (sock, sock.makefile("rb"))
+                sock, reader = conn
+                sock.sendall(payload)
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError("proxy daemon closed the connection")
+                try:
+                    reply = json.loads(line)
+                except ValueError:
+                    self.close()  # поток ответов рассинхронизирован
+                    raise
+                if not isinstance(reply, dict):
+                    raise ValueError(f"unexpected reply {reply!r}")
+                if "error" in reply:
+                    raise RuntimeError(reply["error"])
+                return reply.get("result")
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+
+def connect_proxy_daemon(
+    path: str = PROXY_DAEMON_SOCKET,
+    logger: Callable[[str], None] | None = None,
+) -> RemoteProxyPool | None:
+    """RemoteProxyPool, если демон запущен и отвечает, иначе None."""
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    pool = RemoteProxyPool(path, logger=logger)
+    if pool.ping():
+        return pool
+    pool.close()
+    return None
+
+def open_proxy_pool(
+    proxy_file: str,
+    alive_file: str | None = None,
+    *,
+    logger: Callable[[str], None] | None = None,
+    check_alive: bool = False,
+    warm_start: bool = True,
+    daemon: bool = True,
+) -> "ProxyPool | RemoteProxyPool":
+    """
+    Загрузить прокси через load_proxies и собрать ProxyPool.
+    При warm_start пул стартует с исторической успешностью и задержкой из proxy_registry.
+    Если запущен proxy_daemon.py (и daemon=True), возвращается RemoteProxyPool:
+    этап не скачивает и не перезаписывает списки прокси сам.
+    """
+    if daemon:
+        remote = connect_proxy_daemon(logger=logger)
+        if remote is not None:
+            if logger:
+                logger(f"[PROXIES] 🛰️ Используется общий пул демона ({remote.path}): {len(remote)} прокси")
+            return remote
+
+    pool = ProxyPool(load_proxies(proxy_file, alive_file, logger=logger, check_alive=check_alive))
+    if warm_start and len(pool):
+        history = proxy_registry.history(pool.snapshot())
+        pool.seed(history)
+        if logger and history:
+            logger(f"[PROXIES] 🧠 История найдена для {len(history)} прокси")
+    return pool
+
+# 🔋 Фоновое пополнение пула прокси
+PROXY_LOW_WATER = 20
+
+class _ListTarget:
+    """Обычный список прокси как цель пополнения (старый интерфейс fetch_with_proxies)."""
+
+    def __init__(self, proxies: list[str]):
+        self.proxies = proxies
+
+    def available(self) -> int:
+        return len(self.proxies)
+
+    def replace(self, proxies: list[str]):
+        with proxy_lock:
+            self.proxies[:] = proxies
+            entry = _list_pools.get(id(self.proxies))
+            if entry is not None:
+                entry[1].replace(proxies)
+
+class ProxyReplenisher:
+    """
+    Пополняет пул в фоновом потоке, когда доступных прокси меньше low_water.
+    poke() ничего не ждёт: запускает перезагрузку (не чаще min_interval) и сразу
+    возвращается; готовый список подменяет состав пула одним replace().
+    """
+
+    def __init__(
+        self,
+        pool: "ProxyPool | list[str]",
+        reload: Callable[[], list[str]],
+        *,
+        low_water: int = PROXY_LOW_WATER,
+        min_interval: float = 60.0,
+        check_interval: float = 1.0,
+        logger: Callable[[str], None] | None = None,
+    ):
+        self.pool = _ListTarget(pool) if isinstance(pool, list) else pool
+        self.reload = reload
+        self.low_water = low_water
+        self.min_interval = min_interval
+        self.check_interval = check_interval
+        self.logger = logger
+        self._lock = Lock()
+        self._thread: Thread | None = None
+        self._last_started = float("-inf")
+        self._last_checked = float("-inf")
+
+    @property
+    def running(self) -> bool:
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def poke(self, force: bool = False) -> bool:
+        """Запустить пополнение, если пул ниже low_water (force — без проверки). True — запущено."""
+        if isinstance(self.pool, RemoteProxyPool):
+            return False  # пул демона обновляет сам демон
+        now = time.monotonic()
+        with self._lock:
+            if self.running or now - self._last_started < self.min_interval:
+                return False
+            if not force:
+                if now - self._last_checked < self.check_interval:
+                    return False
+                self._last_checked = now
+        # available() обходит весь пул — считаем вне своего лока и не чаще check_interval
+        if not force and self.pool.available() >= self.low_water:
+            return False
+        with self._lock:
+            if self.running:
+                return False
+            self._last_started = now
+            self._thread = Thread(target=self._run, name="proxy-replenisher", daemon=True)
+            self._thread.start()
+        return True
+
+    def wait(self, timeout: float | None = None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        if self.logger:
+            self.logger(f"[ПРОКСИ] 🔋 Доступно меньше {self.low_water} прокси — загружаем новые в фоне...")
+        try:
+            new_proxies = self.reload()
+        except Exception as e:
+            if self.logger:
+                self.logger(f"[ПРОКСИ] ❌ Ошибка фоновой загрузки прокси: {e}")
+            return
+        if not new_proxies:
+            if self.logger:
+                self.logger("[ПРОКСИ] ❌ Не удалось получить новые прокси.")
+            return
+        self.pool.replace(new_proxies)
+        if self.logger:
+            self.logger(f"[ПРОКСИ] Получено новых прокси: {len(new_proxies)}")
+
+# Обычному списку атрибут не назначить — его пополнители хранятся здесь. Запись держит
+# список и функцию (через ProxyReplenisher), поэтому их id не переиспользуются
+_list_replenishers: dict[tuple[int, int], ProxyReplenisher] = {}
+
+# Пулы для обычных списков: по одному на список, чтобы EWMA и cooldown копились между
+# вызовами. Запись держит сам список (его id не переиспользуется); старые вытесняются (LRU)
+LIST_POOLS_MAX = 16
+_list_pools: OrderedDict[int, tuple[list[str], ProxyPool]] = OrderedDict()
+
+def _pool_for_list(proxies: list[str]) -> ProxyPool:
+    """ProxyPool для обычного списка; состав сверяется со списком, если изменилась длина."""
+    with proxy_lock:
+        entry = _list_pools.get(id(proxies))
+        if entry is None:
+            entry = _list_pools[id(proxies)] = (proxies, ProxyPool(proxies))
+            while len(_list_pools) > LIST_POOLS_MAX:
+                _list_pools.popitem(last=False)
+        else:
+            _list_pools.move_to_end(id(proxies))
+            if len(entry[1]) != len(proxies):
+                entry[1].replace(proxies)
+        return entry[1]
+
+def _replenisher_for(
+    pool: "ProxyPool | RemoteProxyPool | list[str]",
+    reload: "Callable[[], list[str]] | ProxyReplenisher | None",
+    logger: Callable[[str], None] | None,
+) -> ProxyReplenisher | None:
+    """Один фоновый пополнитель на пару (пул, функция загрузки); живёт, пока жив пул."""
+    if reload is None or isinstance(reload, ProxyReplenisher):
+        return reload
+    with proxy_lock:
+        replenishers = _list_replenishers if isinstance(pool, list) else pool._replenishers
+        key = (id(pool), id(reload)) if isinstance(pool, list) else reload
+        replenisher = replenishers.get(key)
+        if replenisher is None:
+            replenisher = replenishers[key] = ProxyReplenisher(pool, reload, logger=logger)
+    return replenisher
+
+class SessionPool:
+    """
+    Ограниченный пул keep-alive сессий requests по ключу (прокси, хост).
+    Сессия выдаётся одному потоку за раз; простаивающие сверх idle_ttl закрываются,
+    при превышении max_idle вытесняется давно не использованная (LRU).
+    """
+
+    def __init__(self, max_idle: int = 1024, idle_ttl: float = 90.0):
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self._lock = Lock()
+        # id(session) -> (ключ, сессия, время возврата); порядок — от старых к новым
+        self._idle: OrderedDict[int, tuple[tuple, requests.Session, float]] = OrderedDict()
+        self._by_key: dict[tuple, list[int]] = {}
+
+    @contextmanager
+    def session(self, proxy: str | None, url: str) -> Iterator[requests.Session]:
+        """Взять сессию для запроса к url через proxy (None — напрямую)."""
+        key = (proxy, urlsplit(url).netloc.lower())
+        session = self._checkout(key) or self._create(proxy)
+        session.last_host = None
+        try:
+            yield session
+        except BaseException:
+            # Соединение могло остаться в непредсказуемом состоянии
+            session.close()
+            raise
+        # После редиректа открыто соединение к конечному хосту — под его ключом сессию и вернуть
+        self._checkin((proxy, session.last_host or key[1]), session)
+
+    def close(self):
+        with self._lock:
+            sessions = [session for _, session, _ in self._idle.values()]
+            self._idle.clear()
+            self._by_key.clear()
+        for session in sessions:
+            session.close()
+
+    def __len__(self) -> int:
+        return len(self._idle)
+
+    @staticmethod
+    def _create(proxy: str | None) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if proxy:
+            session.proxies.update(get_proxy_dict(proxy))
+
+        def remember_host(response, **kwargs):
+            session.last_host = urlsplit(response.url).netloc.lower()
+
+        session.hooks["response"].append(remember_host)
+        return session
+
+    def _checkout(self, key: tuple) -> requests.Session | None:
+        expired = []
+        session = None
+        with self._lock:
+            self._expire(time.monotonic(), expired)
+            ids = self._by_key.get(key)
+            if ids:
+                sid = ids.pop()
+                if not ids:
+                    del self._by_key[key]
+                _, session, _ = self._idle.pop(sid)
+        for stale in expired:
+            stale.close()
+        return session
+
+    def _checkin(self, key: tuple, session: requests.Session):
+        evicted = []
+        with self._lock:
+            sid = id(session)
+            self._idle[sid] = (key, session, time.monotonic())
+            self._by_key.setdefault(key, []).append(sid)
+            while len(self._idle) > self.max_idle:
+                evicted.append(self._pop_oldest())
+        for stale in evicted:
+            stale.close()
+
+    def _expire(self, now: float, expired: list):
+        while self._idle:
+            _, (_, _, last_used) = next(iter(self._idle.items()))
+            if now - last_used < self.idle_ttl:
+                break
+            expired.append(self._pop_oldest())
+
+    def _pop_oldest(self) -> requests.Session:
+        sid, (key, session, _) = self._idle.popitem(last=False)
+        ids = self._by_key.get(key)
+        if ids:
+            ids.remove(sid)
+            if not ids:
+                del self._by_key[key]
+        return session
+
+# 🔌 Общий пул сессий для всех запросов модуля
+session_pool = SessionPool()
+
+def http_get(
     url: str,
-    proxies: list[str],
-    working: list[str] | None = None,
+    proxy: str | None = None,
     *,
     headers: dict | None = None,
-    retries: int = 3,
-    timeout: int = 10,
-    logger: Callable[[str], None] | None = None,
-    reload_proxies: Callable[[], list[str]] | None = None,
-) -> Tuple[str | None, str | None]:
+    timeout: float | tuple = 10,
+    **kwargs,
+) -> requests.Response:
+    """GET через keep-alive сессию из session_pool (proxy=None — без прокси)."""
+    with session_pool.session(proxy, url) as session:
+        return session.get(url, headers=headers, timeout=timeout, **kwargs)
+
+def canonical_url(url: str) -> str:
+    """URL без привязки к зеркалу: домен любого из MIRRORS заменяется на zapo.ru."""
+    return with_mirror(url, "https://zapo.ru") if mirror_of(url) else url
+
+# 💾 Дисковый кеш ответов
+CACHE_DIR = "http_cache"
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Заголовки, от которых зависит содержимое ответа (XHR-запросы getFilters отдают JSON)
+_CACHE_VARY_HEADERS = ("Accept", "X-Requested-With")
+
+class CachedResponse:
+    __slots__ = ("key", "url", "content", "encoding", "etag", "last_modified", "stored_at")
+
+    def __init__(self, key, url, content, encoding, etag=None, last_modified=None, stored_at=None):
+        self.key = key
+        self.url = url
+        self.content = content
+        self.encoding = encoding
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at if stored_at is not None else time.time()
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def page(self) -> "Page":
+        return Page(self.url, 200, self.content, self.encoding, {})
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.stored_at < ttl
+
+    def conditional_headers(self, headers: dict | None) -> dict | None:
+        """Заголовки запроса с If-None-Match / If-Modified-Since для ревалидации."""
+        if not self.etag and not self.last_modified:
+            return headers
+        conditional = dict(headers or {})
+        if self.etag:
+            conditional["If-None-Match"] = self.etag
+        if self.last_modified:
+            conditional["If-Modified-Since"] = self.last_modified
+        return conditional
+
+class ResponseCache:
     """
-    Загружает страницу с использованием списка прокси. Без приоритета working-прокси.
-    Работает как старая версия, но с защитой от антибота.
+    Дисковый кеш ответов по каноническому URL (один и тот же для всех зеркал).
+    Свежесть задаёт вызывающий (ttl на этап), устаревшие записи с ETag / Last-Modified
+    ревалидируются условным GET. Общий размер ограничен max_bytes (вытеснение LRU).
     """
-    def is_blocked(html: str) -> bool:
-        return (
-            "Robot Geo Check Redirector" in html
-            or "window.location.href" in html
-            or "enable Javascript" in html
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._index: OrderedDict[str, int] | None = None  # ключ -> размер, от старых к новым
+        self._total = 0
+
+    def key(self, url: str, headers: dict | None = None) -> str:
+        vary = {k.lower(): v for k, v in (headers or {}).items()}
+        parts = [canonical_url(url)] + [f"{h}={vary.get(h.lower(), '')}" for h in _CACHE_VARY_HEADERS]
+        return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, url: str, headers: dict | None = None) -> CachedResponse | None:
+        """Вернуть запись (возможно, устаревшую) или None."""
+        key = self.key(url, headers)
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None
+        self._touch(key, len(content))
+        return CachedResponse(
+            key, meta["url"], content, meta.get("encoding"),
+            meta.get("etag"), meta.get("last_modified"), meta.get("stored_at"),
         )
 
-    working = working or []
+    def put(
+        self,
+        url: str,
+        headers: dict | None,
+        content: bytes,
+        encoding: str | None,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> CachedResponse:
+        key = self.key(url, headers)
+        entry = CachedResponse(key, canonical_url(url), content, encoding, etag, last_modified)
+        self._write(entry)
+        return entry
 
-    for attempt in range(1, retries + 1):
-        with proxy_lock:
-            proxy_list = proxies.copy()
-        random.shuffle(proxy_list)
+    def refresh(self, entry: CachedResponse):
+        """Ответ 304: запись снова свежая."""
+        entry.stored_at = time.time()
+        self._write(entry, meta_only=True)
 
-        while proxy_list:
-            proxy = proxy_list.pop()
+    def invalidate(self, url: str, headers: dict | None = None):
+        """Удалить запись (например, страница оказалась пустой или заблокированной)."""
+        key = self.key(url, headers)
+        for path in self._paths(key):
             try:
-                response = requests.get(
-                    url,
-                    headers=headers,
-                    timeout=timeout,
-                    proxies=get_proxy_dict(proxy),
-                )
-                response.raise_for_status()
-                if is_blocked(response.text):
-                    raise RuntimeError("❌ Заблокировано антибот-защитой")
-                with proxy_lock:
-                    if proxy not in working:
-                        working.append(proxy)
-                return response.text, proxy
-            except Exception as e:
-                if logger:
-                    logger(f"[ПРОКСИ ОШИБКА] {proxy} — {e}")
-                with proxy_lock:
-                    if proxy in proxies:
-                        proxies.remove(proxy)
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            if self._index is not None and key in self._index:
+                self._total -= self._index.pop(key)
 
-        # 🔁 Прокси закончились — пробуем перезагрузить
-        if reload_proxies and attempt < retries:
-            if logger:
-                logger("[ПРОКСИ] 🔁 Все прокси исчерпаны. Пробуем загрузить новые...")
-            with proxy_lock:
-                new_proxies = reload_proxies()
-                if new_proxies:
-                    if logger:
-                        logger(f"[ПРОКСИ] Получено новых прокси: {len(new_proxies)}")
-                    proxies.clear()
-                    proxies.extend(new_proxies)
+    def _paths(self, key: str) -> tuple[str, str]:
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".body", base + ".json"
+
+    def _write(self, entry: CachedResponse, meta_only: bool = False):
+        body_path, meta_path = self._paths(entry.key)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        tmp_suffix = f".{os.getpid()}.{id(entry)}.tmp"
+        if not meta_only:
+            with open(body_path + tmp_suffix, "wb") as f:
+                f.write(entry.content)
+            os.replace(body_path + tmp_suffix, body_path)
+        meta = {
+            "url": entry.url,
+            "encoding": entry.encoding,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+            "stored_at": entry.stored_at,
+        }
+        with open(meta_path + tmp_suffix, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + tmp_suffix, meta_path)
+        self._touch(entry.key, len(entry.content))
+        self._evict()
+
+    def _load_index(self):
+        """Однократно просканировать каталог кеша (от старых файлов к новым)."""
+        entries = []
+        if os.path.isdir(self.directory):
+            for sub in os.listdir(self.directory):
+                sub_dir = os.path.join(self.directory, sub)
+                if not os.path.isdir(sub_dir):
                     continue
-                else:
-                    if logger:
-                        logger("[ПРОКСИ] ❌ Не удалось получить новые прокси.")
-                    break
+                for name in os.listdir(sub_dir):
+                    if name.endswith(".body"):
+                        try:
+                            stat = os.stat(os.path.join(sub_dir, name))
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._total = sum(self._index.values())
 
-        # 📡 Последняя попытка — без прокси
-        try:
-            if logger:
-                logger(f"[ПОПЫТКА {attempt}] Пробуем загрузить без прокси...")
-            response = requests.get(url, headers=headers, timeout=timeout)
-            response.raise_for_status()
-            if is_blocked(response.text):
-                raise RuntimeError("❌ Доступ без прокси заблокирован")
-            return response.text, None
-        except Exception as e:
-            if logger:
-                logger(f"[ОШИБКА] Попытка {attempt} без прокси не удалась: {e}")
+    def _touch(self, key: str, size: int):
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            self._total += size - self._index.pop(key, 0)
+            self._index[key] = size
 
-    if logger:
-        logger(f"[ОШИБКА] ❌ Все попытки загрузки неудачны: {url}")
-    return None, None
\ No newline at end of file
+    def _evict(self):
+        victims = []
+        with self._lock:
+            while self._index and self._total > self.max_bytes:
+                key, size = self._index.popitem(last=False)
+                self._total -= size
+                victims.append(key)
+        for key in victims:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+response_cache = ResponseCache()
+
+# 📈 Метрики процесса: счётчики, gauge и гистограммы с метками, экспорт в формате Prometheus
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Файл для textfile-коллектора ({script} — имя скрипта этапа) и/или порт локального /metrics
+METRICS_FILE = os.getenv("ZAPO_METRICS_FILE")
+METRICS_PORT = os.getenv("ZAPO_METRICS_PORT")
+METRICS_WRITE_INTERVAL = 15.0
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{key}="{_label_value(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metrics:
+    """
+    Реестр метрик процесса. inc — счётчик, set/add — gauge, observe — гистограмма
+    (границы LATENCY_BUCKETS); метки — именованные аргументы. render() отдаёт
+    текстовый формат Prometheus, write() атомарно пишет его в файл, serve() —
+    локальный HTTP /metrics. Семейство создаётся при первой записи.
+    """
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = Lock()
+        self._kinds: dict[str, str] = {}
+        self._help: dict[str, str] = {}
+        self._series: dict[str, dict[tuple, "float | _Histogram"]] = {}
+        self._writer: Thread | None = None
+        self._exporting = False
+
+    def describe(self, name: str, kind: str, help: str):
+        """Тип ("counter" / "gauge" / "histogram") и описание семейства для # HELP."""
+        with self._lock:
+            self._kinds[name] = kind
+            self._help[name] = help
+
+    def _family(self, name: str, kind: str) -> dict:
+        family = self._series.get(name)
+        if family is None:
+            self._kinds.setdefault(name, kind)
+            family = self._series[name] = {}
+        return family
+
+    def inc(self, metric: str, value: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._family(metric, "counter")
+            family[key] = family.get(key, 0.0) + value
+
+    def set(self, metric: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._family(metric, "gauge")[key] = float(value)
+
+    def add(self, metric: str, delta: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._family(metric, "gauge")
+            family[key] = family.get(key, 0.0) + delta
+
+    def observe(self, metric: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._family(metric, "histogram")
+            histogram = family.get(key)
+            if histogram is None:
+                histogram = family[key] = _Histogram(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram.counts[i] += 1
+                    break
+            histogram.sum += value
+            histogram.count += 1
+
+    def value(self, metric: str, **labels) -> float:
+        """Текущее значение счётчика или gauge (0 — серии нет)."""
+        with self._lock:
+            value = self._series.get(metric, {}).get(tuple(sorted(labels.items())), 0.0)
+        return value.count if isinstance(value, _Histogram) else value
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted(self._series):
+                kind = self._kinds[name]
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(self._series[name].items()):
+                    if not isinstance(value, _Histogram):
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                        continue
+                    cumulative = 0
+                    for bound, hits in zip(self.buckets, value.counts):
+                        cumulative += hits
+                        le = f'le="{bound:g}"'
+                        lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+                    le = 'le="+Inf"'
+                    lines.append(f"{name}_bucket{_format_labels(labels, le)} {value.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value.sum:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Записать метрики через временный файл: коллектор не увидит половину."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """Поднять GET /metrics в фоновом потоке; возвращает сервер (shutdown() — остановить)."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+    def write_every(self, path: str, interval: float = METRICS_WRITE_INTERVAL):
+        """Периодически писать метрики в path и один раз — при выходе из процесса."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write(path)
+                except OSError:
+                    pass
+
+        self._writer = Thread(target=loop, name="metrics-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.write, path)
+
+    def start_from_env(self, logger: Callable[[str], None] | None = None):
+        """
+        Включить экспорт по ZAPO_METRICS_FILE / ZAPO_METRICS_PORT (без них — ничего).
+        Вызывается из profile_main при запуске этапа, повторный вызов ничего не делает.
+        """
+        with self._lock:
+            if self._exporting:
+                return
+            self._exporting = True
+        if METRICS_FILE:
+            self.write_every(METRICS_FILE.format(script=_script_name(), pid=os.getpid()))
+        if METRICS_PORT:
+            try:
+                self.serve(int(METRICS_PORT))
+            except OSError as e:
+                # Порт занят другим этапом — метрики этого процесса остаются в файле
+                if logger:
+                    logger(f"[МЕТРИКИ] ⚠️ Порт {METRICS_PORT} недоступен: {e}")
+
+metrics = Metrics()
+metrics.describe("zapo_http_requests_total", "counter", "HTTP-запросы по зеркалу, маршруту и исходу")
+metrics.describe("zapo_http_request_seconds", "histogram", "Время HTTP-запроса до конца тела")
+metrics.describe("zapo_http_response_bytes_total", "counter", "Байты тел ответов по зеркалу")
+metrics.describe("zapo_proxy_requests_total", "counter", "HTTP-запросы через прокси по исходу")
+metrics.describe("zapo_proxy_request_seconds_total", "counter", "Суммарное время запросов через прокси")
+metrics.describe("zapo_fetches_total", "counter", "Загрузки страниц (со всеми повторами) по результату")
+metrics.describe("zapo_fetch_retries_total", "counter", "Повторные запросы внутри загрузки страницы")
+metrics.describe("zapo_tasks_total", "counter", "Завершённые задачи этапа по результату")
+metrics.describe("zapo_tasks_inflight", "gauge", "Задачи этапа в работе")
+metrics.describe("zapo_concurrency_limit", "gauge", "Текущий лимит AdaptiveConcurrency")
+
+# Счётчик запросов текущей загрузки: fetch_page_with_proxies ставит, stream_get увеличивает
+_fetch_requests: ContextVar[list[int] | None] = ContextVar("_fetch_requests", default=None)
+
+def _metric_mirror(url: str) -> str:
+    """Метка зеркала: хост из MIRRORS, прочие сайты — одной меткой, чтобы не плодить серии."""
+    mirror = mirror_of(url)
+    return urlsplit(mirror).netloc if mirror else "other"
+
+def _request_outcome(error: Exception) -> str:
+    if isinstance(error, PageBlocked):
+        return error.kind
+    if isinstance(error, MirrorUnavailable):
+        return "rate_limited"
+    if isinstance(error, ResponseTooLarge):
+        return "too_large"
+    if isinstance(error, (requests.Timeout, asyncio.TimeoutError)):
+        return "timeout"
+    return "error"
+
+def _record_request(url: str, proxy: str | None, outcome: str, elapsed: float, size: int = 0):
+    mirror = _metric_mirror(url)
+    route = "proxy" if proxy else "direct"
+    metrics.inc("zapo_http_requests_total", mirror=mirror, route=route, outcome=outcome)
+    metrics.observe("zapo_http_request_seconds", elapsed, mirror=mirror, route=route)
+    if size:
+        metrics.inc("zapo_http_response_bytes_total", size, mirror=mirror)
+    if proxy:
+        metrics.inc("zapo_proxy_requests_total", proxy=proxy, outcome=outcome)
+        metrics.inc("zapo_proxy_request_seconds_total", elapsed, proxy=proxy)
+    requests_made = _fetch_requests.get()
+    if requests_made is not None:
+        requests_made[0] += 1
+
+def _record_fetch(url: str, requests_made: int, ok: bool):
+    mirror = _metric_mirror(url)
+    result = "ok" if ok else "failed"
+    if ok and requests_made == 0:
+        result = "cached"
+    metrics.inc("zapo_fetches_total", mirror=mirror, result=result)
+    if requests_made > 1:
+        metrics.inc("zapo_fetch_retries_total", requests_made - 1, mirror=mirror)
+
+def _metered(fetch):
+    """Учёт загрузки целиком: результат и число повторных запросов."""
+    @wraps(fetch)
+    def wrapper(url: str, *args, **kwargs):
+        requests_made = [0]
+        token = _fetch_requests.set(requests_made)
+        page = None
+        try:
+            page, proxy = fetch(url, *args, **kwargs)
+            return page, proxy
+        finally:
+            _fetch_requests.reset(token)
+            _record_fetch(url, requests_made[0], page is not None)
+    return wrapper
+
+def _metered_async(fetch):
+    @wraps(fetch)
+    async def wrapper(url: str, *args, **kwargs):
+        requests_made = [0]
+        token = _fetch_requests.set(requests_made)
+        page = None
+        try:
+            page, proxy = await fetch(url, *args, **kwargs)
+            return page, proxy
+        finally:
+            _fetch_requests.reset(token)
+            _record_fetch(url, requests_made[0], page is not None)
+    return wrapper
+
+# ⏳ Бюджет повторов: один на задачу, общий для всех вложенных циклов
+_budget_stats_lock = Lock()
+# (имя бюджета, причина: "attempts" / "deadline") -> сколько задач исчерпали бюджет
+retry_budget_stats: dict[tuple[str, str], int] = {}
+
+class RetryBudget:
+    """
+    Ограничение на число сетевых запросов и время для одной задачи (URL, группы, бренда).
+    Передаётся во все вложенные циклы повторов и в fetch_with_proxies(budget=...);
+    каждый запрос расходует одну попытку, таймауты урезаются до оставшегося времени.
+    """
+
+    def __init__(self, attempts: int, seconds: float | None = None, *, name: str = ""):
+        self.attempts = attempts
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.name = name
+        self.spent = 0
+        self.reason: str | None = None
+        self._lock = Lock()
+
+    def remaining(self) -> float | None:
+        """Сколько секунд осталось до дедлайна (None — без ограничения по времени)."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def exhausted(self) -> bool:
+        with self._lock:
+            return self._check()
+
+    def spend(self) -> bool:
+        """Израсходовать попытку; False — бюджет исчерпан и запрос делать не нужно."""
+        with self._lock:
+            if self._check():
+                return False
+            self.spent += 1
+            return True
+
+    def timeout(self, default: float | tuple) -> float | tuple:
+        """Урезать таймаут (или пару connect/read) до оставшегося времени."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if isinstance(default, tuple):
+            return tuple(max(0.1, min(t, remaining)) for t in default)
+        return max(0.1, min(default, remaining))
+
+    def sleep(self, seconds: float):
+        """Пауза между повторами, не выходящая за дедлайн."""
+        remaining = self.remaining()
+        time.sleep(seconds if remaining is None else min(seconds, remaining))
+
+    def _check(self) -> bool:
+        if self.reason is None:
+            if self.spent >= self.attempts:
+                self._exhaust("attempts")
+            elif self.deadline is not None and time.monotonic() >= self.deadline:
+                self._exhaust("deadline")
+        return self.reason is not None
+
+    def _exhaust(self, reason: str):
+        self.reason = reason
+        with _budget_stats_lock:
+            key = (self.name, reason)
+            retry_budget_stats[key] = retry_budget_stats.get(key, 0) + 1
+
+    def __repr__(self) -> str:
+        return f"RetryBudget({self.name!r}, spent={self.spent}/{self.attempts}, remaining={self.remaining()})"
+
+def format_budget_stats() -> str:
+    """Сводка по исчерпанным бюджетам для лога этапа."""
+    with _budget_stats_lock:
+        items = sorted(retry_budget_stats.items())
+    if not items:
+        return "[БЮДЖЕТ] Все задачи уложились в бюджет повторов"
+    return "[БЮДЖЕТ] Исчерпан: " + ", ".join(
+        f"{name or '-'}/{reason}={count}" for (name, reason), count in items
+    )
+
+def _budget_spent(budget: RetryBudget | None, url: str, logger: Callable[[str], None] | None) -> bool:
+    if budget is None or budget.spend():
+        return False
+    if logger:
+        logger(f"[БЮДЖЕТ] ⌛ Исчерпан ({budget.reason}, {budget.spent} запросов): {url}")
+    return True
+
+# 🎚️ Адаптивная конкурентность (AIMD)
+class AdaptiveConcurrency:
+    """
+    Ограничитель числа одновременных задач вместо подобранных вручную THREADS.
+    Пока задачи успешны и задержка не растёт, лимит растёт аддитивно (+increase за
+    «круг» из limit задач); при падении доли успехов ниже min_success или росте
+    задержки в latency_tolerance раз от обычной — умножается на decrease (не чаще
+    раза в cooldown секунд). ceiling — жёсткий потолок; run_bounded(concurrency=...)
+    отправляет в пул не больше limit задач, и потоков заводится столько же.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        *,
+        ceiling: int,
+        floor: int = 1,
+        increase: float = 1.0,
+        decrease: float = 0.7,
+        min_success: float = 0.8,
+        latency_tolerance: float = 2.0,
+        min_latency: float = 1.0,
+        cooldown: float = 2.0,
+        alpha: float = 0.05,
+        name: str = "",
+        logger: Callable[[str], None] | None = None,
+        log_every: float = 30.0,
+    ):
+        self.ceiling = ceiling
+        self.floor = max(1, floor)
+        self.increase = increase
+        self.decrease = decrease
+        self.min_success = min_success
+        self.latency_tolerance = latency_tolerance
+        self.min_latency = min_latency
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.name = name
+        self.logger = logger
+        self.log_every = log_every
+        self._limit = float(min(max(initial, self.floor), ceiling))
+        self._inflight = 0
+        self._success = 1.0
+        self._latency_fast: float | None = None
+        self._latency_slow: float | None = None
+        self._last_decrease = 0.0
+        self._last_log = time.monotonic()
+        self._cond = Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self):
+        with self._cond:
+            while self._inflight >= int(self._limit):
+                self._cond.wait()
+            self._inflight += 1
+
+    def release(self, ok: bool | None = None, latency: float | None = None):
+        """Освободить место; ok=None — задача пропущена и в статистику не идёт."""
+        message = None
+        with self._cond:
+            self._inflight -= 1
+            before = int(self._limit)
+            if ok is not None:
+                message = self._observe(ok, latency)
+            if int(self._limit) > before:
+                self._cond.notify_all()
+            else:
+                self._cond.notify()
+            metrics.set("zapo_concurrency_limit", int(self._limit), name=self.name)
+            now = time.monotonic()
+            if message is None and now - self._last_log >= self.log_every:
+                message = f"[КОНКУРЕНТНОСТЬ] {self}"
+            if message is not None:
+                self._last_log = now
+        if message and self.logger:
+            self.logger(message)
+
+    @contextmanager
+    def slot(self):
+        """with concurrency.slot() as done: ...; done(ok) — исход задачи (по умолчанию успех)."""
+        self.acquire()
+        started = time.monotonic()
+        outcome = {"ok": True}
+
+        def done(ok: bool | None):
+            outcome["ok"] = ok
+
+        try:
+            yield done
+        except BaseException:
+            outcome["ok"] = False
+            raise
+        finally:
+            self.release(outcome["ok"], time.monotonic() - started)
+
+    def wrap(self, fn: Callable, succeeded: Callable[[object], bool | None] | None = None) -> Callable:
+        """
+        Обёртка задачи для executor.submit/map: ждёт свободного места и сообщает исход.
+        succeeded(result) -> True/False/None (None — задача пропущена); без него успех —
+        отсутствие исключения.
+        """
+        @wraps(fn)
+        def run(*args, **kwargs):
+            with self.slot() as done:
+                result = fn(*args, **kwargs)
+                if succeeded is not None:
+                    done(succeeded(result))
+                return result
+        return run
+
+    def _observe(self, ok: bool, latency: float | None) -> str | None:
+        a = self.alpha
+        self._success = (1 - a) * self._success + a * (1.0 if ok else 0.0)
+        if ok and latency is not None:
+            if self._latency_fast is None:
+                self._latency_fast = self._latency_slow = latency
+            self._latency_fast = 0.7 * self._latency_fast + 0.3 * latency
+            self._latency_slow = (1 - a) * self._latency_slow + a * latency
+
+        slow = self._latency_fast is not None and self._latency_fast > max(
+            self.min_latency, self._latency_slow * self.latency_tolerance
+        )
+        if self._success >= self.min_success and not slow:
+            self._limit = min(float(self.ceiling), self._limit + self.increase / self._limit)
+            return None
+
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return None
+        self._last_decrease = now
+        before = int(self._limit)
+        self._limit = max(float(self.floor), self._limit * self.decrease)
+        reason = "задержка" if slow else "ошибки"
+        return f"[КОНКУРЕНТНОСТЬ] ⬇️ {self.name}: {before} → {int(self._limit)} ({reason}; {self})"
+
+    def __repr__(self) -> str:
+        latency = f"{self._latency_fast:.1f}с" if self._latency_fast is not None else "-"
+        return (
+            f"{self.name or 'задачи'}: лимит {int(self._limit)}/{self.ceiling}, в работе {self._inflight}, "
+            f"успех {self._success:.0%}, задержка {latency}"
+        )
+
+# 🧷 Склейка одинаковых одновременных запросов
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+class SingleFlight:
+    """
+    Одновременные вызовы с одним ключом выполняются один раз: первый вызывающий
+    делает работу, остальные ждут и получают его результат (или его исключение).
+    Для корутин — по отдельной таблице задач на каждый event loop.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._flights: dict[str, _Flight] = {}
+        self._tasks: "WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Task]]" = WeakKeyDictionary()
+
+    def __len__(self) -> int:
+        return len(self._flights) + sum(len(tasks) for tasks in list(self._tasks.values()))
+
+    def do(self, key: str, fn: Callable[[], object]):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def do_async(self, key: str, fn: Callable[[], "asyncio.Future"]):
+        tasks = self._tasks.setdefault(asyncio.get_running_loop(), {})
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: tasks.pop(key, None))
+        # shield: отмена одного из ожидающих не должна отменять общую загрузку
+        return await asyncio.shield(task)
+
+inflight_requests = SingleFlight()
+
+def _coalesce_key(url: str, headers: dict | None, kwargs: dict) -> str:
+    """Страница (с точностью до зеркала), все заголовки запроса и параметры, от которых зависит ответ."""
+    return "\n".join([
+        canonical_url(url),
+        repr(sorted((k.lower(), v) for k, v in (headers or {}).items())),
+        f"max_bytes={kwargs.get('max_bytes', MAX_BODY_BYTES)}",
+        f"cache_ttl={kwargs.get('cache_ttl')}",
+    ])
+
+def _follower_result(result: tuple, budget: "RetryBudget | None") -> tuple:
+    """
+    Ответ ведомому вызову: прокси ведущего ему не принадлежит (None), а попытка
+    списывается с его собственного бюджета — исчерпанный бюджет страницу не получает.
+    """
+    if budget is not None and not budget.spend():
+        return None, None
+    return result[0], None
+
+def _coalesced(fetch):
+    """
+    Склеивать одновременные загрузки одной страницы (с точностью до зеркала) с теми же
+    заголовками, max_bytes и cache_ttl. Страницу загружает первый вызов, остальные
+    получают её же (см. _follower_result).
+    """
+    @wraps(fetch)
+    def wrapper(url: str, *args, headers: dict | None = None, **kwargs):
+        led = []
+
+        def lead():
+            led.append(True)
+            return fetch(url, *args, headers=headers, **kwargs)
+
+        result = inflight_requests.do(_coalesce_key(url, headers, kwargs), lead)
+        return result if led else _follower_result(result, kwargs.get("budget"))
+    return wrapper
+
+def _coalesced_async(fetch):
+    @wraps(fetch)
+    async def wrapper(url: str, *args, headers: dict | None = None, **kwargs):
+        led = []
+
+        def lead():
+            led.append(True)
+            return fetch(url, *args, headers=headers, **kwargs)
+
+        result = await inflight_requests.do_async(_coalesce_key(url, headers, kwargs), lead)
+        return result if led else _follower_result(result, kwargs.get("budget"))
+    return wrapper
+
+# ⏱️ Адаптивные таймауты
+DEFAULT_TIMEOUT = 10.0
+class LatencyWindow:
+    """Последние window замеров по каждому ключу и их перцентили."""
+
+    def __init__(self, window: int = 64):
+        self.window = window
+        self._lock = Lock()
+        self._samples: dict[object, deque] = {}
+
+    def observe(self, key, seconds: float):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, key, q: float, min_samples: int = 1) -> float | None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples or len(samples) < min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def forget(self, key):
+        with self._lock:
+            self._samples.pop(key, None)
+
+class AdaptiveTimeouts:
+    """
+    Раздельные таймауты (connect, read) по наблюдаемой задержке:
+    connect — p95 времени до заголовков через этот прокси, read — p95 полной загрузки
+    страницы с этого зеркала; оба умножаются на k и ограничиваются снизу и сверху.
+    Пока замеров меньше min_samples, используется таймаут по умолчанию.
+    """
+
+    def __init__(
+        self,
+        *,
+        k: float = 3.0,
+        quantile: float = 0.95,
+        connect_bounds: tuple[float, float] = (0.5, 10.0),
+        read_bounds: tuple[float, float] = (2.0, 30.0),
+        min_samples: int = 5,
+        window: int = 64,
+    ):
+        self.k = k
+        self.quantile = quantile
+        self.connect_bounds = connect_bounds
+        self.read_bounds = read_bounds
+        self.min_samples = min_samples
+        self.proxies = LatencyWindow(window)
+        self.mirrors = LatencyWindow(window)
+
+    def timeout(self, proxy: str | None, url: str, default: float) -> tuple[float, float]:
+        connect = self._scaled(self.proxies, proxy, self.connect_bounds, min(default, self.connect_bounds[1]))
+        read = self._scaled(self.mirrors, self._mirror_key(url), self.read_bounds, default)
+        return connect, read
+
+    def observe(self, proxy: str | None, url: str, first_byte: float, total: float):
+        """Записать успешный ответ: время до заголовков и полное время загрузки."""
+        self.proxies.observe(proxy, first_byte)
+        self.mirrors.observe(self._mirror_key(url), total)
+
+    def _scaled(self, window: LatencyWindow, key, bounds: tuple[float, float], default: float) -> float:
+        p = window.percentile(key, self.quantile, self.min_samples)
+        if p is None:
+            return default
+        low, high = bounds
+        return min(high, max(low, p * self.k))
+
+    @staticmethod
+    def _mirror_key(url: str) -> str:
+        return mirror_of(url) or urlsplit(url).netloc.lower()
+
+adaptive_timeouts = AdaptiveTimeouts()
+
+# 🚦 Маршрутизация: напрямую или через прокси
+DIRECT = "direct"
+PROXIED = "proxied"
+# Сторонний сайт (не зеркало), недоступный напрямую, пробуется не больше чем через столько прокси за загрузку
+THIRD_PARTY_PROXY_ATTEMPTS = 2
+
+class RoutingPolicy:
+    """
+    Как ходить к хосту: зеркала zapo — через прокси, остальные сайты (сайты брендов) —
+    напрямую через session_pool с keep-alive, прокси для них — запасной путь.
+    Хост, к которому fallback_after прямых запросов подряд не удались, на fallback_for
+    секунд переводится на прокси. overrides — маршрут для отдельных хостов.
+    Здоровье сторонних хостов ведётся здесь, а не в пуле прокси: после down_after
+    неудач через прокси подряд хост считается лежащим (is_down) на down_for секунд.
+    """
+
+    def __init__(
+        self,
+        mirrors: str = PROXIED,
+        others: str = DIRECT,
+        *,
+        overrides: dict[str, str] | None = None,
+        fallback_after: int = 2,
+        fallback_for: float = 30 * 60,
+        down_after: int = 3,
+        down_for: float = 10 * 60,
+    ):
+        self.mirrors = mirrors
+        self.others = others
+        self.overrides = {host.lower(): route for host, route in (overrides or {}).items()}
+        self.fallback_after = fallback_after
+        self.fallback_for = fallback_for
+        self.down_after = down_after
+        self.down_for = down_for
+        self._lock = Lock()
+        self._failures: dict[str, int] = {}
+        self._fallback_until: dict[str, float] = {}
+        self._proxied_failures: dict[str, int] = {}
+        self._down_until: dict[str, float] = {}
+
+    def route(self, url: str) -> str:
+        host = urlsplit(url).netloc.lower()
+        if host in self.overrides:
+            return self.overrides[host]
+        route = self.mirrors if mirror_of(url) is not None else self.others
+        if route != DIRECT:
+            return route
+        with self._lock:
+            until = self._fallback_until.get(host)
+            if until is None:
+                return DIRECT
+            if time.monotonic() < until:
+                return PROXIED
+            del self._fallback_until[host]
+        return DIRECT
+
+    def report(self, url: str, ok: bool):
+        """Учесть исход прямого запроса к хосту."""
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if ok:
+                self._failures.pop(host, None)
+                return
+            failures = self._failures.get(host, 0) + 1
+            if failures < self.fallback_after:
+                self._failures[host] = failures
+                return
+            self._failures.pop(host, None)
+            self._fallback_until[host] = time.monotonic() + self.fallback_for
+
+    def report_proxied(self, url: str, ok: bool):
+        """Учесть исход запроса к стороннему хосту через прокси."""
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if ok:
+                self._proxied_failures.pop(host, None)
+                self._down_until.pop(host, None)
+                return
+            failures = self._proxied_failures.get(host, 0) + 1
+            if failures < self.down_after:
+                self._proxied_failures[host] = failures
+                return
+            self._proxied_failures.pop(host, None)
+            self._down_until[host] = time.monotonic() + self.down_for
+
+    def is_down(self, url: str) -> bool:
+        """Сторонний хост не отвечал ни напрямую, ни через прокси — пока не тратить на него запросы."""
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            until = self._down_until.get(host)
+            if until is None:
+                return False
+            if time.monotonic() < until:
+                return True
+            del self._down_until[host]
+        return False
+
+    def fallen_back(self) -> list[str]:
+        """Хосты, временно переведённые на прокси."""
+        now = time.monotonic()
+        with self._lock:
+            return [host for host, until in self._fallback_until.items() if until > now]
+
+default_routing = RoutingPolicy()
+
+# 📏 Потоковое чтение ответов
+MAX_BODY_BYTES = 8 * 1024 * 1024
+# По началу документа распознаются страницы лимита, отказа доступа и антибота
+HEAD_BYTES = 16 * 1024
+_CHUNK_SIZE = 16 * 1024
+
+class Page(NamedTuple):
+    """
+    Ответ сервера: тело в байтах и кодировка — из Content-Type или из <meta charset>
+    (None — не указана). Парсерам лучше отдавать байты через soup(): документ
+    декодируется один раз, без угадывания кодировки по всему телу.
+    final_url — адрес после редиректов (None — неизвестен, например ответ из кеша).
+    """
+    url: str
+    status: int
+    content: bytes
+    encoding: str | None
+    headers: dict
+    final_url: str | None = None
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def soup(self, features: str = "html.parser") -> BeautifulSoup:
+        return BeautifulSoup(self.content, features, from_encoding=self.encoding)
+
+_CHARSET_HEADER = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.I)
+_CHARSET_META = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?([\w.:-]+)", re.I)
+_SNIFF_BYTES = 4096
+
+def _page_encoding(content_type: str | None, content: bytes) -> str | None:
+    """Кодировка из заголовка, иначе из <meta> в начале документа — без анализа всего тела."""
+    match = _CHARSET_HEADER.search(content_type or "")
+    if match:
+        return match.group(1).lower()
+    match = _CHARSET_META.search(content, 0, _SNIFF_BYTES)
+    return match.group(1).decode("ascii").lower() if match else None
+
+def _marker_group(name: str, *markers: "str | re.Pattern") -> bytes:
+    # Страницы зеркал бывают и в UTF-8, и в cp1251; строка — литерал, re.Pattern — выражение
+    variants = sorted({
+        (marker.pattern if isinstance(marker, re.Pattern) else re.escape(marker)).encode(enc)
+        for marker in markers
+        for enc in ("utf-8", "cp1251")
+    })
+    return b"(?P<%s>%s)" % (name.encode(), b"|".join(variants))
+
+# Все маркеры в одном выражении — один проход по байтам вместо нескольких поисков по тексту
+_PAGE_MARKERS = re.compile(b"|".join([
+    _marker_group("rate_limited", "Превышен лимит запросов в день"),
+    _marker_group("access_denied", "Access denied to", "<title>Access Denied</title>"),
+    _marker_group("challenge", "Robot Geo Check Redirector", "window.location.href", "enable Javascript"),
+]))
+
+# Запас при повторном сканировании: маркер мог начаться до границы уже проверенной части
+_MARKER_OVERLAP = 64
+
+def _scan_markers(content: bytes, pos: int = 0) -> set[str]:
+    return {match.lastgroup for match in _PAGE_MARKERS.finditer(content, pos)}
+
+def _raise_for_markers(url: str, markers: set[str]):
+    """Лимит — MirrorUnavailable, отказ доступа и антибот — PageBlocked (пробуем другой прокси)."""
+    if "rate_limited" in markers:
+        raise MirrorUnavailable("⛔ Превышен дневной лимит запросов зеркала")
+    if "access_denied" in markers:
+        raise PageBlocked("access_denied", "❌ Доступ к зеркалу запрещён")
+    if "challenge" in markers:
+        raise PageBlocked("challenge", "❌ Заблокировано антибот-защитой")
+
+# 🧪 Разметка ответа: данные, честно пустая страница или заглушка
+PAGE_OK = "ok"
+PAGE_EMPTY = "empty"
+PAGE_NO_DATA = "no_data"
+PAGE_SOFT_BLOCKED = "soft_blocked"
+# Разметка сайта зеркал — есть у любой их страницы, но не у заглушки прокси или антибота
+LAYOUT_MARKERS = ('class="fr-',)
+
+class PageClassifier:
+    """
+    Разметка ответа за один проход по байтам. content — признаки данных на странице этапа
+    (строка таблицы, плитка товара); empty — проверенное на настоящих страницах этапа
+    сообщение «ничего нет». Общего значения у empty нет: текст вроде «не найдено» бывает
+    и в поиске, и в подвале, а PAGE_EMPTY — окончательный ответ. Без такого сообщения
+    (empty=()) пустая страница считается PAGE_NO_DATA и повторяется.
+    classify() возвращает PAGE_OK, PAGE_EMPTY (явное «ничего нет» — повторять бессмысленно),
+    PAGE_NO_DATA (целая страница зеркала без данных и без такого сообщения — стоит спросить
+    другое зеркало), PAGE_SOFT_BLOCKED (заглушка или обрезанный документ — стоит взять
+    другой прокси) либо "access_denied" / "rate_limited" / "challenge".
+    """
+
+    def __init__(
+        self,
+        content: Iterable["str | re.Pattern"],
+        *,
+        empty: Iterable["str | re.Pattern"],
+        layout: Iterable["str | re.Pattern"] = LAYOUT_MARKERS,
+    ):
+        groups = {"content": list(content), "empty": list(empty), "layout": list(layout)}
+        # Пустая группа совпала бы с любой страницей — маркеров нет, нет и группы
+        self.pattern = re.compile(b"|".join([
+            _PAGE_MARKERS.pattern,
+            *(_marker_group(name, *markers) for name, markers in groups.items() if markers),
+            _marker_group("complete", "</html>", "</HTML>"),
+        ]))
+
+    def classify(self, page: "Page | bytes") -> str:
+        content = page.content if isinstance(page, Page) else page
+        found = {match.lastgroup for match in self.pattern.finditer(content)}
+        for kind in ("rate_limited", "access_denied", "challenge"):
+            if kind in found:
+                return kind
+        if "content" in found:
+            return PAGE_OK
+        if "empty" in found:
+            return PAGE_EMPTY
+        if {"layout", "complete"} <= found:
+            return PAGE_NO_DATA
+        return PAGE_SOFT_BLOCKED
+
+class _BodyReader:
+    """Накопитель тела ответа: лимит размера и проверка начала документа по ходу чтения."""
+
+    def __init__(self, url: str, max_bytes: int | None, declared_length: str | None):
+        if max_bytes and declared_length and declared_length.isdigit() and int(declared_length) > max_bytes:
+            raise ResponseTooLarge(f"📏 Content-Length {declared_length} больше {max_bytes} байт")
+        self.url = url
+        self.max_bytes = max_bytes
+        self.chunks: list[bytes] = []
+        self.size = 0
+        self.scanned = 0
+
+    def feed(self, chunk: bytes):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise ResponseTooLarge(f"📏 Тело ответа больше {self.max_bytes} байт")
+        if not self.scanned and self.size >= HEAD_BYTES:
+            _raise_for_markers(self.url, _scan_markers(b"".join(self.chunks)))
+            self.scanned = self.size
+
+    def finish(self) -> bytes:
+        """Склеить тело и досканировать то, что пришло после проверки начала."""
+        content = b"".join(self.chunks)
+        _raise_for_markers(self.url, _scan_markers(content, max(0, self.scanned - _MARKER_OVERLAP)))
+        return content
+
+def stream_get(
+    url: str,
+    proxy: str | None = None,
+    *,
+    headers: dict | None = None,
+    timeout: float | tuple | None = None,
+    max_bytes: int | None = MAX_BODY_BYTES,
+) -> Page:
+    """
+    Потоковый GET через session_pool. Страница лимита, отказа или антибота обрывает
+    загрузку после первых HEAD_BYTES, тело больше max_bytes — ResponseTooLarge.
+    timeout=None — адаптивная пара (connect, read) из adaptive_timeouts.
+    Удачные ответы пополняют статистику задержек прокси и зеркала.
+    """
+    if timeout is None:
+        timeout = adaptive_timeouts.timeout(proxy, url, DEFAULT_TIMEOUT)
+    aborted = None
+    started = time.monotonic()
+    mirror_router.started(url)
+    try:
+        with session_pool.session(proxy, url) as session:
+            with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+                first_byte = time.monotonic() - started
+                quota_ledger.count(url)
+                try:
+                    reader = _BodyReader(url, max_bytes, response.headers.get("Content-Length"))
+                    for chunk in response.iter_content(_CHUNK_SIZE):
+                        reader.feed(chunk)
+                except (PageBlocked, FetchAborted) as e:
+                    # Недочитанное соединение закроется вместе с ответом, сама сессия исправна
+                    aborted = e
+                else:
+                    content = reader.finish()
+                    encoding = _page_encoding(response.headers.get("Content-Type"), content)
+                    page = Page(url, response.status_code, content, encoding, response.headers, response.url)
+    except Exception as e:
+        _record_request(url, proxy, _request_outcome(e), time.monotonic() - started)
+        raise
+    elapsed = time.monotonic() - started
+    if aborted is not None:
+        _record_request(url, proxy, _request_outcome(aborted), elapsed)
+        _report_aborted(url, proxy, aborted)
+        raise aborted
+    _record_request(url, proxy, "ok" if page.status < 400 else f"http_{page.status}", elapsed, len(page.content))
+    if page.status < 500 and page.status != 429:
+        adaptive_timeouts.observe(proxy, url, first_byte, elapsed)
+    return page
+
+def _report_aborted(url: str, proxy: str | None, error: Exception):
+    """
+    Страница лимита или отказа доступа — обычная ошибка зеркала: такие страницы часто
+    касаются одного прокси. Цепь открывается, только когда их видели разные источники
+    (лимит считает quota_ledger, отказ доступа — mirror_router).
+    """
+    if isinstance(error, MirrorUnavailable):
+        mirror_router.report(url, False, blocked=quota_ledger.report_limit(url, proxy))
+    elif isinstance(error, PageBlocked) and error.kind == "access_denied":
+        mirror_router.report_blocked(url, proxy)
+
+def _request_timeout(proxy: str | None, url: str, default: float, budget: "RetryBudget | None") -> tuple[float, float]:
+    timeout = adaptive_timeouts.timeout(proxy, url, default)
+    return budget.timeout(timeout) if budget else timeout
+
+# Страницы нет — через другой прокси её тоже не будет
+_MISSING_STATUSES = (404, 410)
+
+class PageMissing(RuntimeError):
+    """Сервер ответил 404/410."""
+
+def _inspect_page(page: Page, started: float):
+    """Проверить статус ответа (маркеры уже проверены при чтении) и сообщить результат в mirror_router."""
+    if page.status >= 500 or page.status == 429:
+        mirror_router.report(page.url, False)
+        raise RuntimeError(f"HTTP {page.status}")
+    mirror_router.report(page.url, True, time.monotonic() - started)
+    if page.status in _MISSING_STATUSES:
+        raise PageMissing(f"HTTP {page.status}")
+    if page.status >= 400:
+        raise RuntimeError(f"HTTP {page.status}")
+
+def _cache_response(
+    url: str,
+    headers: dict | None,
+    page: Page,
+    cached: CachedResponse | None,
+    cache_ttl: float | None,
+) -> Page:
+    """304 — страница из кеша, успешный ответ при cache_ttl — сохранить в кеш."""
+    if page.status == 304 and cached is not None:
+        response_cache.refresh(cached)
+        return cached.page()
+    if cache_ttl:
+        response_cache.put(
+            url, headers, page.content, page.encoding,
+            page.headers.get("ETag"), page.headers.get("Last-Modified"),
+        )
+    return page
+
+def _reroute(url: str, logger: Callable[[str], None] | None) -> str | None:
+    """Тот же URL на другом зеркале, не открытом и не исчерпавшем лимит, либо None."""
+    mirror = mirror_of(url)
+    target = mirror_router.pick(exclude={mirror}) if mirror is not None else None
+    if target is None:
+        if logger:
+            logger(f"[ЗЕРКАЛО] ⏭️ Дневной лимит исчерпан, другого зеркала нет, пропуск: {url}")
+        return None
+    if logger:
+        logger(f"[ЗЕРКАЛО] 🔀 Лимит {mirror}, переходим на {target}: {url}")
+    return with_mirror(url, target)
+
+@_coalesced
+@_metered
+def fetch_page_with_proxies(
+    url: str,
+    proxies: "ProxyPool | RemoteProxyPool | list[str]",
+    working: list[str] | None = None,
+    *,
+    headers: dict | None = None,
+    retries: int = 3,
+    timeout: int = 10,
+    logger: Callable[[str], None] | None = None,
+    reload_proxies: "Callable[[], list[str]] | ProxyReplenisher | None" = None,
+    cache_ttl: float | None = None,
+    max_bytes: int | None = MAX_BODY_BYTES,
+    budget: RetryBudget | None = None,
+    routing: RoutingPolicy | None = None,
+) -> Tuple[Page | None, str | None]:
+    """
+    Загружает страницу (Page — байты и кодировка) с использованием пула прокси и защитой от антибота.
+    Принимает ProxyPool / RemoteProxyPool (рекомендуется) или обычный список — во втором случае
+    неудачные прокси, как и раньше, удаляются из списка.
+    При cache_ttl ответ берётся из response_cache (свежий — без сети, устаревший —
+    условным GET) и сохраняется в него; прокси в этом случае — None.
+    Тело читается потоково (см. stream_get) и ограничено max_bytes.
+    budget ограничивает общее число запросов и время (см. RetryBudget).
+    timeout — таймаут по умолчанию, пока adaptive_timeouts не накопит замеров
+    для прокси и зеркала; дальше connect и read подбираются по их задержкам.
+    routing (по умолчанию default_routing) решает, идти к хосту через прокси или
+    напрямую; при прямом маршруте прокси пробуются, только если прямой запрос не удался.
+    Сторонний сайт (не зеркало) пробуется не больше чем через THIRD_PARTY_PROXY_ATTEMPTS
+    прокси, а его ошибки не остужают прокси и не пишутся в proxy_registry.
+    Зеркало с исчерпанным дневным лимитом заменяется другим через mirror_router.
+    """
+    cached = response_cache.get(url, headers) if cache_ttl else None
+    if cached is not None and cached.is_fresh(cache_ttl):
+        return cached.page(), None
+    request_headers = cached.conditional_headers(headers) if cached else headers
+
+    if quota_ledger.is_exhausted(url):
+        url = _reroute(url, logger)
+        if url is None:
+            return None, None
+
+    legacy_list = proxies if isinstance(proxies, list) else None
+    pool = _pool_for_list(proxies) if legacy_list is not None else proxies
+    working = working if working is not None else []
+    replenisher = _replenisher_for(proxies, reload_proxies, logger)
+    if replenisher is not None:
+        replenisher.poke()
+    routing = routing or default_routing
+    third_party = mirror_of(url) is None
+    if third_party and routing.is_down(url):
+        if logger:
+            logger(f"[САЙТ] ⏭️ Хост недоступен ни напрямую, ни через прокси, пропуск: {url}")
+        return None, None
+    proxy_attempts = THIRD_PARTY_PROXY_ATTEMPTS
+
+    for attempt in range(1, retries + 1):
+        # 🚦 Хост ходит напрямую (keep-alive из session_pool) — прокси только запасной путь
+        direct = routing.route(url) == DIRECT
+        if direct:
+            if _budget_spent(budget, url, logger):
+                return None, None
+            started = time.monotonic()
+            try:
+                page = stream_get(
+                    url, headers=request_headers,
+                    timeout=_request_timeout(None, url, timeout, budget), max_bytes=max_bytes,
+                )
+                _inspect_page(page, started)
+                routing.report(url, True)
+                return _cache_response(url, headers, page, cached, cache_ttl), None
+            except MirrorUnavailable:
+                url = _reroute(url, logger)
+                if url is None:
+                    return None, None
+                continue
+            except FetchAborted as e:
+                if logger:
+                    logger(f"[ЗЕРКАЛО] {url} — {e}")
+                return None, None
+            except PageMissing as e:
+                routing.report(url, True)
+                if logger:
+                    logger(f"[НАПРЯМУЮ] {e}: {url}")
+                return None, None
+            except Exception as e:
+                routing.report(url, False)
+                if logger:
+                    logger(f"[НАПРЯМУЮ] Попытка {attempt} не удалась, пробуем через прокси: {e}")
+
+        tried: set[str] = set()
+        for _ in range(len(pool)):
+            if third_party and proxy_attempts <= 0:
+                break
+            proxy = pool.lease()
+            if proxy is None:
+                break
+            if proxy in tried:
+                pool.release(proxy)
+                continue
+            tried.add(proxy)
+            if _budget_spent(budget, url, logger):
+                pool.release(proxy)
+                return None, None
+            proxy_attempts -= 1
+            started = time.monotonic()
+            try:
+                page = stream_get(
+                    url, proxy, headers=request_headers,
+                    timeout=_request_timeout(proxy, url, timeout, budget), max_bytes=max_bytes,
+                )
+                _inspect_page(page, started)
+                elapsed = time.monotonic() - started
+                pool.release(proxy, ok=True, latency=elapsed)
+                if third_party:
+                    routing.report_proxied(url, True)
+                else:
+                    proxy_registry.record(proxy, url, True, elapsed)
+                with proxy_lock:
+                    if proxy not in working:
+                        working.append(proxy)
+                return _cache_response(url, headers, page, cached, cache_ttl), proxy
+            except MirrorUnavailable:
+                # Страница лимита бывает и лимитом самого прокси: он остывает, а следующий
+                # прокси идёт уже на другое зеркало
+                pool.release(proxy, ok=False, latency=time.monotonic() - started)
+                url = _reroute(url, logger)
+                if url is None:
+                    return None, None
+            except FetchAborted as e:
+                pool.release(proxy, ok=True, latency=time.monotonic() - started)
+                if logger:
+                    logger(f"[ЗЕРКАЛО] {url} — {e}")
+                return None, None
+            except Exception as e:
+                if logger:
+                    logger(f"[ПРОКСИ ОШИБКА] {proxy} — {e}")
+                if third_party:
+                    # Лежит, скорее всего, сам сайт — прокси не остужаем
+                    pool.release(proxy)
+                    routing.report_proxied(url, False)
+                    continue
+                pool.release(proxy, ok=False, latency=time.monotonic() - started)
+                proxy_registry.record(proxy, url, False)
+                if legacy_list is not None:
+                    with proxy_lock:
+                        if proxy in legacy_list:
+                            legacy_list.remove(proxy)
+                            pool.remove(proxy)
+
+        # 🔋 Прокси на исходе — пополнение идёт в фоне, эта загрузка его не ждёт
+        if replenisher is not None:
+            replenisher.poke()
+
+        # 📡 Последняя попытка — без прокси (при прямом маршруте она уже была)
+        if direct:
+            continue
+        if _budget_spent(budget, url, logger):
+            return None, None
+        try:
+            if logger:
+                logger(f"[ПОПЫТКА {attempt}] Пробуем загрузить без прокси...")
+            started = time.monotonic()
+            page = stream_get(
+                url, headers=request_headers,
+                timeout=_request_timeout(None, url, timeout, budget), max_bytes=max_bytes,
+            )
+            _inspect_page(page, started)
+            return _cache_response(url, headers, page, cached, cache_ttl), None
+        except MirrorUnavailable:
+            url = _reroute(url, logger)
+            if url is None:
+                return None, None
+        except FetchAborted as e:
+            if logger:
+                logger(f"[ЗЕРКАЛО] {url} — {e}")
+            return None, None
+        except Exception as e:
+            if logger:
+                logger(f"[ОШИБКА] Попытка {attempt} без прокси не удалась: {e}")
+
+    if logger:
+        logger(f"[ОШИБКА] ❌ Все попытки загрузки неудачны: {url}")
+    return None, None
+
+def fetch_with_proxies(
+    url: str,
+    proxies: "ProxyPool | RemoteProxyPool | list[str]",
+    working: list[str] | None = None,
+    **kwargs,
+) -> Tuple[str | None, str | None]:
+    """fetch_page_with_proxies, возвращающий текст (для кода, которому нужна строка)."""
+    page, proxy = fetch_page_with_proxies(url, proxies, working, **kwargs)
+    return (page.text if page is not None else None), proxy
+
+
+class AsyncSessionPool:
+    """
+    Пул aiohttp-сессий (по одной на прокси) для одного event loop.
+    Закрываются только простаивающие сессии: сверх max_sessions (LRU) или старше idle_ttl.
+    """
+
+    def __init__(self, max_sessions: int = 2048, idle_ttl: float = 90.0, limit_per_host: int = 32):
+        if aiohttp is None:
+            raise ImportError("Для асинхронного режима установите aiohttp и aiohttp-socks")
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.limit_per_host = limit_per_host
+        # прокси -> [сессия, число пользователей, время последнего использования]
+        self._sessions: OrderedDict[str | None, list] = OrderedDict()
+
+    @asynccontextmanager
+    async def session(self, proxy: str | None):
+        entry = self._sessions.get(proxy)
+        if entry is None or entry[0].closed:
+            entry = [self._create(proxy), 0, 0.0]
+            self._sessions[proxy] = entry
+        self._sessions.move_to_end(proxy)
+        entry[1] += 1
+        try:
+            yield entry[0]
+        finally:
+            entry[1] -= 1
+            entry[2] = time.monotonic()
+            await self._evict()
+
+    async def close(self):
+        sessions = [entry[0] for entry in self._sessions.values()]
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+
+    def _create(self, proxy: str | None) -> "aiohttp.ClientSession":
+        if proxy:
+            connector = ProxyConnector.from_url(
+                f"socks5://{proxy}", rdns=True, limit_per_host=self.limit_per_host
+            )
+        else:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.limit_per_host)
+        return aiohttp.ClientSession(connector=connector)
+
+    async def _evict(self):
+        now = time.monotonic()
+        for proxy in list(self._sessions):
+            session, users, last_used = self._sessions[proxy]
+            over_limit = len(self._sessions) > self.max_sessions
+            if not over_limit and now - last_used < self.idle_ttl:
+                break
+            if users == 0:
+                del self._sessions[proxy]
+                await session.close()
+
+_async_session_pools: "WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncSessionPool]" = WeakKeyDictionary()
+
+def _get_async_session_pool() -> AsyncSessionPool:
+    loop = asyncio.get_running_loop()
+    pool = _async_session_pools.get(loop)
+    if pool is None:
+        pool = _async_session_pools[loop] = AsyncSessionPool()
+    return pool
+
+# Кеш на диске, SQLite и сокет демона блокируют — из корутин они вызываются в потоках.
+# RPC к демону идут через один поток: аренда и возврат прокси — в одном соединении
+_daemon_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="proxy-daemon")
+
+async def _pool_call(pool: "ProxyPool | RemoteProxyPool", method: str, *args, **kwargs):
+    """Вызов метода пула прокси из корутины: ProxyPool — на месте, RemoteProxyPool — в потоке."""
+    fn = getattr(pool, method)
+    if not isinstance(pool, RemoteProxyPool):
+        return fn(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_daemon_executor, partial(fn, *args, **kwargs))
+
+async def _async_get_page(
+    url: str,
+    proxy: str | None,
+    headers: dict | None,
+    timeout: tuple[float, float],
+    session_pool: AsyncSessionPool,
+    cached: CachedResponse | None = None,
+    cache_ttl: float | None = None,
+    max_bytes: int | None = MAX_BODY_BYTES,
+) -> Page:
+    started = time.monotonic()
+    request_headers = cached.conditional_headers(headers) if cached else headers
+    connect, read = timeout
+    mirror_router.started(url)
+    try:
+        async with session_pool.session(proxy) as session:
+            async with session.get(
+                url, headers=request_headers,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read),
+            ) as response:
+                first_byte = time.monotonic() - started
+                await asyncio.to_thread(quota_ledger.count, url)
+                reader = _BodyReader(url, max_bytes, response.headers.get("Content-Length"))
+                async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
+                    reader.feed(chunk)
+                content = reader.finish()
+                encoding = _page_encoding(response.headers.get("Content-Type"), content)
+                page = Page(url, response.status, content, encoding, response.headers, str(response.url))
+    except Exception as e:
+        _record_request(url, proxy, _request_outcome(e), time.monotonic() - started)
+        if isinstance(e, (MirrorUnavailable, PageBlocked)):
+            await asyncio.to_thread(_report_aborted, url, proxy, e)
+        raise
+    elapsed = time.monotonic() - started
+    _record_request(url, proxy, "ok" if page.status < 400 else f"http_{page.status}", elapsed, len(page.content))
+    if page.status < 500 and page.status != 429:
+        adaptive_timeouts.observe(proxy, url, first_byte, elapsed)
+    _inspect_page(page, started)
+    if cached is None and not cache_ttl:
+        return page
+    return await asyncio.to_thread(_cache_response, url, headers, page, cached, cache_ttl)
+
+@_coalesced_async
+@_metered_async
+async def fetch_page_with_proxies_async(
+    url: str,
+    proxies: "ProxyPool | RemoteProxyPool",
+    working: list[str] | None = None,
+    *,
+    headers: dict | None = None,
+    retries: int = 3,
+    timeout: int = 10,
+    logger: Callable[[str], None] | None = None,
+    reload_proxies: "Callable[[], list[str]] | ProxyReplenisher | None" = None,
+    session_pool: AsyncSessionPool | None = None,
+    cache_ttl: float | None = None,
+    max_bytes: int | None = MAX_BODY_BYTES,
+    budget: RetryBudget | None = None,
+    routing: RoutingPolicy | None = None,
+) -> Tuple[Page | None, str | None]:
+    """
+    Асинхронный аналог fetch_page_with_proxies (aiohttp + SOCKS5) с той же семантикой:
+    защита от антибота, повторы, cooldown неудачных прокси, попытка без прокси, кеш,
+    бюджет и маршрутизация. Кеш, SQLite-учёт и демон прокси вызываются в потоках,
+    чтобы не останавливать event loop.
+    """
+    cached = await asyncio.to_thread(response_cache.get, url, headers) if cache_ttl else None
+    if cached is not None and cached.is_fresh(cache_ttl):
+        return cached.page(), None
+
+    if await asyncio.to_thread(quota_ledger.is_exhausted, url):
+        url = await asyncio.to_thread(_reroute, url, logger)
+        if url is None:
+            return None, None
+
+    session_pool = session_pool or _get_async_session_pool()
+    working = working if working is not None else []
+    replenisher = _replenisher_for(proxies, reload_proxies, logger)
+    if replenisher is not None:
+        replenisher.poke()
+    routing = routing or default_routing
+    third_party = mirror_of(url) is None
+    if third_party and routing.is_down(url):
+        if logger:
+            logger(f"[САЙТ] ⏭️ Хост недоступен ни напрямую, ни через прокси, пропуск: {url}")
+        return None, None
+    proxy_attempts = THIRD_PARTY_PROXY_ATTEMPTS
+
+    for attempt in range(1, retries + 1):
+        # 🚦 Хост ходит напрямую — прокси только запасной путь
+        direct = routing.route(url) == DIRECT
+        if direct:
+            if _budget_spent(budget, url, logger):
+                return None, None
+            try:
+                page = await _async_get_page(
+                    url, None, headers, _request_timeout(None, url, timeout, budget),
+                    session_pool, cached, cache_ttl, max_bytes,
+                )
+                routing.report(url, True)
+                return page, None
+            except MirrorUnavailable:
+                url = await asyncio.to_thread(_reroute, url, logger)
+                if url is None:
+                    return None, None
+                continue
+            except FetchAborted as e:
+                if logger:
+                    logger(f"[ЗЕРКАЛО] {url} — {e}")
+                return None, None
+            except PageMissing as e:
+                routing.report(url, True)
+                if logger:
+                    logger(f"[НАПРЯМУЮ] {e}: {url}")
+                return None, None
+            except Exception as e:
+                routing.report(url, False)
+                if logger:
+                    logger(f"[НАПРЯМУЮ] Попытка {attempt} не удалась, пробуем через прокси: {e!r}")
+
+        tried: set[str] = set()
+        for _ in range(await _pool_call(proxies, "__len__")):
+            if third_party and proxy_attempts <= 0:
+                break
+            proxy = await _pool_call(proxies, "lease")
+            if proxy is None:
+                break
+            if proxy in tried:
+                await _pool_call(proxies, "release", proxy)
+                continue
+            tried.add(proxy)
+            if _budget_spent(budget, url, logger):
+                await _pool_call(proxies, "release", proxy)
+                return None, None
+            proxy_attempts -= 1
+            started = time.monotonic()
+            try:
+                page = await _async_get_page(
+                    url, proxy, headers, _request_timeout(proxy, url, timeout, budget),
+                    session_pool, cached, cache_ttl, max_bytes,
+                )
+                elapsed = time.monotonic() - started
+                await _pool_call(proxies, "release", proxy, ok=True, latency=elapsed)
+                if third_party:
+                    routing.report_proxied(url, True)
+                else:
+                    await asyncio.to_thread(proxy_registry.record, proxy, url, True, elapsed)
+                if proxy not in working:
+                    working.append(proxy)
+                return page, proxy
+            except MirrorUnavailable:
+                # Страница лимита бывает и лимитом самого прокси (см. fetch_page_with_proxies)
+                await _pool_call(proxies, "release", proxy, ok=False, latency=time.monotonic() - started)
+                url = await asyncio.to_thread(_reroute, url, logger)
+                if url is None:
+                    return None, None
+            except FetchAborted as e:
+                await _pool_call(proxies, "release", proxy, ok=True, latency=time.monotonic() - started)
+                if logger:
+                    logger(f"[ЗЕРКАЛО] {url} — {e}")
+                return None, None
+            except Exception as e:
+                if logger:
+                    logger(f"[ПРОКСИ ОШИБКА] {proxy} — {e!r}")
+                if third_party:
+                    # Лежит, скорее всего, сам сайт — прокси не остужаем
+                    await _pool_call(proxies, "release", proxy)
+                    routing.report_proxied(url, False)
+                    continue
+                await _pool_call(proxies, "release", proxy, ok=False, latency=time.monotonic() - started)
+                await asyncio.to_thread(proxy_registry.record, proxy, url, False)
+
+        # 🔋 Прокси на исходе — пополнение идёт в фоне, эта загрузка его не ждёт
+        if replenisher is not None:
+            replenisher.poke()
+
+        # 📡 Последняя попытка — без прокси (при прямом маршруте она уже была)
+        if direct:
+            continue
+        if _budget_spent(budget, url, logger):
+            return None, None
+        try:
+            if logger:
+                logger(f"[ПОПЫТКА {attempt}] Пробуем загрузить без прокси...")
+            page = await _async_get_page(
+                url, None, headers, _request_timeout(None, url, timeout, budget),
+                session_pool, cached, cache_ttl, max_bytes,
+            )
+            return page, None
+        except MirrorUnavailable:
+            url = await asyncio.to_thread(_reroute, url, logger)
+            if url is None:
+                return None, None
+        except FetchAborted as e:
+            if logger:
+                logger(f"[ЗЕРКАЛО] {url} — {e}")
+            return None, None
+        except Exception as e:
+            if logger:
+                logger(f"[ОШИБКА] Попытка {attempt} без прокси не удалась: {e!r}")
+
+    if logger:
+        logger(f"[ОШИБКА] ❌ Все попытки загрузки неудачны: {url}")
+    return None, None
+
+async def fetch_with_proxies_async(
+    url: str,
+    proxies: "ProxyPool | RemoteProxyPool",
+    working: list[str] | None = None,
+    **kwargs,
+) -> Tuple[str | None, str | None]:
+    """fetch_page_with_proxies_async, возвращающий текст."""
+    page, proxy = await fetch_page_with_proxies_async(url, proxies, working, **kwargs)
+    return (page.text if page is not None else None), proxy
+
+class RetryLater(Exception):
+    """
+    Задачу стоит повторить позже: run_bounded вернёт её в очередь с задержкой, а поток
+    займётся другими задачами. delay — своя задержка вместо экспоненциальной.
+    """
+
+    def __init__(self, message: str = "", *, delay: float | None = None):
+        super().__init__(message)
+        self.delay = delay
+
+def _retry_delay(attempt: int, backoff: float, max_delay: float) -> float:
+    # Экспонента с полным джиттером: повторы разных задач не сходятся в одну секунду
+    return random.uniform(0, min(max_delay, backoff * 2 ** (attempt - 1)))
+
+def run_bounded(
+    worker: Callable,
+    items: Iterable,
+    *,
+    max_workers: int,
+    window: int | None = None,
+    retries: int = 0,
+    backoff: float = 1.0,
+    max_delay: float = 300.0,
+    on_retry: Callable[[object, int, float, Exception], None] | None = None,
+    name: str = "",
+    concurrency: "AdaptiveConcurrency | None" = None,
+) -> Iterator[tuple[object, object]]:
+    """
+    Потоковый аналог gather_bounded: worker(item) в пуле из max_workers потоков, в работе
+    не больше window задач (по умолчанию 2 × max_workers). С concurrency окно следует за
+    его текущим лимитом: ThreadPoolExecutor заводит потоки только под отправленные задачи,
+    поэтому потоков столько, сколько задач реально в работе, а не max_workers. items читаются лениво, пары
+    (item, результат) отдаются по мере готовности; исключение worker приходит как результат.
+    Память не растёт с числом задач — в отличие от submit() для всего списка сразу.
+
+    Если worker бросает RetryLater, задача до retries раз возвращается в очередь отложенных
+    (экспонента от backoff с джиттером, не больше max_delay) — поток не спит, а берёт
+    следующую задачу. on_retry(item, попытка, задержка, исключение) вызывается при каждом
+    откладывании; после последней попытки результатом становится само RetryLater.
+    name — метка этапа в metrics (zapo_tasks_total, zapo_tasks_inflight).
+    """
+    window = max(1, window or 2 * max_workers)
+    iterator = iter(items)
+    pending: dict[Future, tuple[object, int]] = {}
+    # (когда запустить, порядковый номер, item, номер попытки)
+    delayed: list[tuple[float, int, object, int]] = []
+    order = count()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def refill():
+            # Сначала подошедшие повторы, затем новые задачи
+            limit = min(window, concurrency.limit) if concurrency is not None else window
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now and len(pending) < limit:
+                _, _, item, attempt = heapq.heappop(delayed)
+                pending[executor.submit(worker, item)] = (item, attempt)
+            for item in islice(iterator, max(0, limit - len(pending))):
+                pending[executor.submit(worker, item)] = (item, 1)
+            metrics.set("zapo_tasks_inflight", len(pending), name=name)
+
+        refill()
+        while pending or delayed:
+            timeout = max(0.0, delayed[0][0] - time.monotonic()) if delayed else None
+            if pending:
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(timeout)
+                done = set()
+            for future in done:
+                item, attempt = pending.pop(future)
+                try:
+                    result = future.result()
+                except RetryLater as e:
+                    if attempt <= retries:
+                        delay = e.delay if e.delay is not None else _retry_delay(attempt, backoff, max_delay)
+                        heapq.heappush(delayed, (time.monotonic() + delay, next(order), item, attempt + 1))
+                        metrics.inc("zapo_tasks_total", name=name, result="retried")
+                        if on_retry:
+                            on_retry(item, attempt, delay, e)
+                        continue
+                    result = e
+                except Exception as e:
+                    result = e
+                metrics.inc("zapo_tasks_total", name=name, result="error" if isinstance(result, Exception) else "done")
+                yield item, result
+            refill()
+
+def run_per_host(
+    worker: Callable,
+    items: Iterable,
+    *,
+    host: Callable[[object], str],
+    max_workers: int,
+    per_host: int = 1,
+    min_interval: float = 0.0,
+    lookahead: int | None = None,
+    name: str = "",
+) -> Iterator[tuple[object, object]]:
+    """
+    Как run_bounded, но с учётом хоста задачи host(item): к одному хосту одновременно не
+    больше per_host задач и старт не чаще раза в min_interval секунд, всего — не больше
+    max_workers. Задачи занятых хостов ждут в очереди, а потоки берут задачи свободных
+    хостов (по кругу). Из items заранее читается не больше lookahead задач (по
+    умолчанию 8 × max_workers). name — метка этапа в metrics.
+    """
+    lookahead = max(1, lookahead or 8 * max_workers)
+    iterator = iter(items)
+    exhausted = False
+    queues: dict[str, deque] = {}
+    # Хосты, у которых есть задачи в очереди, — по одному разу, в порядке обхода
+    ready: deque[str] = deque()
+    busy: dict[str, int] = {}
+    next_start: dict[str, float] = {}
+    buffered = 0
+    pending: dict[Future, tuple[object, str]] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def read_ahead():
+            nonlocal exhausted, buffered
+            while not exhausted and buffered < lookahead:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                key = host(item)
+                if key not in queues:
+                    queues[key] = deque()
+                    ready.append(key)
+                queues[key].append(item)
+                buffered += 1
+
+        def dispatch() -> float | None:
+            """Запустить всё, что можно; вернуть момент, когда освободится хост с паузой."""
+            nonlocal buffered
+            now = time.monotonic()
+            wake_at = None
+            for _ in range(len(ready)):
+                if len(pending) >= max_workers:
+                    break
+                key = ready.popleft()
+                if busy.get(key, 0) >= per_host:
+                    ready.append(key)
+                    continue
+                start = next_start.get(key, 0.0)
+                if start > now:
+                    ready.append(key)
+                    wake_at = start if wake_at is None else min(wake_at, start)
+                    continue
+                item = queues[key].popleft()
+                buffered -= 1
+                busy[key] = busy.get(key, 0) + 1
+                if min_interval:
+                    next_start[key] = now + min_interval
+                pending[executor.submit(worker, item)] = (item, key)
+                if queues[key]:
+                    ready.append(key)
+                else:
+                    del queues[key]
+            return wake_at
+
+        read_ahead()
+        wake_at = dispatch()
+        while pending or queues:
+            timeout = max(0.0, wake_at - time.monotonic()) if wake_at is not None else None
+            if pending:
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(timeout if timeout is not None else 0.01)
+                done = set()
+            for future in done:
+                item, key = pending.pop(future)
+                busy[key] -= 1
+                if not busy[key]:
+                    del busy[key]
+                    if key not in queues and next_start.get(key, 0.0) <= time.monotonic():
+                        next_start.pop(key, None)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+                metrics.inc("zapo_tasks_total", name=name, result="error" if isinstance(result, Exception) else "done")
+                yield item, result
+            read_ahead()
+            wake_at = dispatch()
+            metrics.set("zapo_tasks_inflight", len(pending), name=name)
+
+async def gather_bounded(
+    worker: Callable,
+    items: Iterable,
+    *,
+    concurrency: int = 10_000,
+    on_done: Callable[[object, object], None] | None = None,
+    retries: int = 0,
+    backoff: float = 1.0,
+    max_delay: float = 300.0,
+    on_retry: Callable[[object, int, float, Exception], None] | None = None,
+):
+    """
+    Выполнить корутину worker(item) для всех items не более чем concurrency одновременно.
+    Задачи берутся из итератора лениво; on_done(item, результат) вызывается после каждой,
+    исключение worker приходит как результат. По окончании закрываются aiohttp-сессии
+    текущего event loop.
+
+    RetryLater обрабатывается как в run_bounded: задача до retries раз откладывается
+    с задержкой, а её место занимает следующая; после последней попытки результатом
+    становится само RetryLater.
+    """
+    iterator = iter(items)
+    # (когда запустить, порядковый номер, item, номер попытки)
+    delayed: list[tuple[float, int, object, int]] = []
+    order = count()
+    exhausted = False
+    waiting = 0  # воркеры, ждущие повторов
+
+    def next_job():
+        nonlocal exhausted
+        if delayed and delayed[0][0] <= time.monotonic():
+            return heapq.heappop(delayed)[2:]
+        if not exhausted:
+            for item in iterator:
+                return item, 1
+            exhausted = True
+        return None
+
+    async def run_worker():
+        nonlocal waiting
+        while True:
+            job = next_job()
+            if job is None:
+                # Новых задач нет — повторы ждут не больше воркеров, чем самих повторов
+                if waiting >= len(delayed):
+                    return
+                waiting += 1
+                try:
+                    await asyncio.sleep(max(0.0, delayed[0][0] - time.monotonic()))
+                finally:
+                    waiting -= 1
+                continue
+            item, attempt = job
+            try:
+                result = await worker(item)
+            except RetryLater as e:
+                if attempt <= retries:
+                    delay = e.delay if e.delay is not None else _retry_delay(attempt, backoff, max_delay)
+                    heapq.heappush(delayed, (time.monotonic() + delay, next(order), item, attempt + 1))
+                    if on_retry:
+                        on_retry(item, attempt, delay, e)
+                    continue
+                result = e
+            except Exception as e:
+                result = e
+            if on_done:
+                on_done(item, result)
+
+    try:
+        await asyncio.gather(*(run_worker() for _ in range(max(1, concurrency))))
+    finally:
+        pool = _async_session_pools.pop(asyncio.get_running_loop(), None)
+        if pool:
+            await pool.close()
+
+async def check_proxies_async(
+    proxies: Iterable[str],
+    targets: Iterable[str] | None = None,
+    *,
+    concurrency: int = 2000,
+    timeout: float = 5,
+    registry: ProxyRegistry | None = None,
+) -> list[str]:
+    """
+    Асинхронно проверить прокси на реальных зеркалах (по умолчанию все MIRRORS).
+    Каждый исход пишется в реестр, ответившие запросы — в quota_ledger; запись идёт
+    пачками в отдельном потоке, не на event loop. Возвращаются прокси, открывшие хотя
+    бы одно зеркало, упорядоченные по числу открытых зеркал и задержке.
+    """
+    registry = registry or proxy_registry
+    proxies = list(dict.fromkeys(proxies))
+    targets = list(targets or MIRRORS)
+    results: dict[str, list[float]] = {}
+    session_pool = AsyncSessionPool(max_sessions=concurrency)
+    # (прокси, зеркало, успех, задержка, ответило ли зеркало)
+    outcomes: list[tuple[str, str, bool, float | None, bool]] = []
+
+    def write(batch: list):
+        for proxy, target, ok, latency, responded in batch:
+            registry.record(proxy, target, ok, latency)
+            if responded:
+                quota_ledger.count(target)
+
+    async def write_pending():
+        nonlocal outcomes
+        batch, outcomes = outcomes, []
+        if batch:
+            await asyncio.to_thread(write, batch)
+
+    async def probe(job: tuple[str, str]):
+        proxy, target = job
+        started = time.monotonic()
+        ok = responded = False
+        try:
+            connect, read = adaptive_timeouts.timeout(proxy, target, timeout)
+            async with session_pool.session(proxy) as session:
+                async with session.get(
+                    target,
+                    timeout=aiohttp.ClientTimeout(total=timeout, sock_connect=connect, sock_read=read),
+                ) as response:
+                    responded = True
+                    first_byte = time.monotonic() - started
+                    head = await response.content.read(HEAD_BYTES)
+                    ok = response.status < 400 and not _scan_markers(head)
+            if ok:
+                adaptive_timeouts.proxies.observe(proxy, first_byte)
+        except Exception:
+            ok = False
+        elapsed = time.monotonic() - started
+        outcomes.append((proxy, target, ok, elapsed if ok else None, responded))
+        if len(outcomes) >= registry.flush_every:
+            await write_pending()
+        if ok:
+            results.setdefault(proxy, []).append(elapsed)
+
+    jobs = ((proxy, target) for proxy in proxies for target in targets)
+    try:
+        await gather_bounded(probe, jobs, concurrency=concurrency)
+    finally:
+        await session_pool.close()
+        await write_pending()
+        await asyncio.to_thread(registry.flush)
+
+    return sorted(results, key=lambda p: (-len(results[p]), sum(results[p]) / len(results[p])))
+
+# 🔬 Профилирование — в profiling.py; здесь к нему добавлен запуск экспорта метрик
+def profile_main(main: Callable, name: str | None = None, logger: Callable[[str], None] | None = None):
+    """profiling.profile_main, перед запуском включающий экспорт метрик (ошибки — в logger)."""
+    metrics.start_from_env(logger)
+    return _profile_main(main, name, logger)